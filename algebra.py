@@ -1,16 +1,35 @@
-from utils import gen_prime, randint
-import numpy as np
-import sympy
+import json
+import os
+import tempfile
+
+from utils import gen_safe_prime, is_prime, prime_factors, randint
 
 PRIME_BITS=64
+GROUP_CACHE_ENV="GC_GROUP_CACHE" # overrides the path of the parameter cache
+FIXED_BASE_WINDOW=8 # bits of exponent per lookup in the generator table
 
 class PrimeCyclicGroup:
-    """Cyclic abelian group of prime order 'prime'."""
-    def __init__(self, prime=None):
-        self.prime = prime or gen_prime(num_bits=PRIME_BITS)
+    """Cyclic abelian group of prime order 'prime'.
+
+    Without a prime, the cached parameters of a PRIME_BITS safe prime are used. With
+    an 'order', a prime dividing p-1, the generator spans the subgroup of that order.
+    """
+    def __init__(self, prime=None, generator=None, order=None):
+        if prime is None:
+            prime, generator = cached_parameters(PRIME_BITS)
+        self.prime = prime
         self.prime_m1 = self.prime - 1
         self.prime_m2 = self.prime - 2
-        self.generator = self.find_generator()
+        self.order = self.prime_m1 if order is None else order
+        if order is not None:
+            if generator is None or self.prime_m1 % order or not is_prime(order) or generator in (0, 1) or self.pow(generator, order) != 1:
+                raise ValueError(f"{generator} does not generate a subgroup of prime order {order} mod {prime}")
+        elif generator is None:
+            generator = self.find_generator()
+        elif not self.is_generator(generator):
+            raise ValueError(f"{generator} does not generate the group of {prime}")
+        self.generator = generator
+        self.gen_table = None  # built on the first generator exponentiation
 
 
     def add(self, a:int, b:int):
@@ -27,7 +46,67 @@ class PrimeCyclicGroup:
 
     def gen_pow(self, exponent):  # generator exponentiation
         "Compute nth power of a generator." ""
-        return pow(self.generator, exponent, self.prime)
+        if self.gen_table is None:
+            self.gen_table = self.build_gen_table()
+        exponent %= self.order
+        mask = (1 << FIXED_BASE_WINDOW) - 1
+        result = 1
+        for row in self.gen_table:
+            if not exponent:
+                break
+            result = result * row[exponent & mask] % self.prime
+            exponent >>= FIXED_BASE_WINDOW
+        return result
+
+    def gen_pow_many(self, exponents: list[int]) -> list[int]:
+        """Compute the powers of the generator for many exponents."""
+        return [self.gen_pow(exponent) for exponent in exponents]
+
+    def build_gen_table(self) -> list[list[int]]:
+        """Fixed-base window table, row i holds generator^(d * 2^(w*i)) for every digit d.
+
+        An exponentiation then costs one multiplication per w bits of the exponent instead
+        of a square and multiply per bit.
+        """
+        table = []
+        base = self.generator
+        for _ in range(-(-self.order.bit_length() // FIXED_BASE_WINDOW)):
+            row = [1]
+            for _ in range(1, 1 << FIXED_BASE_WINDOW):
+                row.append(row[-1] * base % self.prime)
+            table.append(row)
+            base = row[-1] * base % self.prime
+        return table
+
+    def multi_pow(self, bases: list[int], exponents: list[int]) -> int:
+        """Compute the product of bases[i]^exponents[i] with Pippenger's bucket method.
+
+        Exponents are read c bits at a time, the bases are added to the bucket of their
+        digit and the buckets are combined with running products, so each window costs
+        about n + 2^(c+1) multiplications for all the n bases together.
+        """
+        if len(bases) != len(exponents):
+            raise ValueError("As many bases as exponents are needed")
+        exponents = [exponent % self.prime_m1 for exponent in exponents]
+        bits = max(exponents, default=0).bit_length()
+        c = min(max(len(bases).bit_length() - 2, 2), 8)
+        mask = (1 << c) - 1
+        result = 1
+        for window in range(-(-bits // c) - 1, -1, -1):
+            for _ in range(c):
+                result = result * result % self.prime
+            buckets = [1] * (1 << c)
+            shift = window * c
+            for base, exponent in zip(bases, exponents):
+                digit = exponent >> shift & mask
+                if digit:
+                    buckets[digit] = buckets[digit] * base % self.prime
+            running = total = 1
+            for digit in range(mask, 0, -1):  # total = prod(bucket[d]^d)
+                running = running * buckets[digit] % self.prime
+                total = total * running % self.prime
+            result = result * total % self.prime
+        return result
 
     def inv(self, a:int):
         "Compute multiplicative inverse of an element." ""
@@ -37,16 +116,35 @@ class PrimeCyclicGroup:
             return pow(a, self.prime_m2, self.prime)
 
 
+    def inv_many(self, values: list[int]) -> list[int]:
+        """Invert many elements with a single inversion, see batch_inverse."""
+        return batch_inverse(values, self.prime)
+
     def polyeval(self,polynomial: list[int],  y: int):
-        return np.polyval(polynomial, y) % self.prime
+        "Evaluate a polynomial, highest degree coefficient first, with Horner's rule." ""
+        result = 0
+        for coefficient in polynomial:  # reduce at every step, np.polyval overflows int64
+            result = (result * y + coefficient) % self.prime
+        return result
 
     def rand_int(self):  # random int in [1, prime-1]
         "Return an random int in [1, prime - 1]." ""
         return randint(1, self.prime_m1)
 
+    def order_factors(self) -> list[int]:
+        """Distinct prime factors of the group order p-1, no factoring needed for safe primes."""
+        q = self.prime_m1 // 2
+        if self.prime > 3 and is_prime(q):
+            return sorted({2, q})
+        return prime_factors(self.prime_m1)
+
+    def is_generator(self, candidate: int) -> bool:
+        """A generator has no power p-1/f equal to 1 for any prime factor f of p-1."""
+        return 0 < candidate < self.prime and all(self.pow(candidate, self.prime_m1 // factor) != 1 for factor in self.order_factors())
+
     def find_generator(self) -> int:  # find random generator for group
         """Find a random generator for the group."""
-        factors = sympy.primefactors(self.prime_m1)
+        factors = self.order_factors()
 
         while True:
             candidate = self.rand_int()
@@ -55,4 +153,70 @@ class PrimeCyclicGroup:
                     break
             else:
                 return candidate
-    
+
+    @classmethod
+    def cached(cls, bits: int = PRIME_BITS) -> 'PrimeCyclicGroup':
+        """Group of a 'bits' safe prime, generated once and then read from the parameter cache."""
+        return cls(*cached_parameters(bits))
+
+
+def batch_inverse(values: list[int], prime: int) -> list[int]:
+    """Montgomery's trick: invert n non-zero elements with one inversion and 3(n-1) multiplications."""
+    prefix = [1]
+    for value in values:
+        prefix.append(prefix[-1] * value % prime)
+    if prefix[-1] == 0:
+        raise ValueError("0 has no inverse")
+    inverse = pow(prefix[-1], -1, prime)
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        inverses[i] = inverse * prefix[i] % prime
+        inverse = inverse * values[i] % prime
+    return inverses
+
+
+def cache_path() -> str:
+    """Path of the parameter cache, $GC_GROUP_CACHE or a file in the user cache directory."""
+    if GROUP_CACHE_ENV in os.environ:
+        return os.environ[GROUP_CACHE_ENV]
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "garbled-circuit", "groups.json")
+
+
+def valid_parameters(bits: int, prime: int, generator: int) -> bool:
+    """Check a cached entry: a safe prime of the right size and a generator of its group."""
+    q = (prime - 1) // 2
+    return (prime.bit_length() == bits and is_prime(prime) and is_prime(q)
+            and 0 < generator < prime and pow(generator, 2, prime) != 1 and pow(generator, q, prime) != 1)
+
+
+def cached_parameters(bits: int) -> tuple[int, int]:
+    """Return the (prime, generator) pair of the cache for 'bits', generating and storing it if needed.
+
+    Entries are validated when read, so a corrupt or edited cache is regenerated.
+    """
+    path = cache_path()
+    try:
+        with open(path) as file:
+            parameters = json.load(file)
+    except (OSError, ValueError):
+        parameters = {}
+    if not isinstance(parameters, dict):
+        parameters = {}
+    entry = parameters.get(str(bits))
+    if (isinstance(entry, list) and len(entry) == 2 and all(isinstance(value, int) for value in entry)
+            and valid_parameters(bits, *entry)):
+        return tuple(entry)
+
+    prime = gen_safe_prime(bits)
+    group = PrimeCyclicGroup(prime)
+    parameters[str(bits)] = [prime, group.generator]
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # write then rename, so concurrent processes never read a partial file
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path) or ".", delete=False) as file:
+            json.dump(parameters, file)
+        os.replace(file.name, path)
+    except OSError:
+        pass  # a read-only cache only costs the generation next time
+    return prime, group.generator
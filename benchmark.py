@@ -0,0 +1,234 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, NamedTuple
+
+from builder import CircuitBuilder
+from circuit import Circuit
+from garbled_circuit import GarbledCircuit
+from simulate import simulate
+from yao import evaluate, evaluate_levels
+
+# (encryption method, kappa, scheme) combinations measured by default
+CONFIGS = [
+    ('xor', 1, 'classic'),
+    ('xor', 1, 'free_xor'),
+    ('blake2', 16, 'classic'),
+    ('blake2', 16, 'half_gates'),
+    ('fixed_key', 16, 'half_gates'),
+]
+TOLERANCE = 0.2 # slowdown against the baseline reported as a regression
+
+
+def adder(n: int) -> Circuit:
+    """n-bit + n-bit adder with n+1 output bits."""
+    builder = CircuitBuilder(f'adder{n}')
+    builder.output(builder.add(builder.alice_input(n), builder.bob_input(n), carry_out=True))
+    return builder.build()
+
+
+def comparator(n: int) -> Circuit:
+    """a > b for n-bit numbers."""
+    builder = CircuitBuilder(f'comparator{n}')
+    builder.output(builder.gt(builder.alice_input(n), builder.bob_input(n)))
+    return builder.build()
+
+
+def millionaire(n: int) -> Circuit:
+    """Yao's millionaires' problem, a >= b for n-bit numbers."""
+    builder = CircuitBuilder(f'millionaire{n}')
+    builder.output(builder.geq(builder.alice_input(n), builder.bob_input(n)))
+    return builder.build()
+
+
+def multiplier(n: int) -> Circuit:
+    """n×n-bit multiplier with a 2n-bit product."""
+    builder = CircuitBuilder(f'multiplier{n}')
+    builder.output(builder.mul(builder.alice_input(n), builder.bob_input(n)))
+    return builder.build()
+
+
+def bitwise_and(n: int) -> Circuit:
+    """a AND b bit by bit, one level of n independent AND gates."""
+    builder = CircuitBuilder(f'and{n}')
+    builder.output([builder.and_(x, y) for x, y in zip(builder.alice_input(n), builder.bob_input(n))])
+    return builder.build()
+
+
+FAMILIES: dict[str, Callable[[int], Circuit]] = {
+    'adder': adder,
+    'and': bitwise_and,
+    'comparator': comparator,
+    'millionaire': millionaire,
+    'multiplier': multiplier,
+}
+SIZES = {
+    'adder': [8, 32, 128],
+    'and': [64, 1024, 4096],
+    'comparator': [8, 32, 128],
+    'millionaire': [8, 32, 128],
+    'multiplier': [8, 16, 32],
+}
+
+
+class BenchmarkResult(NamedTuple):
+    family: str
+    size: int
+    encryption_method: str
+    kappa: int
+    scheme: str
+    gates: int
+    tables: int
+    garble_seconds: float # best of the repeats
+    evaluate_seconds: float
+    garble_gates_per_second: float
+    evaluate_gates_per_second: float
+    bytes_per_gate: float # table bytes sent per gate of the circuit
+    peak_memory_bytes: int # tracemalloc peak while garbling and evaluating
+    levels_gates_per_second: float = 0.0 # yao.evaluate_levels, 0 for configurations it does not support
+
+    def key(self) -> tuple:
+        return (self.family, self.size, self.encryption_method, self.kappa, self.scheme)
+
+
+def run_one(family: str, size: int, encryption_method: str, kappa: int, scheme: str, repeat: int = 3,
+        seed: bytes | None = None) -> BenchmarkResult:
+    """Time garbling and evaluation of one circuit and check the result against the simulator.
+
+    With a seed the labels and the inputs are reproducible across runs.
+    """
+    circuit = FAMILIES[family](size)
+    rng = random.Random(seed) if seed else random
+    levels = encryption_method == 'xor' and scheme in ('classic', 'free_xor')
+    garble_times, evaluate_times, levels_times = [], [], []
+    for _ in range(repeat):
+        inputs = {wire: rng.getrandbits(1) for wire in circuit.alice + circuit.bob}
+        start = time.perf_counter()
+        garbled_circuit = GarbledCircuit(circuit, encryption_method, kappa, scheme, seed)
+        garble_times.append(time.perf_counter() - start)
+
+        keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+        a_inputs = {wire: (keys[wire][inputs[wire]], pbits[wire] ^ inputs[wire]) for wire in circuit.alice}
+        b_inputs = {wire: (keys[wire][inputs[wire]], pbits[wire] ^ inputs[wire]) for wire in circuit.bob}
+        start = time.perf_counter()
+        result = evaluate(circuit, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(), a_inputs, b_inputs,
+                encryption_method, kappa, scheme)
+        evaluate_times.append(time.perf_counter() - start)
+        if result != simulate(circuit, inputs, 1):
+            raise AssertionError(f"Wrong result for {circuit.name} with {encryption_method}/{scheme}")
+        if levels:
+            start = time.perf_counter()
+            result = evaluate_levels(circuit, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(), a_inputs, b_inputs,
+                    encryption_method, kappa, scheme)
+            levels_times.append(time.perf_counter() - start)
+            if result != simulate(circuit, inputs, 1):
+                raise AssertionError(f"Wrong level evaluation for {circuit.name} with {encryption_method}/{scheme}")
+
+    # memory is measured on a separate run, tracing slows execution down
+    tracemalloc.start()
+    try:
+        garbled_circuit = GarbledCircuit(circuit, encryption_method, kappa, scheme, seed)
+        keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+        evaluate(circuit, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(),
+                {wire: (keys[wire][0], pbits[wire]) for wire in circuit.alice},
+                {wire: (keys[wire][0], pbits[wire]) for wire in circuit.bob}, encryption_method, kappa, scheme)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = garbled_circuit.stats()
+    garble, evaluation = min(garble_times), min(evaluate_times)
+    return BenchmarkResult(family, size, encryption_method, kappa, scheme, stats.gates, stats.tables, garble, evaluation,
+            stats.gates / garble, stats.gates / evaluation, stats.table_bytes / stats.gates, peak,
+            stats.gates / min(levels_times) if levels else 0.0)
+
+
+def run(families: list[str], sizes: list[int] | None = None, configs: list[tuple[str, int, str]] = CONFIGS,
+        repeat: int = 3, log=None, seed: bytes | None = None) -> list[BenchmarkResult]:
+    """Benchmark every family at its sizes (or the given ones) under every configuration."""
+    results = []
+    for family in families:
+        for size in sizes or SIZES[family]:
+            for encryption_method, kappa, scheme in configs:
+                result = run_one(family, size, encryption_method, kappa, scheme, repeat, seed)
+                results.append(result)
+                if log:
+                    print(format_result(result), file=log)
+    return results
+
+
+def format_result(result: BenchmarkResult) -> str:
+    return (f"{result.family + str(result.size):>14} {result.encryption_method:>9}/{result.scheme:<10} {result.gates:>6} gates "
+            f"garble {result.garble_gates_per_second:>9.0f} g/s  evaluate {result.evaluate_gates_per_second:>9.0f} g/s  "
+            f"{result.bytes_per_gate:5.1f} B/gate  peak {result.peak_memory_bytes / 1024:8.1f} KiB"
+            + (f"  levels {result.levels_gates_per_second:>9.0f} g/s" if result.levels_gates_per_second else ""))
+
+
+def to_json(results: list[BenchmarkResult]) -> dict:
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': [result._asdict() for result in results],
+    }
+
+
+def compare(results: list[BenchmarkResult], baseline: dict, tolerance: float = TOLERANCE) -> list[str]:
+    """Return a description of every regression against a baseline written by to_json.
+
+    Throughput may drop by 'tolerance' before it counts; bytes per gate is
+    deterministic and must not grow at all. Results missing from the baseline are skipped.
+    """
+    previous = {BenchmarkResult(**entry).key(): BenchmarkResult(**entry) for entry in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result.key())
+        if before is None:
+            continue
+        name = f"{result.family}{result.size} {result.encryption_method}/{result.scheme}"
+        for metric in ('garble_gates_per_second', 'evaluate_gates_per_second', 'levels_gates_per_second'):
+            now, then = getattr(result, metric), getattr(before, metric)
+            if not then:
+                continue
+            if now < then * (1 - tolerance):
+                regressions.append(f"{name}: {metric} {then:.0f} -> {now:.0f} ({now / then - 1:+.0%})")
+        if result.bytes_per_gate > before.bytes_per_gate:
+            regressions.append(f"{name}: bytes_per_gate {before.bytes_per_gate:.2f} -> {result.bytes_per_gate:.2f}")
+    return regressions
+
+
+def parse_config(text: str) -> tuple[str, int, str]:
+    method, kappa, scheme = text.split(':')
+    return method, int(kappa), scheme
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark garbling and evaluation throughput.")
+    parser.add_argument('--families', nargs='+', choices=sorted(FAMILIES), default=sorted(FAMILIES))
+    parser.add_argument('--sizes', nargs='+', type=int, help="sizes in bits, default depends on the family")
+    parser.add_argument('--configs', nargs='+', type=parse_config, default=CONFIGS, metavar='METHOD:KAPPA:SCHEME')
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement, the best one is kept")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results saved with --output, exit 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--seed', type=str.encode, help="derive labels and inputs from this seed for reproducible runs")
+    args = parser.parse_args(argv)
+
+    results = run(args.families, args.sizes, args.configs, args.repeat, log=sys.stdout, seed=args.seed)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(to_json(results), file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import io
+import mmap
+import os
+from array import array
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, NamedTuple
+
+import numpy as np
+
+from circuit import Circuit, Gate, Id
+from compact import CompactCircuit, OPCODES, NO_WIRE
+
+Source = str | os.PathLike | bytes | bytearray | memoryview | mmap.mmap | BinaryIO
+
+# Bristol gate -> (gate type, inputs) in terms of the operand wires
+GATE_MAP = {
+    'XOR': lambda a, b: ('XOR', [a, b]),
+    'AND': lambda a, b: ('AND', [a, b]),
+    'INV': lambda a: ('NOT', [a]),
+    'EQW': lambda a: ('BUF', [a]),
+}
+
+
+class BristolHeader(NamedTuple):
+    n_gates: int
+    n_wires: int
+    inputs: list[int] # number of wires of each input value
+    outputs: list[int] # number of wires of each output value
+
+
+@contextmanager
+def open_lines(source: Source) -> Iterator[Iterator[bytes]]:
+    """Iterate over the lines of a file path, buffer or binary file without reading it whole."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield iter(mapped.readline, b'')
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield iter(io.BytesIO(source).readline, b'')
+    else:
+        yield iter(source.readline, b'')
+
+
+def tokens(lines: Iterator[bytes]) -> Iterator[list[bytes]]:
+    """Yield the whitespace separated fields of the non-empty lines."""
+    for line in lines:
+        fields = line.split()
+        if fields:
+            yield fields
+
+
+def parse_header(lines: Iterator[list[bytes]]) -> BristolHeader:
+    n_gates, n_wires = map(int, next(lines))
+    inputs = [int(n) for n in next(lines)]
+    outputs = [int(n) for n in next(lines)]
+    if inputs[0] != len(inputs) - 1 or outputs[0] != len(outputs) - 1:
+        raise ValueError('Malformed Bristol Fashion header')
+    return BristolHeader(n_gates, n_wires, inputs[1:], outputs[1:])
+
+
+class BristolReader():
+    """Translate the gates of a Bristol Fashion netlist to gates of the project's types.
+
+    Wires are renumbered densely in the order they are driven: inputs keep their index
+    and every emitted gate gets the next id, so ids are topological. MAND is split into
+    AND gates and EQ constants are built from input wire 0. Only the renumbering table
+    (4 bytes per Bristol wire) is kept in memory.
+    """
+    header: BristolHeader
+    renumber: array # dense id of each Bristol wire
+
+    def __init__(self, lines: Iterator[bytes]):
+        self.lines = tokens(lines)
+        self.header = parse_header(self.lines)
+        self.renumber = array('i', [NO_WIRE]) * self.header.n_wires
+        for wire in range(self.n_inputs):
+            self.renumber[wire] = wire
+
+    @property
+    def n_inputs(self) -> int:
+        return sum(self.header.inputs)
+
+    @property
+    def alice(self) -> list[Id]:
+        return list(range(self.header.inputs[0]))
+
+    @property
+    def bob(self) -> list[Id]:
+        return list(range(self.header.inputs[0], self.n_inputs))
+
+    def gates(self) -> Iterator[Gate]:
+        renumber = self.renumber
+        next_id = self.n_inputs
+        for fields in self.lines:
+            n_in, n_out = int(fields[0]), int(fields[1])
+            operands = [int(wire) for wire in fields[2:2+n_in]]
+            targets = [int(wire) for wire in fields[2+n_in:2+n_in+n_out]]
+            kind = fields[-1].decode()
+
+            if kind == 'MAND':
+                emitted = [('AND', [renumber[a], renumber[b]]) for a, b in zip(operands[:n_out], operands[n_out:])]
+            elif kind == 'EQ':
+                emitted = [('XNOR' if operands[0] else 'XOR', [0, 0])]
+            elif kind in GATE_MAP:
+                emitted = [GATE_MAP[kind](*[renumber[wire] for wire in operands])]
+            else:
+                raise ValueError(f"Unsupported Bristol gate '{kind}'")
+
+            for target, (gate_type, inputs) in zip(targets, emitted):
+                if NO_WIRE in inputs:
+                    raise ValueError(f"Wire used before it is driven in gate '{b' '.join(fields).decode()}'")
+                renumber[target] = next_id
+                yield Gate(next_id, gate_type, inputs)
+                next_id += 1
+
+    def outputs(self) -> list[Id]:
+        """Dense ids of the output wires, available once all the gates have been read."""
+        n_outputs = sum(self.header.outputs)
+        return [self.renumber[wire] for wire in range(self.header.n_wires - n_outputs, self.header.n_wires)]
+
+
+def iter_gates(source: Source) -> Iterator[Gate]:
+    """Yield the gates of a Bristol Fashion circuit one by one."""
+    with open_lines(source) as lines:
+        yield from BristolReader(lines).gates()
+
+
+def load_bristol(source: Source, name: str = 'bristol', compact: bool = True) -> CompactCircuit | Circuit:
+    """Load a Bristol Fashion circuit, see https://nigelsmart.github.io/MPC-Circuits/.
+
+    The first input value is Alice's and the remaining ones are Bob's. With compact=True
+    the gates are streamed straight into the columns of a CompactCircuit.
+    """
+    with open_lines(source) as lines:
+        reader = BristolReader(lines)
+        if not compact:
+            gates = list(reader.gates())
+            return Circuit(name, reader.alice, reader.bob, reader.outputs(), gates)
+
+        ops, in_a, in_b = array('b'), array('i'), array('i')
+        for gate in reader.gates():
+            ops.append(OPCODES[gate.type])
+            in_a.append(gate.inputs[0])
+            in_b.append(gate.inputs[1] if len(gate.inputs) > 1 else NO_WIRE)
+        return CompactCircuit(name, len(reader.alice), len(reader.bob), reader.outputs(),
+                np.frombuffer(ops, dtype=np.int8), np.frombuffer(in_a, dtype=np.int32), np.frombuffer(in_b, dtype=np.int32))
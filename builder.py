@@ -0,0 +1,164 @@
+from circuit import Circuit, Gate, Id
+
+# Numbers are lists of wire ids, least significant bit first.
+Bits = list[Id]
+
+
+class CircuitBuilder():
+    """Build circuits gate by gate with automatically allocated wire ids.
+
+    The arithmetic favours constructions with few non-free gates, since XOR and XNOR
+    cost nothing under Free-XOR and half-gates: additions, subtractions and
+    comparisons use one AND per bit, and inversions are folded into XNOR, LEQ and GEQ
+    gates wherever possible (NOT gates are free too, but add a gate to evaluate).
+    """
+    name: str
+    alice: list[Id]
+    bob: list[Id]
+    out: list[Id]
+    gates: list[Gate]
+
+    def __init__(self, name: str = 'circuit'):
+        self.name = name
+        self.alice = []
+        self.bob = []
+        self.out = []
+        self.gates = []
+        self.next_id = 1
+
+    def wire(self) -> Id:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def alice_input(self, n: int = 1) -> Bits:
+        """Allocate n input wires of Alice."""
+        wires = [self.wire() for _ in range(n)]
+        self.alice += wires
+        return wires
+
+    def bob_input(self, n: int = 1) -> Bits:
+        """Allocate n input wires of Bob."""
+        wires = [self.wire() for _ in range(n)]
+        self.bob += wires
+        return wires
+
+    def output(self, wires: Id | Bits):
+        """Mark wires as outputs, in order."""
+        self.out += [wires] if isinstance(wires, Id) else wires
+
+    def build(self) -> Circuit:
+        return Circuit(self.name, list(self.alice), list(self.bob), list(self.out), list(self.gates))
+
+    def gate(self, gate_type: str, *inputs: Id) -> Id:
+        gate_id = self.wire()
+        self.gates.append(Gate(gate_id, gate_type, list(inputs)))
+        return gate_id
+
+    def xor(self, x: Id, y: Id) -> Id:
+        return self.gate('XOR', x, y)
+
+    def xnor(self, x: Id, y: Id) -> Id:
+        return self.gate('XNOR', x, y)
+
+    def and_(self, x: Id, y: Id) -> Id:
+        return self.gate('AND', x, y)
+
+    def or_(self, x: Id, y: Id) -> Id:
+        return self.gate('OR', x, y)
+
+    def not_(self, x: Id) -> Id:
+        return self.gate('NOT', x)
+
+    def add(self, a: Bits, b: Bits, carry_out: bool = False) -> Bits:
+        """a + b modulo 2^max(len), or with the carry as an extra bit.
+
+        Each full adder uses one AND: carry' = carry ^ ((a ^ carry) & (b ^ carry)).
+        """
+        if len(a) < len(b):
+            a, b = b, a
+        out = [self.xor(a[0], b[0])]
+        carry = self.and_(a[0], b[0]) if len(a) > 1 or carry_out else None
+        for i in range(1, len(a)):
+            last = i == len(a) - 1 and not carry_out
+            if i < len(b):
+                t = self.xor(a[i], carry)
+                out.append(self.xor(t, b[i]))
+                if not last:
+                    carry = self.xor(carry, self.and_(t, self.xor(b[i], carry)))
+            else: # half adder for the bits beyond b
+                out.append(self.xor(a[i], carry))
+                if not last:
+                    carry = self.and_(a[i], carry)
+        return out + [carry] if carry_out else out
+
+    def sub(self, a: Bits, b: Bits) -> Bits:
+        """a - b modulo 2^n, computed as ~(~a + b) with all the inversions free."""
+        if len(a) != len(b):
+            raise ValueError("Operands must have the same length")
+        out = [self.xor(a[0], b[0])]
+        carry = self.gate('LEQ', a[0], b[0])
+        for i in range(1, len(a)):
+            t = self.xnor(a[i], carry)
+            out.append(self.xnor(t, b[i]))
+            if i < len(a) - 1:
+                carry = self.xor(carry, self.and_(t, self.xor(b[i], carry)))
+        return out
+
+    def lt(self, a: Bits, b: Bits) -> Id:
+        """a < b, the carry of ~a + b: one AND per bit."""
+        if len(a) != len(b):
+            raise ValueError("Operands must have the same length")
+        carry = self.gate('LEQ', a[0], b[0])
+        for i in range(1, len(a)):
+            carry = self.xor(carry, self.and_(self.xnor(a[i], carry), self.xor(b[i], carry)))
+        return carry
+
+    def gt(self, a: Bits, b: Bits) -> Id:
+        """a > b, starting with GEQ(a0, b0) = a0 & ~b0."""
+        if len(a) != len(b):
+            raise ValueError("Operands must have the same length")
+        carry = self.gate('GEQ', a[0], b[0])
+        for i in range(1, len(a)):
+            carry = self.xor(carry, self.and_(self.xnor(b[i], carry), self.xor(a[i], carry)))
+        return carry
+
+    def geq(self, a: Bits, b: Bits) -> Id:
+        """a >= b = ~(a < b), the inversion is absorbed into the last carry XOR."""
+        if len(a) != len(b):
+            raise ValueError("Operands must have the same length")
+        if len(a) == 1:
+            return self.not_(self.gate('LEQ', a[0], b[0]))
+        carry = self.lt(a[:-1], b[:-1])
+        return self.xnor(carry, self.and_(self.xnor(a[-1], carry), self.xor(b[-1], carry)))
+
+    def leq(self, a: Bits, b: Bits) -> Id:
+        """a <= b."""
+        return self.geq(b, a)
+
+    def eq(self, a: Bits, b: Bits) -> Id:
+        """a == b: free XNORs and a balanced tree of len-1 ANDs."""
+        return self.and_tree([self.xnor(x, y) for x, y in zip(a, b, strict=True)])
+
+    def neq(self, a: Bits, b: Bits) -> Id:
+        """a != b, the inversion is absorbed into the root of the tree as a NAND."""
+        if len(a) == 1:
+            return self.xor(a[0], b[0])
+        return self.and_tree([self.xnor(x, y) for x, y in zip(a, b, strict=True)], root='NAND')
+
+    def and_tree(self, wires: Bits, root: str = 'AND') -> Id:
+        """AND of all the wires with logarithmic depth."""
+        while len(wires) > 2:
+            wires = [self.and_(wires[i], wires[i+1]) for i in range(0, len(wires) - 1, 2)] + wires[len(wires) - len(wires) % 2:]
+        return self.gate(root, *wires) if len(wires) == 2 else wires[0]
+
+    def mux(self, select: Id, a: Bits, b: Bits) -> Bits:
+        """select ? b : a, one AND per bit: a ^ (select & (a ^ b))."""
+        return [self.xor(x, self.and_(select, self.xor(x, y))) for x, y in zip(a, b, strict=True)]
+
+    def mul(self, a: Bits, b: Bits) -> Bits:
+        """Full product of a and b by shift and add, len(a) + len(b) bits (one less if either has one bit)."""
+        product = [self.and_(x, b[0]) for x in a]
+        for j in range(1, len(b)):
+            row = [self.and_(x, b[j]) for x in a]
+            product = product[:j] + (self.add(product[j:], row, carry_out=True) if product[j:] else row)
+        return product
@@ -0,0 +1,192 @@
+from hashlib import blake2b, sha512
+from typing import Iterable
+
+import instrument
+from utils import xor_bytes, hash_label, encrypt_hash, decrypt_hash
+
+# (key_one, key_two) pair of input keys of one table row
+KeyPair = tuple[bytes, bytes]
+
+STATE_CACHE_SIZE = 1 << 16 # max number of precomputed per-label hash states
+FIXED_KEY = sha512(b'garbled-circuit fixed-key hash').digest()[:32]
+
+
+class CipherBackend():
+    """Encryption of garbled table rows.
+
+    A backend is resolved once per circuit with get_backend() and derives the one-time
+    pads of all the rows of a gate at once (derive_keys). Rows are encrypted and
+    decrypted by XOR-ing them with their pad.
+    """
+    name: str
+    hashes: bool = True # True if hash_label is available, required by half-gates
+    kappa: int
+
+    def __init__(self, kappa: int):
+        self.kappa = kappa
+
+    def __reduce__(self):
+        # hash states are caches, a pickled backend is built again from its parameters
+        return type(self), (self.kappa,)
+
+    def derive_key(self, index: int, key_one: bytes, key_two: bytes) -> bytes:
+        """Return the kappa+1 bytes pad of the row encrypted under key_one and key_two."""
+        raise NotImplementedError
+
+    def derive_keys(self, index: int, pairs: Iterable[KeyPair]) -> list[bytes]:
+        """Return the pads of all the rows of gate 'index'."""
+        return [self.derive_key(index, key_one, key_two) for key_one, key_two in pairs]
+
+    def encrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        return xor_bytes(value, self.derive_key(index, key_one, key_two))
+
+    def decrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        return xor_bytes(value, self.derive_key(index, key_one, key_two))
+
+    def encrypt_rows(self, index: int, rows: list[tuple[bytes, bytes, bytes]]) -> list[bytes]:
+        """Encrypt all (key_one, key_two, value) rows of gate 'index'."""
+        pads = self.derive_keys(index, [(key_one, key_two) for key_one, key_two, _ in rows])
+        return [xor_bytes(value, pad) for (_, _, value), pad in zip(rows, pads)]
+
+    def hash_label(self, index: int, label: bytes) -> bytes:
+        """Hash a kappa+1 bytes label with a tweak to kappa+1 bytes."""
+        raise ValueError(f"'{self.name}' method can not hash labels")
+
+
+BACKENDS: dict[str, type[CipherBackend]] = {}
+
+def register_backend(backend: type[CipherBackend]) -> type[CipherBackend]:
+    """Make a backend available under its name, usable as a class decorator."""
+    BACKENDS[backend.name] = backend
+    return backend
+
+def get_backend(method: str, kappa: int) -> CipherBackend:
+    """Resolve an encryption method name to a backend instance."""
+    if method not in BACKENDS:
+        raise ValueError(f"Unknown method '{method}'")
+    return instrument.backend(BACKENDS[method](kappa))
+
+
+@register_backend
+class XorBackend(CipherBackend):
+    """Encrypt rows by XOR-ing them with both keys. Not secure, useful for testing."""
+    name = 'xor'
+    hashes = False
+
+    def derive_key(self, index: int, key_one: bytes, key_two: bytes) -> bytes:
+        assert len(key_one) == self.kappa
+        assert len(key_two) == self.kappa
+        # the last key byte also covers the pbit byte
+        return xor_bytes(key_one + key_one[-1:], key_two + key_two[-1:])
+
+
+@register_backend
+class HashBackend(CipherBackend):
+    """The original sha512 based method.
+
+    Rows are added to the hash modulo 62273 instead of being XOR-ed with a pad, which
+    only round-trips for kappa = 1. Use 'blake2' or 'fixed_key' for wider labels.
+    """
+    name = 'hash'
+
+    def encrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        return encrypt_hash(index, key_one, key_two, value, self.kappa)
+
+    def decrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        return decrypt_hash(index, key_one, key_two, value, self.kappa)
+
+    def encrypt_rows(self, index: int, rows: list[tuple[bytes, bytes, bytes]]) -> list[bytes]:
+        return [self.encrypt(index, key_one, key_two, value) for key_one, key_two, value in rows]
+
+    def hash_label(self, index: int, label: bytes) -> bytes:
+        return hash_label(index, label, self.kappa)
+
+
+@register_backend
+class Blake2Backend(CipherBackend):
+    """Pads are blake2b(key_one ‖ key_two ‖ index) truncated to kappa+1 bytes.
+
+    The hash state after absorbing key_one is computed once per label and copied for
+    every row that uses it, so a gate costs one state copy and update per row.
+    """
+    name = 'blake2'
+
+    def __init__(self, kappa: int):
+        assert kappa + 1 <= blake2b.MAX_DIGEST_SIZE
+        super().__init__(kappa)
+        self.states = {}
+
+    def label_state(self, label: bytes):
+        """Return the precomputed hash state of a label."""
+        state = self.states.get(label)
+        if state is None:
+            if len(self.states) >= STATE_CACHE_SIZE:
+                self.states.clear()
+            state = self.states[label] = blake2b(label, digest_size=self.kappa+1)
+        return state
+
+    def derive_key(self, index: int, key_one: bytes, key_two: bytes) -> bytes:
+        state = self.label_state(key_one).copy()
+        state.update(key_two + index.to_bytes(8, 'big'))
+        return state.digest()
+
+    def derive_keys(self, index: int, pairs: Iterable[KeyPair]) -> list[bytes]:
+        tweak = index.to_bytes(8, 'big')
+        pads = []
+        for key_one, key_two in pairs:
+            state = self.label_state(key_one).copy()
+            state.update(key_two + tweak)
+            pads.append(state.digest())
+        return pads
+
+    def hash_label(self, index: int, label: bytes) -> bytes:
+        return blake2b(label + index.to_bytes(8, 'big'), digest_size=self.kappa+1, person=b'label').digest()
+
+
+def double(value: bytes) -> bytes:
+    """Multiply a byte string by x, reducing with the GF(2^128) constant."""
+    number = int.from_bytes(value, 'big') << 1
+    bits = 8 * len(value)
+    if number >> bits:
+        number ^= (1 << bits) | 0x87
+    return number.to_bytes(len(value), 'big')
+
+
+@register_backend
+class FixedKeyBackend(CipherBackend):
+    """Correlation-robust hash H(x) = π(x) ⊕ x built on a fixed-key permutation.
+
+    The pad of a row is H(2·key_one ⊕ 4·key_two ⊕ index) as in fixed-key AES
+    garbling. There is no AES in the standard library so π is blake2b keyed with a
+    fixed public key, whose initial state is computed once per circuit.
+    """
+    name = 'fixed_key'
+
+    def __init__(self, kappa: int, key: bytes = FIXED_KEY):
+        assert kappa + 1 <= blake2b.MAX_DIGEST_SIZE
+        super().__init__(kappa)
+        self.key = key
+        self.state = blake2b(key=key, digest_size=kappa+1)
+
+    def __reduce__(self):
+        return type(self), (self.kappa, self.key)
+
+    def permute(self, value: bytes) -> bytes:
+        state = self.state.copy()
+        state.update(value)
+        return xor_bytes(state.digest(), value)
+
+    def tweak(self, index: int) -> bytes:
+        """The index as a kappa+1 bytes block, indices that do not fit are rejected rather than wrapped."""
+        try:
+            return index.to_bytes(self.kappa+1, 'big')
+        except OverflowError:
+            raise ValueError(f"Index {index} does not fit the {self.kappa+1} bytes tweak of kappa = {self.kappa}, use a larger kappa") from None
+
+    def derive_key(self, index: int, key_one: bytes, key_two: bytes) -> bytes:
+        # the keys are extended by a zero byte to cover the pbit byte
+        key = xor_bytes(double(key_one + b'\x00'), double(double(key_two + b'\x00')))
+        return self.permute(xor_bytes(key, self.tweak(index)))
+
+    def hash_label(self, index: int, label: bytes) -> bytes:
+        return self.permute(xor_bytes(double(label), self.tweak(index)))
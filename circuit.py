@@ -22,6 +22,18 @@ class Circuit(NamedTuple):
     out: list[Id]
     gates: list[Gate]
 
+    def wires(self) -> list[Id]:
+        """Return the ids of all the wires of the circuit."""
+        wires = set(self.alice + self.bob) # inputs no gate reads still get labels
+        for gate in self.gates:
+            wires.add(gate.id)
+            wires.update(set(gate.inputs))
+        return list(wires)
+
+    def sorted_gates(self) -> list[Gate]:
+        """Return the gates in id order, see topological_order for an order every circuit can be evaluated in."""
+        return sorted(self.gates, key=lambda g: g.id)
+
 GateFunctions = {
     'AND': lambda x, y: x and y,
     'OR': lambda x, y: x or y,
@@ -32,5 +44,77 @@ GateFunctions = {
     'XNOR':  lambda x, y: not (x ^ y),
     'GEQ': lambda x, y: x > y,
     'LEQ': lambda x, y: x < y,
+    'BUF': lambda x: x,
 }
 
+
+def topological_order(circuit: Circuit) -> list[Gate]:
+    """Return the gates in an order where every wire is driven before it is read.
+
+    Gates in id order usually are topological, which is checked in one pass; otherwise
+    they are sorted by their dependencies. Raises ValueError for wires that no input or
+    gate drives, wires driven twice and cycles.
+    """
+    gates = list(circuit.sorted_gates())
+    inputs = set(circuit.alice + circuit.bob)
+    if len(inputs) != len(circuit.alice + circuit.bob):
+        raise ValueError("An input wire is listed twice")
+    defined = set(inputs)
+    for gate in gates:
+        if any(wire not in defined for wire in gate.inputs):
+            break
+        if gate.id in defined:
+            raise ValueError(f"Wire {gate.id} is driven twice")
+        defined.add(gate.id)
+    else:
+        return gates
+
+    drivers = {}
+    for gate in gates:
+        if gate.id in inputs or gate.id in drivers:
+            raise ValueError(f"Wire {gate.id} is driven twice")
+        drivers[gate.id] = gate
+    for gate in gates:
+        for wire in gate.inputs:
+            if wire not in inputs and wire not in drivers:
+                raise ValueError(f"Gate {gate.id} reads undefined wire {wire}")
+
+    # Kahn's algorithm
+    waiting = {}
+    readers: dict[Id, list[Gate]] = {}
+    ready = []
+    for gate in gates:
+        pending = {wire for wire in gate.inputs if wire in drivers}
+        for wire in pending:
+            readers.setdefault(wire, []).append(gate)
+        waiting[gate.id] = len(pending)
+        if not pending:
+            ready.append(gate)
+    order = []
+    while ready:
+        gate = ready.pop()
+        order.append(gate)
+        for reader in readers.get(gate.id, []):
+            waiting[reader.id] -= 1
+            if waiting[reader.id] == 0:
+                ready.append(reader)
+    if len(order) != len(gates):
+        raise ValueError("The circuit has a cycle")
+    return order
+
+
+def topological_levels(circuit: Circuit) -> list[list[Gate]]:
+    """Group the gates of a circuit into levels.
+
+    Inputs are on level 0 and a gate is one level above its deepest input, so all the
+    gates of a level only depend on gates of lower levels and can be processed together.
+    """
+    depth = {wire: 0 for wire in circuit.alice + circuit.bob}
+    levels = []
+    for gate in topological_order(circuit):
+        level = 1 + max(depth[wire] for wire in gate.inputs)
+        depth[gate.id] = level
+        if level > len(levels):
+            levels.append([])
+        levels[level-1].append(gate)
+    return levels
@@ -0,0 +1,128 @@
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from circuit import Circuit, Gate, Id, GateFunctions, topological_order
+
+GATE_TYPES = tuple(GateFunctions) # opcode of a gate type is its index
+OPCODES = {gate_type: opcode for opcode, gate_type in enumerate(GATE_TYPES)}
+NO_WIRE = -1 # second input of unary gates
+ITER_CHUNK = 1 << 12 # gates converted at once when iterating
+
+
+class CompactGates(Sequence):
+    """Read-only sequence of the gates of a CompactCircuit, built on access."""
+
+    def __init__(self, circuit: 'CompactCircuit'):
+        self.circuit = circuit
+
+    def __len__(self) -> int:
+        return len(self.circuit.ops)
+
+    def __getitem__(self, index: int) -> Gate:
+        if not -len(self) <= index < len(self):
+            raise IndexError('gate index out of range')
+        index %= len(self)
+        return self.circuit.gate(index)
+
+    def __iter__(self) -> Iterator[Gate]:
+        circuit = self.circuit
+        gate_id = circuit.n_inputs
+        # convert the columns in chunks to keep the iteration memory bounded
+        for start in range(0, len(self), ITER_CHUNK):
+            stop = start + ITER_CHUNK
+            for op, in_a, in_b in zip(circuit.ops[start:stop].tolist(), circuit.in_a[start:stop].tolist(), circuit.in_b[start:stop].tolist()):
+                inputs = [in_a] if in_b == NO_WIRE else [in_a, in_b]
+                yield Gate(gate_id, GATE_TYPES[op], inputs)
+                gate_id += 1
+
+
+class CompactCircuit():
+    """A circuit stored as NumPy columns with dense wire indices.
+
+    Alice's inputs are wires 0..len(alice)-1, followed by Bob's inputs, and gate k
+    drives wire n_inputs + k, so gate outputs are implicit and wire indices are in
+    topological order. Each gate costs one int8 opcode and two int32 input indices.
+    The object can be used wherever a Circuit is expected.
+    """
+    name: str
+    alice: list[Id]
+    bob: list[Id]
+    out: list[Id]
+    ops: np.ndarray # int8 opcode of each gate, see GATE_TYPES
+    in_a: np.ndarray # int32 first input of each gate
+    in_b: np.ndarray # int32 second input of each gate, NO_WIRE for unary gates
+    wire_ids: np.ndarray | None # original id of each dense wire, if converted from a Circuit
+
+    def __init__(self, name: str, n_alice: int, n_bob: int, out: list[Id],
+            ops: np.ndarray, in_a: np.ndarray, in_b: np.ndarray,
+            wire_ids: np.ndarray | None = None):
+        self.name = name
+        self.alice = list(range(n_alice))
+        self.bob = list(range(n_alice, n_alice + n_bob))
+        self.out = list(out)
+        self.ops = np.asarray(ops, dtype=np.int8)
+        self.in_a = np.asarray(in_a, dtype=np.int32)
+        self.in_b = np.asarray(in_b, dtype=np.int32)
+        self.wire_ids = wire_ids
+
+    @property
+    def n_inputs(self) -> int:
+        return len(self.alice) + len(self.bob)
+
+    @property
+    def n_wires(self) -> int:
+        return self.n_inputs + len(self.ops)
+
+    @property
+    def gates(self) -> CompactGates:
+        return CompactGates(self)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the gate columns."""
+        return self.ops.nbytes + self.in_a.nbytes + self.in_b.nbytes
+
+    def gate(self, index: int) -> Gate:
+        """Return the index-th gate."""
+        in_a, in_b = int(self.in_a[index]), int(self.in_b[index])
+        inputs = [in_a] if in_b == NO_WIRE else [in_a, in_b]
+        return Gate(self.n_inputs + index, GATE_TYPES[self.ops[index]], inputs)
+
+    def wires(self) -> range:
+        return range(self.n_wires)
+
+    def sorted_gates(self) -> CompactGates:
+        """Gates are stored in topological order already."""
+        return self.gates
+
+    @classmethod
+    def from_circuit(cls, circuit: Circuit) -> 'CompactCircuit':
+        """Renumber a circuit densely, gates are taken in topological order."""
+        gates = topological_order(circuit)
+        index = {wire: i for i, wire in enumerate(circuit.alice + circuit.bob)}
+        ops = np.empty(len(gates), dtype=np.int8)
+        in_a = np.empty(len(gates), dtype=np.int32)
+        in_b = np.full(len(gates), NO_WIRE, dtype=np.int32)
+        for k, gate in enumerate(gates):
+            try:
+                ops[k] = OPCODES[gate.type]
+                in_a[k] = index[gate.inputs[0]]
+                if len(gate.inputs) > 1:
+                    in_b[k] = index[gate.inputs[1]]
+            except KeyError as error:
+                raise ValueError(f"Gate {gate.id} uses unknown gate type or undefined wire {error}") from None
+            index[gate.id] = len(index)
+
+        wire_ids = np.array(circuit.alice + circuit.bob + [gate.id for gate in gates], dtype=np.int64)
+        return cls(circuit.name, len(circuit.alice), len(circuit.bob), [index[wire] for wire in circuit.out], ops, in_a, in_b, wire_ids)
+
+    def to_circuit(self, original_ids: bool = True) -> Circuit:
+        """Convert back to a Circuit, with the original wire ids if they are known."""
+        if original_ids and self.wire_ids is not None:
+            ids = self.wire_ids.tolist()
+        else:
+            ids = list(self.wires())
+        gates = [Gate(ids[gate.id], gate.type, [ids[wire] for wire in gate.inputs]) for gate in self.gates]
+        return Circuit(self.name, [ids[wire] for wire in self.alice], [ids[wire] for wire in self.bob],
+                [ids[wire] for wire in self.out], gates)
@@ -1,32 +1,162 @@
-from utils import gen_label, encode, decode, encrypt, decrypt, flip_coin
-from circuit import Circuit, Gate, Id, Label, GateFunctions
+from typing import NamedTuple, Sequence
+
+from utils import gen_label, encode, flip_coin, xor_bytes, prf
+from circuit import Circuit, Gate, Id, Label, GateFunctions, topological_order
+from cipher import CipherBackend, get_backend
+from garbled_file import write_garbled
+from labels import LabelGenerator, SeededKeys, SeededPbits
+import instrument
 
 # name parameter is for testing purposes
-GarbledTable = dict[tuple[int, int], bytes]
+# classic tables are keyed by the (encr_bit_a, encr_bit_b) pair, half-gates tables by (row,)
+GarbledTable = dict[tuple[int, ...], bytes]
+
+SCHEMES = ('classic', 'free_xor', 'half_gates')
+FREE_GATES = ('XOR', 'XNOR') # gates evaluated by XOR-ing labels under Free-XOR
+UNARY_GATES = ('NOT', 'BUF') # gates whose output labels are the input labels, in every scheme
+
+
+def is_free(gate: Gate, scheme: str) -> bool:
+    """Return True if the gate needs no garbled table under the given scheme."""
+    return gate.type in UNARY_GATES or (scheme != 'classic' and gate.type in FREE_GATES)
+
+
+def is_derived(gate: Gate, scheme: str) -> bool:
+    """Return True if the output keys of the gate are derived while garbling it."""
+    return is_free(gate, scheme) or scheme == 'half_gates'
+
+
+def half_gate_params(gate_type: str) -> tuple[int, int, int]:
+    """Write a 2-input gate as ((a ⊕ α) ∧ (b ⊕ β)) ⊕ γ and return (α, β, γ).
+
+    This works for every gate whose truth table has an odd number of ones (AND, OR,
+    NAND, NOR, GEQ, LEQ), i.e. all the binary gates of GateFunctions that are not free.
+    """
+    truth_table = {(a, b): int(GateFunctions[gate_type](a, b)) for a in (0, 1) for b in (0, 1)}
+    ones = [inputs for inputs, out in truth_table.items() if out == 1]
+    if len(ones) == 1:
+        (a, b), gamma = ones[0], 0
+    elif len(ones) == 3:
+        (a, b), gamma = next(inputs for inputs, out in truth_table.items() if out == 0), 1
+    else:
+        raise ValueError(f"{gate_type} gate can not be garbled with half-gates")
+    return 1 ^ a, 1 ^ b, gamma
+
+
+class GarblingStats(NamedTuple):
+    gates: int
+    tables: int
+    skipped_tables: int
+    table_bytes: int
+    bytes_per_and_gate: float # average table size of the non-free gates
 
 class GarbledGate():
     """A representation of a garbled gate. """
-    gate_type: str # XOR, AND, NAND, OR, NOR, XNOR, NOT
-    encryption_method: str
+    gate_type: str # XOR, AND, NAND, OR, NOR, XNOR, GEQ, LEQ, NOT, BUF
+    backend: CipherBackend
     kappa: int
     output: Id # id of the output wire
     pbits: dict[Id, int] # bits used to also encrypt the actual wire value
     keys: dict[Id, tuple[bytes,bytes]] # dict mapping each wire's id to pair of two keys/labels, one for 0 and one for 1
-    garbled_table: GarbledTable
+    scheme: str # classic, free_xor, half_gates
+    delta: bytes | None # global Free-XOR offset
+    seed: bytes | None # secret seed of reproducible garbling
+    garbled_table: GarbledTable | None # None if the gate is free
 
     def __init__(self, gate:Gate, 
             pbits: dict[Id, int], 
             keys: dict[Id, tuple[bytes,bytes]], 
-            encryption_method: str, 
-            kappa: int):
+            backend: CipherBackend, 
+            kappa: int,
+            scheme: str = 'classic',
+            delta: bytes | None = None,
+            seed: bytes | None = None):
         self.gate_type = gate.type
         self.output = gate.id
         self.inputs = gate.inputs
         self.pbits = pbits
         self.keys = keys
-        self.encryption_method = encryption_method
+        self.backend = backend
         self.kappa = kappa
-        self.gen_garbled_table()
+        self.scheme = scheme
+        self.delta = delta
+        self.seed = seed
+        if gate.type in UNARY_GATES:
+            self.gen_unary()
+        elif is_free(gate, scheme):
+            self.gen_free_xor()
+        elif scheme == 'half_gates':
+            self.gen_half_gates_table()
+        else:
+            self.gen_garbled_table()
+
+    def gen_unary(self):
+        """Derive the output keys and p-bit of a NOT or BUF gate.
+
+        The evaluator forwards its input key and encrypted bit unchanged. For a buffer
+        the output wire reuses the keys and p-bit of the input, for a NOT gate the two
+        keys are swapped and the p-bit flipped, so the same key decodes to the inverse.
+        """
+        key_zero, key_one = self.keys[self.inputs[0]]
+        negated = int(self.gate_type == 'NOT')
+        self.keys[self.output] = (key_one, key_zero) if negated else (key_zero, key_one)
+        self.pbits[self.output] = self.pbits[self.inputs[0]] ^ negated
+        self.garbled_table = None
+
+    def gen_free_xor(self):
+        """Derive the output keys and p-bit of a XOR/XNOR gate under Free-XOR.
+
+        The output 0-key is the XOR of the input 0-keys, so the evaluator obtains the
+        output key by XOR-ing its two input keys and no table is needed. XNOR is XOR
+        with the output keys swapped.
+        """
+        in_a, in_b, out = self.inputs[0], self.inputs[1], self.output
+        key_zero = xor_bytes(self.keys[in_a][0], self.keys[in_b][0])
+        pbit = self.pbits[in_a] ^ self.pbits[in_b]
+        if self.gate_type == 'XNOR':
+            key_zero = xor_bytes(key_zero, self.delta)
+            pbit ^= 1
+
+        self.keys[out] = (key_zero, xor_bytes(key_zero, self.delta))
+        self.pbits[out] = pbit
+        self.garbled_table = None
+
+    def composite(self, wire: Id, value: int) -> bytes:
+        """Return the key of a wire value followed by its encrypted bit (kappa+1 bytes)."""
+        return self.keys[wire][value] + bytes([self.pbits[wire] ^ value])
+
+    def gen_half_gates_table(self):
+        """Create the two-row table of a gate with the half-gates construction.
+
+        Keys are extended with their encrypted bit, so the offset becomes delta‖1 and the
+        encrypted bit of a wire is the point-and-permute bit. The output keys and p-bit
+        are derived from the table, like under Free-XOR.
+        """
+        in_a, in_b, out = self.inputs[0], self.inputs[1], self.output
+        alpha, beta, gamma = half_gate_params(self.gate_type)
+        offset = self.delta + b'\x01'
+        zero_row = bytes(self.kappa + 1)
+
+        key_a = self.composite(in_a, alpha)
+        key_b = self.composite(in_b, beta)
+        pbit_a, pbit_b = key_a[-1], key_b[-1]
+        hash_a = [self.backend.hash_label(2*out, key) for key in (key_a, xor_bytes(key_a, offset))]
+        hash_b = [self.backend.hash_label(2*out+1, key) for key in (key_b, xor_bytes(key_b, offset))]
+
+        # garbler half gate
+        table_g = xor_bytes(xor_bytes(hash_a[0], hash_a[1]), offset if pbit_b else zero_row)
+        key_g = xor_bytes(hash_a[0], table_g if pbit_a else zero_row)
+        # evaluator half gate
+        table_e = xor_bytes(xor_bytes(hash_b[0], hash_b[1]), key_a)
+        key_e = xor_bytes(hash_b[0], xor_bytes(table_e, key_a) if pbit_b else zero_row)
+
+        key_out = xor_bytes(key_g, key_e)
+        if gamma:
+            key_out = xor_bytes(key_out, offset)
+        label, pbit = key_out[:-1], key_out[-1] & 1
+        self.keys[out] = (label, xor_bytes(label, self.delta))
+        self.pbits[out] = pbit
+        self.garbled_table = {(0,): table_g, (1,): table_e}
 
 
     def gen_garbled_table(self):
@@ -36,55 +166,110 @@ class GarbledGate():
         """
         in_a, in_b, out = self.inputs[0], self.inputs[1], self.output
 
-        garbled_table = dict()
+        entries = [(encr_bit_a, encr_bit_b) for encr_bit_a in (0, 1) for encr_bit_b in (0, 1)]
+        # keys and p-bits may be recomputed from a seed on access, read them once
+        keys_a, keys_b, keys_out = self.keys[in_a], self.keys[in_b], self.keys[out]
+        pbit_a, pbit_b, pbit_out = self.pbits[in_a], self.pbits[in_b], self.pbits[out]
+        # with a seed the padding bits only depend on the gate and row, whoever garbles it
+        paddings = prf(self.seed, b'padding', out, 4) if self.seed else None
+        rows = []
         # For each entry in the garbled table
-        for encr_bit_a in (0, 1):
-            for encr_bit_b in (0, 1):
-                bit_a = encr_bit_a ^ self.pbits[in_a]
-                bit_b = encr_bit_b ^ self.pbits[in_b]
-                bit_out = int(GateFunctions[self.gate_type](bit_a, bit_b))
-                encr_bit_out = bit_out ^ self.pbits[out]
-                key_a = self.keys[in_a][bit_a]
-                key_b = self.keys[in_b][bit_b]
-                key_out = self.keys[out][bit_out]
-                msg = encode(key_out, encr_bit_out, self.kappa)
+        for encr_bit_a, encr_bit_b in entries:
+            bit_a = encr_bit_a ^ pbit_a
+            bit_b = encr_bit_b ^ pbit_b
+            bit_out = int(GateFunctions[self.gate_type](bit_a, bit_b))
+            padding = paddings[2*encr_bit_a + encr_bit_b] >> 2 if paddings else None
+            rows.append((keys_a[bit_a], keys_b[bit_b], encode(keys_out[bit_out], bit_out ^ pbit_out, self.kappa, padding)))
 
-                garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(self.output, key_a, key_b, msg, self.encryption_method, self.kappa)
-
-
-        self.garbled_table = garbled_table
+        # the pads of all four rows are derived in one backend call
+        self.garbled_table = dict(zip(entries, self.backend.encrypt_rows(self.output, rows)))
 
 
 class GarbledCircuit():
-    circuit: Circuit
-    wires: list[Id] # id of wires
+    circuit: Circuit # or a CompactCircuit
+    wires: Sequence[Id] # id of wires
     pbits: dict[Id, int] # bits used to also encrypt the actual wire value
     keys: dict[Id, tuple[bytes,bytes]] # dict mapping each wire's id to pair of two keys/labels, one for 0 and one for 1
     garbled_tables: dict[Id, GarbledTable] # dict mapping each wire's id to garbled table
+    labels: LabelGenerator | None # derives the keys and p-bits of the fresh wires from the seed
     kappa: int
     encryp_method: str
+    backend: CipherBackend # resolved once from encryption_method
+    scheme: str # classic, free_xor, half_gates
+    delta: bytes | None # global Free-XOR offset, key_1 = key_0 ⊕ delta for every wire
+    seed: bytes | None # if set, keys, p-bits and paddings are derived from it and garbling is reproducible
+
+    def __init__(self,circuit: Circuit, encryption_method: str, kappa: int, scheme: str = 'classic', seed: bytes | None = None):
+        with instrument.phase('garble.configure'):
+            self.configure(circuit, encryption_method, kappa, scheme, seed)
+        with instrument.phase('garble.wires'):
+            self.populate_wires()
+        with instrument.phase('garble.pbits'):
+            self.generate_pbits()
+        with instrument.phase('garble.keys'):
+            self.generate_keys()
+        with instrument.phase('garble.tables'):
+            self.generate_garbled_tables()
 
-    def __init__(self,circuit: Circuit, encryption_method: str, kappa: int):
+        recorder = instrument.active
+        if recorder is not None:
+            # seeded keys of fresh wires are not held, only the stored ones count
+            labels = len(getattr(self.keys, 'stored', self.keys))
+            recorder.gates_done('garbled', (gate.type for gate in circuit.gates), self.stats().table_bytes, labels, labels * (2*kappa + 1))
+
+    def configure(self, circuit: Circuit, encryption_method: str, kappa: int, scheme: str, seed: bytes | None = None):
+        """Check and store the garbling parameters."""
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown garbling scheme '{scheme}'")
         self.circuit = circuit
         self.kappa = kappa
         self.encryption_method = encryption_method
-
-        self.populate_wires()
-        self.generate_pbits()
-        self.generate_keys()
-        self.generate_garbled_tables()
+        self.backend = get_backend(encryption_method, kappa)
+        if scheme == 'half_gates' and not self.backend.hashes:
+            raise ValueError(f"half_gates scheme requires a hash method, not '{encryption_method}'")
+        self.scheme = scheme
+        self.seed = seed
+        self.delta = None
+        if scheme != 'classic':
+            self.delta = prf(seed, b'delta', 0, kappa) if seed else gen_label(kappa)
+        self.labels = LabelGenerator(seed, kappa, pairs=self.delta is None) if seed else None
 
     def populate_wires(self):
         """Populate list of wires' ids in this circuit."""
-        wires = set()
-        for gate in self.circuit.gates:
-            wires.add(gate.id)
-            wires.update(set(gate.inputs))
-        self.wires = list(wires)
-    
+        self.wires = self.circuit.wires()
+        # outputs of free gates (and of every gate under half-gates) get their keys and p-bits while garbling
+        self.derived = {gate.id for gate in self.circuit.gates if is_derived(gate, self.scheme)}
+
+    def fresh_keys(self, wire: Id) -> tuple[bytes, bytes]:
+        """Return a new pair of keys for a wire that is not derived from other wires."""
+        if self.labels:
+            key_zero, key_one = self.labels.keys(wire)
+        else:
+            key_zero = gen_label(self.kappa)
+            key_one = gen_label(self.kappa) if self.delta is None else None
+        if self.delta is None:
+            return key_zero, key_one
+        return key_zero, xor_bytes(key_zero, self.delta)
+
+    def fresh_pbit(self, wire: Id) -> int:
+        """Return a new p-bit for a wire that is not derived from other wires."""
+        if self.labels:
+            return self.labels.pbit(wire)
+        return flip_coin()
+
+    def fresh_wires(self) -> list[Id]:
+        return [wire_id for wire_id in self.wires if wire_id not in self.derived]
+
     def generate_keys(self):
-        """Create pair of keys for each wire value, i.e. 0 and 1."""
-        self.keys = {wire_id: (gen_label(self.kappa), gen_label(self.kappa)) for wire_id in self.wires}
+        """Create pair of keys for each wire value, i.e. 0 and 1.
+
+        With a seed the keys of fresh wires are recomputed from it when read, and only
+        the derived ones are stored.
+        """
+        if self.labels:
+            self.keys = SeededKeys(self.labels, self.delta, self.fresh_wires())
+        else:
+            self.keys = {wire_id: self.fresh_keys(wire_id) for wire_id in self.fresh_wires()}
 
     def generate_pbits(self):
         """
@@ -92,11 +277,39 @@ class GarbledCircuit():
 
         For each wire a random value ρ_i ∈ {0, 1} is chosen. This is used to also encrypt the actual wire value. If the actual wire value is v_i then the encrypted, or “external” value, is given by e_i = v_i ⊕ ρ_i.
         """
-        self.pbits = {wire_id: flip_coin() for wire_id in self.wires}
+        if self.labels:
+            self.pbits = SeededPbits(self.labels, self.fresh_wires())
+        else:
+            self.pbits = {wire_id: self.fresh_pbit(wire_id) for wire_id in self.fresh_wires()}
+
+    def garble_gate(self, gate: Gate) -> GarbledTable | None:
+        """Garble a single gate, returns None if the gate needs no table."""
+        return GarbledGate(gate, self.pbits, self.keys, self.backend, self.kappa, self.scheme, self.delta, self.seed).garbled_table
 
     def generate_garbled_tables(self):
-        """Create the garbled table of each gate."""
-        self.garbled_tables = {gate.id: GarbledGate(gate, self.pbits, self.keys, self.encryption_method, self.kappa).garbled_table for gate in self.circuit.gates}
+        """Create the garbled table of each gate.
+
+        Gates are garbled in topological order because free gates derive their
+        output keys from the keys of their inputs.
+        """
+        self.garbled_tables = {}
+        for gate in topological_order(self.circuit):
+            garbled_table = self.garble_gate(gate)
+            if garbled_table is not None:
+                self.garbled_tables[gate.id] = garbled_table
+
+    def stats(self) -> GarblingStats:
+        """Report how many gates were garbled, how many tables were skipped and the table sizes."""
+        gates = len(self.circuit.gates)
+        tables = len(self.garbled_tables)
+        table_bytes = sum(len(row) for table in self.garbled_tables.values() for row in table.values())
+        bytes_per_and_gate = table_bytes / tables if tables else 0.0
+        return GarblingStats(gates, tables, gates - tables, table_bytes, bytes_per_and_gate)
+
+    def write(self, path: str):
+        """Write the tables and output p-bits in the binary format read by garbled_file.GarbledFile."""
+        with open(path, 'wb') as file:
+            write_garbled(self, file)
 
     def get_pbits_out(self):
         return {wire: self.pbits[wire] for wire in self.circuit.out}
@@ -0,0 +1,168 @@
+import mmap
+import os
+import struct
+from typing import BinaryIO, Iterator, Mapping
+
+import numpy as np
+
+from circuit import Id
+
+# Layout, little endian:
+#   header   magic, version, kappa, rows per table, number of tables / alice / bob / out wires,
+#            encryption method and scheme names, zero padded to a multiple of 8 bytes
+#   gate ids int64 id of each gate with a table, ascending (topological order)
+#   rows     rows per table × (kappa+1) bytes per gate, in gate order
+#   inputs   int64 ids of Alice's then Bob's wires
+#   outputs  int64 ids of the output wires, then one uint8 p-bit per output wire
+MAGIC = b'GCBF'
+VERSION = 1
+HEADER = struct.Struct('<4sBxHIIIIIBB')
+
+
+def align(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def write_garbled(garbled_circuit, file: BinaryIO):
+    """Write the evaluator's view of a GarbledCircuit: tables, wire ids and output p-bits."""
+    circuit = garbled_circuit.circuit
+    tables = [(gate.id, garbled_circuit.garbled_tables[gate.id]) for gate in circuit.sorted_gates()
+            if gate.id in garbled_circuit.garbled_tables]
+    rows_per_table = len(tables[0][1]) if tables else 0
+    method = garbled_circuit.encryption_method.encode()
+    scheme = garbled_circuit.scheme.encode()
+
+    header = HEADER.pack(MAGIC, VERSION, garbled_circuit.kappa, rows_per_table, len(tables),
+            len(circuit.alice), len(circuit.bob), len(circuit.out), len(method), len(scheme)) + method + scheme
+    file.write(header + bytes(align(len(header)) - len(header)))
+    file.write(np.array([gate_id for gate_id, _ in tables], dtype='<i8').tobytes())
+    rows = b''.join(row for _, table in tables for _, row in sorted(table.items()))
+    file.write(rows + bytes(align(len(rows)) - len(rows)))
+    file.write(np.array(circuit.alice + circuit.bob + circuit.out, dtype='<i8').tobytes())
+    file.write(bytes(garbled_circuit.get_pbits_out()[wire] for wire in circuit.out))
+
+
+class FileTable(Mapping):
+    """The rows of one gate, indexed like a GarbledTable and returned as memoryviews."""
+
+    def __init__(self, rows: memoryview, stride: int):
+        self.rows = rows
+        self.stride = stride
+
+    def __getitem__(self, entry: tuple[int, ...]) -> memoryview:
+        # (encr_bit_a, encr_bit_b) is row 2*a+b, half-gates (row,) is row
+        index = 2*entry[0] + entry[1] if len(entry) == 2 else entry[0]
+        return self.rows[index*self.stride:(index+1)*self.stride]
+
+    def __iter__(self) -> Iterator[tuple[int, ...]]:
+        if len(self) == 4:
+            return iter([(0, 0), (0, 1), (1, 0), (1, 1)])
+        return iter([(row,) for row in range(len(self))])
+
+    def __len__(self) -> int:
+        return len(self.rows) // self.stride
+
+
+class FileTables(Mapping):
+    """Mapping from gate id to FileTable over the rows of a GarbledFile, nothing is copied."""
+
+    def __init__(self, ids: np.ndarray, rows: memoryview, table_size: int, stride: int):
+        self.ids = ids
+        self.rows = rows
+        self.table_size = table_size
+        self.stride = stride
+
+    def position(self, gate_id: Id) -> int:
+        position = int(np.searchsorted(self.ids, gate_id))
+        if position == len(self.ids) or self.ids[position] != gate_id:
+            raise KeyError(gate_id)
+        return position
+
+    def __getitem__(self, gate_id: Id) -> FileTable:
+        start = self.position(gate_id) * self.table_size
+        return FileTable(self.rows[start:start+self.table_size], self.stride)
+
+    def __contains__(self, gate_id: object) -> bool:
+        try:
+            self.position(gate_id)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[Id]:
+        return iter(self.ids.tolist())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class GarbledFile():
+    """Read a garbled circuit written by GarbledCircuit.write.
+
+    The file is memory-mapped and the tables are served as memoryviews of the mapping,
+    so several evaluator processes can share one copy through the page cache. Pass
+    tables and pbits_out to yao.evaluate.
+    """
+    kappa: int
+    encryption_method: str
+    scheme: str
+    alice: list[Id]
+    bob: list[Id]
+    out: list[Id]
+    pbits_out: dict[Id, int]
+    tables: FileTables
+
+    def __init__(self, source: str | os.PathLike | bytes | memoryview):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as file:
+                self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mapped)
+        else:
+            self.mapped = None
+            self.buffer = memoryview(source)
+        self.parse()
+
+    def parse(self):
+        (magic, version, self.kappa, rows_per_table, n_tables, n_alice, n_bob, n_out,
+                method_size, scheme_size) = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a garbled circuit file')
+        offset = HEADER.size
+        self.encryption_method = bytes(self.buffer[offset:offset+method_size]).decode()
+        offset += method_size
+        self.scheme = bytes(self.buffer[offset:offset+scheme_size]).decode()
+        offset = align(offset + scheme_size)
+
+        # copied, an array over the buffer would keep it exported and block close()
+        ids = np.frombuffer(self.buffer, dtype='<i8', count=n_tables, offset=offset).copy()
+        offset += ids.nbytes
+        stride = self.kappa + 1
+        table_size = rows_per_table * stride
+        rows = self.buffer[offset:offset + n_tables*table_size]
+        offset = align(offset + n_tables*table_size)
+        self.tables = FileTables(ids, rows, table_size, stride)
+
+        wires = np.frombuffer(self.buffer, dtype='<i8', count=n_alice+n_bob+n_out, offset=offset).tolist()
+        offset += 8 * len(wires)
+        self.alice, self.bob, self.out = wires[:n_alice], wires[n_alice:n_alice+n_bob], wires[n_alice+n_bob:]
+        self.pbits_out = dict(zip(self.out, bytes(self.buffer[offset:offset+n_out])))
+
+    def close(self):
+        """Release the mapping.
+
+        Tables and rows handed out before stay valid: while they are referenced the
+        mapping can not be closed, and it is unmapped once they are garbage collected.
+        """
+        self.tables = None
+        self.buffer.release()
+        if self.mapped is not None:
+            try:
+                self.mapped.close()
+            except BufferError:
+                pass
+
+    def __enter__(self) -> 'GarbledFile':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,185 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator
+
+PROFILE_LIMIT = 25 # functions listed in the exported profile
+
+# the recorder of the current recording, hooks do nothing while it is None
+active: 'Recorder | None' = None
+_disabled = nullcontext()
+
+
+class CountingBackend():
+    """Cipher backend proxy counting pad derivations and label hashes.
+
+    Calls are counted where they enter the backend, so a backend method using
+    another one internally is only counted once. Backends are used from several
+    threads (runtime, pool), so the counts are updated under the recorder's lock.
+    """
+
+    def __init__(self, backend, counts: Counter, lock: threading.Lock):
+        self.backend = backend
+        self.counts = counts
+        self.lock = lock
+
+    def count(self, name: str, calls: int):
+        with self.lock:
+            self.counts[name] += calls
+
+    def __getattr__(self, name: str):
+        return getattr(self.backend, name)
+
+    def __reduce__(self):
+        # counting is not part of the state, pickles as the wrapped backend
+        return self.backend.__reduce__()
+
+    def derive_key(self, index: int, key_one: bytes, key_two: bytes) -> bytes:
+        self.count('pads', 1)
+        return self.backend.derive_key(index, key_one, key_two)
+
+    def derive_keys(self, index: int, pairs: Iterable) -> list[bytes]:
+        pads = self.backend.derive_keys(index, pairs)
+        self.count('pads', len(pads))
+        return pads
+
+    def encrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        self.count('pads', 1)
+        return self.backend.encrypt(index, key_one, key_two, value)
+
+    def decrypt(self, index: int, key_one: bytes, key_two: bytes, value: bytes) -> bytes:
+        self.count('pads', 1)
+        return self.backend.decrypt(index, key_one, key_two, value)
+
+    def encrypt_rows(self, index: int, rows: list) -> list[bytes]:
+        self.count('pads', len(rows))
+        return self.backend.encrypt_rows(index, rows)
+
+    def hash_label(self, index: int, label: bytes) -> bytes:
+        self.count('label_hashes', 1)
+        return self.backend.hash_label(index, label)
+
+
+class Recorder():
+    """Measurements collected between start() and stop(), see record()."""
+    phases: dict[str, list] # name -> [calls, seconds]
+    gates: dict[str, Counter] # 'garbled' and 'evaluated' gates by type
+    hashes: Counter # 'pads' and 'label_hashes'
+    table_bytes: Counter # 'produced' and 'consumed'
+    peak_labels: int # most labels held at once by one garbler or evaluator
+    peak_label_bytes: int
+
+    def __init__(self, profile: bool = False):
+        self.phases = {}
+        self.gates = {'garbled': Counter(), 'evaluated': Counter()}
+        self.hashes = Counter()
+        self.table_bytes = Counter()
+        self.peak_labels = self.peak_label_bytes = 0
+        self.lock = threading.Lock()
+        self.profiler = cProfile.Profile() if profile else None
+
+    def start(self):
+        global active
+        if active is not None:
+            raise RuntimeError("A recording is already active")
+        active = self
+        if self.profiler:
+            self.profiler.enable()
+
+    def stop(self):
+        global active
+        if self.profiler:
+            self.profiler.disable()
+        active = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                calls_seconds = self.phases.setdefault(name, [0, 0.0])
+                calls_seconds[0] += 1
+                calls_seconds[1] += elapsed
+
+    def gates_done(self, kind: str, gate_types: Iterable[str], table_bytes: int, labels: int, label_bytes: int):
+        counts = Counter(gate_types)
+        with self.lock:
+            self.gates[kind].update(counts)
+            self.table_bytes['produced' if kind == 'garbled' else 'consumed'] += table_bytes
+            self.peak_labels = max(self.peak_labels, labels)
+            self.peak_label_bytes = max(self.peak_label_bytes, label_bytes)
+
+    def profile(self, limit: int = PROFILE_LIMIT) -> list[dict]:
+        """The functions with the highest cumulative time, like pstats sorted by 'cumulative'."""
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler).sort_stats('cumulative')
+        rows = []
+        for function in stats.fcn_list[:limit]:
+            _, calls, tottime, cumtime, _ = stats.stats[function]
+            filename, line, name = function
+            rows.append({'function': f"{filename}:{line}({name})", 'calls': calls, 'tottime': tottime, 'cumtime': cumtime})
+        return rows
+
+    def dump_profile(self, path: str):
+        """Write the raw profile, readable with pstats or snakeviz."""
+        if self.profiler is None:
+            raise ValueError("The recording was not profiled")
+        self.profiler.dump_stats(path)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            result = {
+                'phases': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.phases.items()},
+                'gates': {kind: dict(counts) for kind, counts in self.gates.items()},
+                'hashes': {'pads': self.hashes['pads'], 'label_hashes': self.hashes['label_hashes']},
+                'table_bytes': {'produced': self.table_bytes['produced'], 'consumed': self.table_bytes['consumed']},
+                'labels': {'peak': self.peak_labels, 'peak_bytes': self.peak_label_bytes},
+            }
+        if self.profiler:
+            result['profile'] = self.profile()
+        return result
+
+    def to_json(self, indent: int | None = 2) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+
+@contextmanager
+def record(profile: bool = False) -> Iterator[Recorder]:
+    """Record garbling and evaluation metrics of the code run in the block.
+
+    With profile=True the block also runs under cProfile. Only one recording can be
+    active at a time; it collects from every thread but not from worker processes.
+
+        with instrument.record() as recorder:
+            garbled_circuit = GarbledCircuit(circuit, 'blake2', 16, 'half_gates')
+        print(recorder.to_json())
+    """
+    recorder = Recorder(profile)
+    recorder.start()
+    try:
+        yield recorder
+    finally:
+        recorder.stop()
+
+
+# hooks called from the garbling and evaluation code, cheap no-ops when not recording;
+# code that has more to report checks 'active' itself
+
+def phase(name: str):
+    """Context manager timing a phase, a shared null context when not recording."""
+    recorder = active
+    return recorder.phase(name) if recorder is not None else _disabled
+
+
+def backend(backend):
+    """Wrap a cipher backend to count its hash invocations while recording."""
+    recorder = active
+    return CountingBackend(backend, recorder.hashes, recorder.lock) if recorder is not None else backend
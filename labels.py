@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from hashlib import shake_256
+from typing import Iterable, Iterator, TypeVar
+
+from circuit import Id
+from utils import xor_bytes
+
+BLOCK_WIRES = 1024 # wires whose labels and p-bits are derived by one SHAKE call
+CACHED_BLOCKS = 4 # most recently used blocks kept around
+
+Value = TypeVar('Value')
+
+
+class LabelGenerator():
+    """Derive the keys and p-bit of every wire from a secret seed.
+
+    Wires are grouped in blocks of BLOCK_WIRES consecutive ids and a block is one
+    SHAKE-256 output keyed by the seed and the block index: the 0-keys of its wires,
+    their 1-keys when there is no global offset, then one p-bit per wire. A few recent
+    blocks are cached, so garbling in id order costs one hash per block.
+    """
+    seed: bytes
+    kappa: int
+    pairs: bool # True if both keys are random, i.e. without a Free-XOR offset
+
+    def __init__(self, seed: bytes, kappa: int, pairs: bool):
+        self.seed = seed
+        self.kappa = kappa
+        self.pairs = pairs
+        self.key_bytes = kappa * (2 if pairs else 1)
+        self.blocks: OrderedDict[int, bytes] = OrderedDict() # least recently used first
+
+    def block(self, index: int) -> bytes:
+        block = self.blocks.get(index)
+        if block is None:
+            if len(self.blocks) >= CACHED_BLOCKS:
+                self.blocks.popitem(last=False)
+            prefix = self.seed + b'labels' + index.to_bytes(8, 'big', signed=True)
+            block = self.blocks[index] = shake_256(prefix).digest(BLOCK_WIRES * self.key_bytes + BLOCK_WIRES // 8)
+        else:
+            self.blocks.move_to_end(index)
+        return block
+
+    def keys(self, wire: Id) -> tuple[bytes, bytes | None]:
+        """The 0-key of a wire and its 1-key, None if it is derived from a global offset."""
+        index, position = divmod(wire, BLOCK_WIRES)
+        block = self.block(index)
+        start = position * self.key_bytes
+        key_zero = block[start:start+self.kappa]
+        return key_zero, block[start+self.kappa:start+self.key_bytes] if self.pairs else None
+
+    def pbit(self, wire: Id) -> int:
+        index, position = divmod(wire, BLOCK_WIRES)
+        return self.block(index)[BLOCK_WIRES * self.key_bytes + position // 8] >> (position % 8) & 1
+
+
+class DerivedMap(MutableMapping[Id, Value]):
+    """Mapping of wires to values that are recomputed on access instead of stored.
+
+    Only values assigned explicitly, the derived wires, are stored; they take
+    precedence and deleting a wire forgets them. Iteration covers the stored wires
+    and the given fresh ones.
+    """
+
+    def __init__(self, fresh: Iterable[Id] = ()):
+        self.fresh = fresh
+        self.stored: dict[Id, Value] = {}
+
+    def derive(self, wire: Id) -> Value:
+        raise NotImplementedError
+
+    def __getitem__(self, wire: Id) -> Value:
+        if wire in self.stored:
+            return self.stored[wire]
+        return self.derive(wire)
+
+    def __setitem__(self, wire: Id, value: Value):
+        self.stored[wire] = value
+
+    def __delitem__(self, wire: Id):
+        # fresh values can always be recomputed, there is nothing to free
+        self.stored.pop(wire, None)
+
+    def __iter__(self) -> Iterator[Id]:
+        yield from self.stored
+        yield from (wire for wire in self.fresh if wire not in self.stored)
+
+    def __len__(self) -> int:
+        return len(self.stored) + sum(wire not in self.stored for wire in self.fresh)
+
+
+class SeededKeys(DerivedMap[tuple[bytes, bytes]]):
+    """Key pairs of the wires, with the 1-key offset by delta under Free-XOR."""
+
+    def __init__(self, generator: LabelGenerator, delta: bytes | None, fresh: Iterable[Id] = ()):
+        super().__init__(fresh)
+        self.generator = generator
+        self.delta = delta
+
+    def derive(self, wire: Id) -> tuple[bytes, bytes]:
+        key_zero, key_one = self.generator.keys(wire)
+        return key_zero, key_one if self.delta is None else xor_bytes(key_zero, self.delta)
+
+
+class SeededPbits(DerivedMap[int]):
+    """Point-and-permute bits of the wires."""
+
+    def __init__(self, generator: LabelGenerator, fresh: Iterable[Id] = ()):
+        super().__init__(fresh)
+        self.generator = generator
+
+    def derive(self, wire: Id) -> int:
+        return self.generator.pbit(wire)
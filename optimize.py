@@ -0,0 +1,183 @@
+import random
+from typing import NamedTuple
+
+from circuit import Circuit, Gate, GateFunctions, Id, topological_order
+from garbled_circuit import FREE_GATES, UNARY_GATES
+from simulate import exhaustive_inputs, simulate
+
+# A wire of the optimized circuit with a polarity, (wire, 1) stands for NOT wire.
+# Constants are (None, value).
+Literal = tuple[Id | None, int]
+
+SYMMETRIC = {'AND', 'OR', 'XOR', 'NAND', 'NOR', 'XNOR'}
+COMPLEMENT = {'AND': 'NAND', 'NAND': 'AND', 'OR': 'NOR', 'NOR': 'OR', 'XOR': 'XNOR', 'XNOR': 'XOR'}
+EXHAUSTIVE_INPUTS = 12 # circuits with more inputs are verified on random assignments
+
+
+def truth_table(gate_type: str) -> int:
+    """Truth table of a binary gate type, bit 2x+y holds the output for inputs x, y."""
+    return sum(int(bool(GateFunctions[gate_type](x, y))) << (2*x + y) for x in (0, 1) for y in (0, 1))
+
+
+def canonical_forms() -> dict[int, tuple[str, bool, int]]:
+    """Map each binary function depending on both inputs to (gate type, swap inputs, negated output).
+
+    Functions are realised without negation whenever a gate type exists for them;
+    the other ones (x | ~y and ~x | y) are a GEQ or LEQ with a negated output.
+    """
+    forms = {}
+    for negated in (0, 1):
+        for gate_type in ('AND', 'OR', 'XOR', 'NAND', 'NOR', 'XNOR', 'GEQ', 'LEQ'):
+            table = truth_table(gate_type)
+            for swap in (False, True):
+                swapped = sum((table >> (2*y + x) & 1) << (2*x + y) for x in (0, 1) for y in (0, 1)) if swap else table
+                forms.setdefault(swapped ^ (15 * negated), (gate_type, swap, negated))
+    return forms
+
+
+CANONICAL = canonical_forms()
+
+
+class OptimizationReport(NamedTuple):
+    gates_before: int
+    gates_after: int
+    non_free_before: int # gates with a table under Free-XOR and half-gates
+    non_free_after: int
+    folded: int # gates replaced by a constant, a copy or an inverse of another wire
+    merged: int # duplicate gates merged by structural hashing
+    dead: int # gates whose output no output depends on
+
+    def __str__(self) -> str:
+        return (f"{self.gates_before} -> {self.gates_after} gates, {self.non_free_before} -> {self.non_free_after} non-free "
+                f"({self.folded} folded, {self.merged} merged, {self.dead} dead)")
+
+
+class Optimizer():
+    """Rewrite a circuit gate by gate in topological order.
+
+    Every wire is mapped to a Literal. Inputs that are constants or inverted are
+    substituted into the truth table of each gate, so constants propagate and
+    inverters are absorbed into the gate types of their readers. Gates left with a
+    function of one wire or none become literals too, and the remaining ones are
+    looked up by (type, inputs) so that duplicates are merged.
+    """
+
+    def __init__(self, circuit: Circuit):
+        self.circuit = circuit
+        self.literals: dict[Id, Literal] = {wire: (wire, 0) for wire in circuit.alice + circuit.bob}
+        self.gates: dict[Id, Gate] = {}
+        self.structure: dict[tuple, Id] = {}
+        self.next_id = max(circuit.alice + circuit.bob + [gate.id for gate in circuit.gates], default=0) + 1
+        self.folded = self.merged = 0
+
+    def reduce(self, gate: Gate) -> Literal:
+        """Literal of the output of a gate of the original circuit."""
+        function = GateFunctions[gate.type]
+        literals = [self.literals[wire] for wire in gate.inputs]
+        wires = list(dict.fromkeys(wire for wire, _ in literals if wire is not None))
+
+        # truth table over the distinct wires, the first wire is the most significant bit of the row as in truth_table
+        table = 0
+        for assignment in range(1 << len(wires)):
+            bits = {wire: assignment >> (len(wires) - 1 - k) & 1 for k, wire in enumerate(wires)}
+            values = [negated if wire is None else bits[wire] ^ negated for wire, negated in literals]
+            table |= int(bool(function(*values))) << assignment
+
+        if len(wires) == 2:
+            x, y = wires
+            if table in (0, 15):
+                return self.fold((None, table & 1))
+            if (table >> 2 & 3) == (table & 3): # output ignores x
+                return self.fold((y, table & 1))
+            if (table >> 1 & 5) == (table & 5): # output ignores y
+                return self.fold((x, table & 1))
+            gate_type, swap, negated = CANONICAL[table]
+            return self.emit(gate.id, gate_type, [y, x] if swap else [x, y]), negated
+        if len(wires) == 1:
+            if table in (0, 3):
+                return self.fold((None, table & 1))
+            return self.fold((wires[0], table & 1))
+        return self.fold((None, table))
+
+    def fold(self, literal: Literal) -> Literal:
+        self.folded += 1
+        return literal
+
+    def emit(self, gate_id: Id, gate_type: str, inputs: list[Id]) -> Id:
+        """Add a gate unless an equivalent one exists, and return its output wire."""
+        key = (gate_type, *inputs)
+        if gate_type in SYMMETRIC:
+            key = (gate_type, min(inputs), max(inputs))
+        elif gate_type == 'LEQ': # ~x & y is GEQ(y, x)
+            key = ('GEQ', inputs[1], inputs[0])
+        if key in self.structure:
+            self.merged += 1
+            return self.structure[key]
+        self.structure[key] = gate_id
+        self.gates[gate_id] = Gate(gate_id, gate_type, inputs)
+        return gate_id
+
+    def output(self, literal: Literal, read: set[Id]) -> Id:
+        """Wire carrying a literal, adding a gate for constants and negations.
+
+        A negated gate output becomes the complementary gate when nothing else reads
+        the gate, which then dies, and a free NOT gate otherwise.
+        """
+        wire, negated = literal
+        any_input = (self.circuit.alice + self.circuit.bob)[0]
+        if wire is None: # XOR(x, x) = 0 and XNOR(x, x) = 1 are free
+            return self.emit(self.fresh(), 'XNOR' if negated else 'XOR', [any_input, any_input])
+        if not negated:
+            return wire
+        gate = self.gates.get(wire)
+        if gate is not None and gate.type in COMPLEMENT and wire not in read:
+            return self.emit(self.fresh(), COMPLEMENT[gate.type], gate.inputs)
+        return self.emit(self.fresh(), 'NOT', [wire])
+
+    def fresh(self) -> Id:
+        self.next_id += 1
+        return self.next_id - 1
+
+    def run(self) -> Circuit:
+        for gate in topological_order(self.circuit):
+            self.literals[gate.id] = self.reduce(gate)
+        outputs = [self.literals[wire] for wire in self.circuit.out]
+        read = {wire for gate in self.gates.values() for wire in gate.inputs} | {wire for wire, negated in outputs if not negated}
+        out = [self.output(literal, read) for literal in outputs]
+
+        live = set(out)
+        gates = []
+        for gate in reversed(self.gates.values()):
+            if gate.id in live:
+                live.update(gate.inputs)
+                gates.append(gate)
+        return Circuit(self.circuit.name, list(self.circuit.alice), list(self.circuit.bob), out, gates[::-1])
+
+
+def non_free(circuit: Circuit) -> int:
+    return sum(gate.type not in FREE_GATES + UNARY_GATES for gate in circuit.gates)
+
+
+def optimize(circuit: Circuit) -> tuple[Circuit, OptimizationReport]:
+    """Return an equivalent circuit with constants folded, inverters absorbed, duplicates merged and dead gates removed.
+
+    Inputs and surviving gates keep their ids. Outputs keep their order but may be
+    carried by other wires, e.g. an input or an equivalent gate.
+    """
+    optimizer = Optimizer(circuit)
+    optimized = optimizer.run()
+    emitted = len(optimizer.gates)
+    report = OptimizationReport(len(circuit.gates), len(optimized.gates), non_free(circuit), non_free(optimized),
+            optimizer.folded, optimizer.merged, emitted - len(optimized.gates))
+    return optimized, report
+
+
+def equivalent(circuit: Circuit, optimized: Circuit, width: int = 4096) -> bool:
+    """Compare two circuits with the same inputs on all assignments, or 'width' random ones for large circuits."""
+    wires = circuit.alice + circuit.bob
+    if len(wires) <= EXHAUSTIVE_INPUTS:
+        inputs, width = exhaustive_inputs(circuit)
+    else:
+        inputs = {wire: random.getrandbits(width) for wire in wires}
+    expected, actual = simulate(circuit, inputs, width), simulate(optimized, inputs, width)
+    return all(expected[before] == actual[after] for before, after in zip(circuit.out, optimized.out))
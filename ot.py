@@ -0,0 +1,260 @@
+import secrets
+from functools import lru_cache
+from hashlib import shake_256
+
+import numpy as np
+
+from algebra import PrimeCyclicGroup
+from utils import xor_bytes
+
+SECURITY = 128 # number of base OTs, the public-key operations paid once per session
+# 2048-bit MODP group of RFC 3526, a safe prime p = 2q + 1 where 2 generates the subgroup of order q
+OT_PRIME = int(
+    'FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74020BBEA63B139B22514A08798E3404DD'
+    'EF9519B3CD3A431B302B0A6DF25F14374FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED'
+    'EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF0598DA48361C55D39A69163FA8FD24CF5F'
+    '83655D23DCA3AD961C62F356208552BB9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B'
+    'E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF6955817183995497CEA956AE515D2261898FA0510'
+    '15728E5A8AACAA68FFFFFFFFFFFFFFFF', 16)
+OT_GENERATOR = 2
+
+# the two messages of an OT sender, indexed by the choice bit
+MessagePair = tuple[bytes, bytes]
+
+
+def residue_group(prime: int, generator: int = 4) -> PrimeCyclicGroup:
+    """Group of the quadratic residues mod a safe prime, of prime order (p-1)/2.
+
+    Any square other than 1 generates it, so both parties agree on a fixed generator.
+    """
+    return PrimeCyclicGroup(prime, generator, (prime - 1) // 2)
+
+
+@lru_cache(maxsize=None)
+def default_group() -> PrimeCyclicGroup:
+    return residue_group(OT_PRIME, OT_GENERATOR)
+
+
+def secret_exponent(group: PrimeCyclicGroup) -> int:
+    """Uniform exponent in [1, q-1] from the OS CSPRNG, q the order of the generator."""
+    return secrets.randbelow(group.order - 1) + 1
+
+
+def hash_elements(index: int, elements: tuple[int, ...], group: PrimeCyclicGroup, size: int) -> bytes:
+    """Hash group elements together with the index of an OT to 'size' bytes."""
+    width = (group.prime.bit_length() + 7) // 8
+    return shake_256(index.to_bytes(8, 'big') + b''.join(e.to_bytes(width, 'big') for e in elements)).digest(size)
+
+
+def hash_row(index: int, row: bytes, size: int) -> bytes:
+    """Correlation robust hash turning a row of the OT extension matrix into a pad."""
+    return shake_256(index.to_bytes(8, 'big') + row).digest(size)
+
+
+def expand(seed: bytes, batch: int, count: int) -> np.ndarray:
+    """PRG stretching a base OT key to a column of 'count' bits, one uint8 per bit."""
+    stream = np.frombuffer(shake_256(batch.to_bytes(8, 'big') + seed).digest((count + 7) // 8), dtype=np.uint8)
+    return np.unpackbits(stream)[:count]
+
+
+def rows(columns: np.ndarray) -> list[bytes]:
+    """Transpose a security × count bit matrix into 'count' rows packed as bytes."""
+    return [row.tobytes() for row in np.packbits(columns.T, axis=1)]
+
+
+class BaseOTSender():
+    """Sender of a batch of base OTs over a PrimeCyclicGroup (Chou-Orlandi).
+
+    The sender publishes A = g^a and derives both keys of every OT from the reply B
+    of the receiver, B^a for choice 0 and (B/A)^a for choice 1.
+    """
+
+    def __init__(self, group: PrimeCyclicGroup, size: int = SECURITY // 8):
+        self.group = group
+        self.size = size
+        self.secret = secret_exponent(group)
+        self.public = group.gen_pow(self.secret)
+
+    def keys(self, replies: list[int]) -> list[MessagePair]:
+        group = self.group
+        unblind = group.pow(group.inv(self.public), self.secret) # A^-a
+        keys = []
+        for index, reply in enumerate(replies):
+            shared = group.pow(reply, self.secret)
+            keys.append((hash_elements(index, (self.public, reply, shared), group, self.size),
+                    hash_elements(index, (self.public, reply, group.mul(shared, unblind)), group, self.size)))
+        return keys
+
+
+class BaseOTReceiver():
+    """Receiver of a batch of base OTs, replies B = g^b or A·g^b and learns the chosen keys."""
+
+    def __init__(self, group: PrimeCyclicGroup, choices: list[int], size: int = SECURITY // 8):
+        self.group = group
+        self.size = size
+        self.choices = choices
+        self.secrets = [secret_exponent(group) for _ in choices]
+
+    def reply(self, public: int) -> list[int]:
+        group = self.group
+        self.public = public
+        self.replies = [group.mul(power, public) if choice else power
+                for power, choice in zip(group.gen_pow_many(self.secrets), self.choices)]
+        return self.replies
+
+    def keys(self) -> list[bytes]:
+        group = self.group
+        # A generates the subgroup as well, which checks it and gives its powers a fixed-base table
+        shared = PrimeCyclicGroup(group.prime, self.public, group.order).gen_pow_many(self.secrets)
+        return [hash_elements(index, (self.public, reply, power), group, self.size)
+                for index, (reply, power) in enumerate(zip(self.replies, shared))]
+
+
+class ExtensionSender():
+    """Sender of IKNP OT extension, the party owning the messages (the garbler).
+
+    It is the receiver of the 'security' base OTs, with a secret random choice vector
+    s. Each call of extend turns the receiver's correction matrix u into 'count'
+    random message pairs with hashing only: row q_i of the matrix is t_i ^ c_i·s, so
+    H(q_i) and H(q_i ^ s) are the two pads and the receiver knows the c_i-th one.
+    """
+
+    def __init__(self, group: PrimeCyclicGroup | None = None, security: int = SECURITY):
+        self.security = security
+        self.choices = np.array([secrets.randbits(1) for _ in range(security)], dtype=np.uint8)
+        self.delta = np.packbits(self.choices).tobytes()
+        self.base = BaseOTReceiver(group or default_group(), self.choices.tolist())
+        self.batch = 0
+        self.extended = 0 # OTs extended so far, the tweak of the next one
+
+    def base_reply(self, public: int) -> list[int]:
+        """Answer the first base OT message of the ExtensionReceiver."""
+        replies = self.base.reply(public)
+        self.seeds = self.base.keys()
+        return replies
+
+    def extend(self, corrections: np.ndarray, size: int) -> list[MessagePair]:
+        """Derive random message pairs of 'size' bytes from the receiver's corrections."""
+        count = corrections.shape[1]
+        columns = np.array([expand(seed, self.batch, count) for seed in self.seeds], dtype=np.uint8).reshape(self.security, count)
+        columns ^= corrections * self.choices[:, None]
+        self.batch += 1
+        start, self.extended = self.extended, self.extended + count
+        return [(hash_row(index, row, size), hash_row(index, xor_bytes(row, self.delta), size))
+                for index, row in enumerate(rows(columns), start)]
+
+
+class ExtensionReceiver():
+    """Receiver of IKNP OT extension (the evaluator), the sender of the base OTs."""
+
+    def __init__(self, group: PrimeCyclicGroup | None = None, security: int = SECURITY):
+        self.security = security
+        self.base = BaseOTSender(group or default_group())
+        self.batch = 0
+        self.extended = 0 # OTs extended so far, the tweak of the next one
+
+    def base_public(self) -> int:
+        """First base OT message, A."""
+        return self.base.public
+
+    def base_keys(self, replies: list[int]):
+        self.seeds = self.base.keys(replies)
+
+    def extend(self, count: int, size: int) -> tuple[np.ndarray, list[int], list[bytes]]:
+        """Prepare 'count' random OTs of 'size' bytes with random choice bits.
+        Returns:
+            The security × count correction matrix for the sender, the choice bits and
+            the chosen messages.
+        """
+        choices = np.array([secrets.randbits(1) for _ in range(count)], dtype=np.uint8)
+        columns = np.empty((self.security, count), dtype=np.uint8)
+        corrections = np.empty((self.security, count), dtype=np.uint8)
+        for j, (seed_zero, seed_one) in enumerate(self.seeds):
+            columns[j] = expand(seed_zero, self.batch, count)
+            corrections[j] = columns[j] ^ expand(seed_one, self.batch, count) ^ choices
+        self.batch += 1
+        start, self.extended = self.extended, self.extended + count
+        return corrections, choices.tolist(), [hash_row(index, row, size) for index, row in enumerate(rows(columns), start)]
+
+
+class RandomOTSenderPool():
+    """Random OT pairs precomputed offline and consumed online by transfer."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.pairs: list[MessagePair] = []
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def add(self, pairs: list[MessagePair]):
+        self.pairs.extend(pairs)
+
+    def transfer(self, messages: list[MessagePair], flips: list[int]) -> list[MessagePair]:
+        """Mask message pairs with the next random OTs.
+
+        flips are the bits d = b ^ c sent by the receiver, so message x_b is masked
+        with the random message the receiver knows.
+        """
+        if len(messages) > len(self.pairs):
+            raise ValueError(f"Only {len(self.pairs)} precomputed OTs left for {len(messages)} transfers")
+        if any(len(message) != self.size for pair in messages for message in pair):
+            raise ValueError(f"Messages must be {self.size} bytes long")
+        pairs, self.pairs = self.pairs[:len(messages)], self.pairs[len(messages):]
+        return [(xor_bytes(x_zero, pair[flip]), xor_bytes(x_one, pair[1 ^ flip]))
+                for (x_zero, x_one), pair, flip in zip(messages, pairs, flips)]
+
+
+class RandomOTReceiverPool():
+    """Random choice bits and their messages precomputed offline, consumed online."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.choices: list[int] = []
+        self.messages: list[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self.choices)
+
+    def add(self, choices: list[int], messages: list[bytes]):
+        self.choices.extend(choices)
+        self.messages.extend(messages)
+
+    def choose(self, bits: list[int]) -> list[int]:
+        """Take random OTs for the choice bits and return the flips d = b ^ c to send."""
+        if len(bits) > len(self.choices):
+            raise ValueError(f"Only {len(self.choices)} precomputed OTs left for {len(bits)} transfers")
+        n = len(bits)
+        self.pending = (bits, self.messages[:n])
+        flips = [bit ^ choice for bit, choice in zip(bits, self.choices)]
+        self.choices, self.messages = self.choices[n:], self.messages[n:]
+        return flips
+
+    def receive(self, masked: list[MessagePair]) -> list[bytes]:
+        """Unmask the chosen message of each pair returned by RandomOTSenderPool.transfer."""
+        bits, messages = self.pending
+        del self.pending
+        return [xor_bytes(pair[bit], message) for pair, bit, message in zip(masked, bits, messages)]
+
+
+def setup(group: PrimeCyclicGroup | None = None, security: int = SECURITY) -> tuple[ExtensionSender, ExtensionReceiver]:
+    """Run the base OTs of an extension session between two local parties."""
+    sender, receiver = ExtensionSender(group, security), ExtensionReceiver(group, security)
+    receiver.base_keys(sender.base_reply(receiver.base_public()))
+    return sender, receiver
+
+
+def precompute(sender: ExtensionSender, receiver: ExtensionReceiver, count: int, size: int,
+        pools: tuple[RandomOTSenderPool, RandomOTReceiverPool] | None = None) -> tuple[RandomOTSenderPool, RandomOTReceiverPool]:
+    """Offline phase: extend 'count' random OTs of 'size' bytes into (new or given) pools."""
+    sender_pool, receiver_pool = pools or (RandomOTSenderPool(size), RandomOTReceiverPool(size))
+    corrections, choices, messages = receiver.extend(count, size)
+    sender_pool.add(sender.extend(corrections, size))
+    receiver_pool.add(choices, messages)
+    return sender_pool, receiver_pool
+
+
+def transfer(pools: tuple[RandomOTSenderPool, RandomOTReceiverPool], messages: list[MessagePair], bits: list[int]) -> list[bytes]:
+    """Online phase between two local parties: the receiver learns messages[i][bits[i]]."""
+    sender_pool, receiver_pool = pools
+    return receiver_pool.receive(sender_pool.transfer(messages, receiver_pool.choose(bits)))
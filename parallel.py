@@ -0,0 +1,148 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+from circuit import Circuit, Gate, topological_levels
+from compact import CompactCircuit
+from cipher import BACKENDS, CipherBackend
+from garbled_circuit import GarbledCircuit, GarbledGate, UNARY_GATES, is_free
+import instrument
+
+MIN_CHUNK = 256 # levels with fewer gates per worker are garbled in the main process
+
+# gate, slots of its inputs and output, position of its table (-1 if none)
+GateTask = tuple[Gate, list[int], int, int]
+
+
+class SharedArrays(NamedTuple):
+    """Names and shapes of the shared memory blocks holding keys, p-bits and table rows."""
+    keys: tuple[str, tuple[int, ...]]
+    pbits: tuple[str, tuple[int, ...]]
+    rows: tuple[str, tuple[int, ...]]
+    encryption_method: str
+    kappa: int
+    scheme: str
+    delta: bytes | None
+    seed: bytes | None
+
+
+# per process cache of attached shared memory and of unwrapped backends, which are wrapped
+# per call so that each recording counts the hashes of its own garbling
+_attached: dict[str, tuple[shared_memory.SharedMemory, np.ndarray]] = {}
+_backends: dict[tuple[str, int], CipherBackend] = {}
+
+
+def attach(name: str, shape: tuple[int, ...]) -> np.ndarray:
+    if name not in _attached:
+        block = shared_memory.SharedMemory(name=name)
+        _attached[name] = (block, np.ndarray(shape, dtype=np.uint8, buffer=block.buf))
+    return _attached[name][1]
+
+
+def detach():
+    """Drop the views and handles of the shared memory blocks of this process."""
+    for name in list(_attached):
+        block, array = _attached.pop(name)
+        del array
+        block.close()
+
+
+def garble_chunk(shared: SharedArrays, tasks: list[GateTask]):
+    """Garble gates whose input keys are in shared memory and write back tables and derived keys."""
+    keys, pbits, rows = attach(*shared.keys), attach(*shared.pbits), attach(*shared.rows)
+    backend_key = (shared.encryption_method, shared.kappa)
+    if backend_key not in _backends:
+        _backends[backend_key] = BACKENDS[shared.encryption_method](shared.kappa)
+    backend = instrument.backend(_backends[backend_key])
+
+    for gate, in_slots, out_slot, table_position in tasks:
+        gate_keys = {wire: (keys[slot, 0].tobytes(), keys[slot, 1].tobytes()) for wire, slot in zip(gate.inputs, in_slots)}
+        gate_pbits = {wire: int(pbits[slot]) for wire, slot in zip(gate.inputs, in_slots)}
+        if table_position >= 0 and shared.scheme != 'half_gates':
+            gate_keys[gate.id] = (keys[out_slot, 0].tobytes(), keys[out_slot, 1].tobytes())
+            gate_pbits[gate.id] = int(pbits[out_slot])
+
+        garbled_table = GarbledGate(gate, gate_pbits, gate_keys, backend, shared.kappa, shared.scheme, shared.delta, shared.seed).garbled_table
+
+        keys[out_slot] = np.frombuffer(b''.join(gate_keys[gate.id]), dtype=np.uint8).reshape(2, shared.kappa)
+        pbits[out_slot] = gate_pbits[gate.id]
+        if garbled_table is not None:
+            rows[table_position] = np.frombuffer(b''.join(row for _, row in sorted(garbled_table.items())), dtype=np.uint8).reshape(rows.shape[1:])
+
+
+class ParallelGarbledCircuit(GarbledCircuit):
+    """GarbledCircuit that garbles independent gates on a pool of processes.
+
+    Keys, p-bits and table rows live in shared memory blocks indexed by dense wire
+    slots, and the workers receive chunks of gates of the same topological level. With
+    the classic scheme and no NOT or BUF gates no key is derived, so all the gates
+    form a single level. With a seed the result is bit-identical to GarbledCircuit
+    with the same seed.
+    """
+    workers: int
+
+    def __init__(self, circuit: Circuit | CompactCircuit, encryption_method: str, kappa: int, scheme: str = 'classic',
+            seed: bytes | None = None, workers: int | None = None):
+        self.workers = workers or os.cpu_count()
+        super().__init__(circuit, encryption_method, kappa, scheme, seed)
+
+    def levels(self) -> list[list[Gate]]:
+        # unary gates derive their keys even under the classic scheme
+        if self.scheme == 'classic' and not any(gate.type in UNARY_GATES for gate in self.circuit.gates):
+            return [list(self.circuit.sorted_gates())]
+        return topological_levels(self.circuit)
+
+    def generate_garbled_tables(self):
+        """Create the garbled table of each gate, level by level on the process pool."""
+        slots = {wire: slot for slot, wire in enumerate(self.wires)}
+        table_gates = [gate.id for gate in self.circuit.sorted_gates() if not is_free(gate, self.scheme)]
+        table_positions = {gate_id: position for position, gate_id in enumerate(table_gates)}
+        rows_per_table = 2 if self.scheme == 'half_gates' else 4
+
+        shapes = {
+            'keys': (len(slots), 2, self.kappa),
+            'pbits': (len(slots),),
+            'rows': (max(len(table_gates), 1), rows_per_table, self.kappa+1),
+        }
+        blocks = {name: shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1)) for name, shape in shapes.items()}
+        arrays = {}
+        try:
+            arrays = {name: np.ndarray(shapes[name], dtype=np.uint8, buffer=block.buf) for name, block in blocks.items()}
+            for wire, (key_zero, key_one) in self.keys.items():
+                arrays['keys'][slots[wire]] = np.frombuffer(key_zero + key_one, dtype=np.uint8).reshape(2, self.kappa)
+            for wire, pbit in self.pbits.items():
+                arrays['pbits'][slots[wire]] = pbit
+
+            shared = SharedArrays(*((blocks[name].name, shapes[name]) for name in ('keys', 'pbits', 'rows')),
+                    self.encryption_method, self.kappa, self.scheme, self.delta, self.seed)
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for level in self.levels():
+                    tasks = [(gate, [slots[wire] for wire in gate.inputs], slots[gate.id], table_positions.get(gate.id, -1)) for gate in level]
+                    if len(tasks) < 2 * MIN_CHUNK:
+                        garble_chunk(shared, tasks)
+                        continue
+                    size = max(MIN_CHUNK, -(-len(tasks) // self.workers))
+                    futures = [executor.submit(garble_chunk, shared, tasks[start:start+size]) for start in range(0, len(tasks), size)]
+                    for future in wait(futures).done:
+                        future.result()
+
+            for gate in self.circuit.sorted_gates():
+                if gate.id in self.derived:
+                    slot = slots[gate.id]
+                    self.keys[gate.id] = (arrays['keys'][slot, 0].tobytes(), arrays['keys'][slot, 1].tobytes())
+                    self.pbits[gate.id] = int(arrays['pbits'][slot])
+            rows = arrays['rows']
+            entries = [(0,), (1,)] if rows_per_table == 2 else [(0, 0), (0, 1), (1, 0), (1, 1)]
+            self.garbled_tables = {gate_id: {entry: rows[position, row].tobytes() for row, entry in enumerate(entries)}
+                    for gate_id, position in table_positions.items()}
+            del rows
+        finally:
+            # views must be released before the blocks can be closed
+            arrays.clear()
+            detach()
+            for block in blocks.values():
+                block.close()
+                block.unlink()
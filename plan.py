@@ -0,0 +1,172 @@
+import pickle
+from collections import OrderedDict
+from hashlib import blake2b
+from itertools import chain
+from operator import itemgetter
+from typing import Mapping, NamedTuple
+
+import numpy as np
+
+from circuit import Circuit, Id, topological_order
+from compact import CompactCircuit
+from garbled_circuit import GarbledTable, UNARY_GATES, is_free
+from garbled_file import FileTables
+
+PLAN_CACHE_SIZE = 32 # plans kept, least recently used ones are evicted first
+
+# kinds of evaluation steps
+FORWARD = 0 # NOT and BUF, the output label is the input label
+FREE_XOR = 1 # the output label is the XOR of the input labels
+TABLE = 2 # decrypt a row of a classic table, or evaluate a half-gates table
+
+# rows of a table in flat order, a classic row (a, b) is at 2*a + b
+ENTRIES = {
+    'classic': ((0, 0), (0, 1), (1, 0), (1, 1)),
+    'free_xor': ((0, 0), (0, 1), (1, 0), (1, 1)),
+    'half_gates': ((0,), (1,)),
+}
+
+# kind, gate id, output slot, slot of the first input, slot of the second input, first row
+Step = tuple[int, Id, int, int, int, int]
+
+
+class EvaluationPlan(NamedTuple):
+    """Everything yao.evaluate needs from a circuit, computed once per circuit and scheme.
+
+    Wires are mapped to dense slots (inputs first), gates are listed in a verified
+    topological order, and the rows of all the tables of a garbling are laid out in
+    one flat buffer with the table of the k-th table gate starting at row k * rows_per_table.
+    """
+    scheme: str
+    inputs: dict[Id, int] # slot of each input wire
+    steps: list[Step]
+    table_gates: np.ndarray # int64 ids of the gates with a table, in evaluation order
+    rows_per_table: int
+    n_slots: int
+    outputs: list[tuple[Id, int]] # output wires and their slots, in order
+
+    def rows(self, garbled_tables: Mapping[Id, GarbledTable], stride: int) -> bytes | memoryview:
+        """The rows of the tables of one garbling in plan order, row r at bytes [r*stride, (r+1)*stride).
+
+        The rows of a GarbledFile are returned without copying when its gates with a table
+        come in plan order, which is the case for files written by write_garbled; they are
+        gathered with one NumPy copy otherwise. Other tables are joined into one bytes object.
+        """
+        if isinstance(garbled_tables, FileTables) and garbled_tables.stride == stride:
+            ids = garbled_tables.ids
+            if np.array_equal(ids, self.table_gates):
+                return garbled_tables.rows
+            positions = np.searchsorted(ids, self.table_gates).clip(max=max(len(ids) - 1, 0))
+            if len(ids) == 0 or not np.array_equal(ids[positions], self.table_gates):
+                missing = np.setdiff1d(self.table_gates, ids)
+                raise KeyError(int(missing[0]))
+            tables = np.frombuffer(garbled_tables.rows, dtype=np.uint8).reshape(len(ids), garbled_tables.table_size)
+            return tables[positions].tobytes()
+        tables = map(garbled_tables.__getitem__, self.table_gates.tolist())
+        return b''.join(chain.from_iterable(map(itemgetter(*ENTRIES[self.scheme]), tables)))
+
+
+class Level(NamedTuple):
+    """The steps of one depth of an EvaluationPlan as slot arrays, evaluated all at once."""
+    forward: np.ndarray # (2, n) output and input slots of NOT and BUF gates
+    free: np.ndarray # (3, n) output and input slots of Free-XOR gates
+    table: np.ndarray # (4, n) output and input slots, and first row, of gates with a table
+
+
+def compile_plan(circuit: Circuit | CompactCircuit, scheme: str) -> EvaluationPlan:
+    """Build the evaluation plan of a circuit garbled with the given scheme."""
+    inputs = circuit.alice + circuit.bob
+    slots = {wire: slot for slot, wire in enumerate(inputs)}
+    steps, table_gates = [], []
+    rows_per_table = len(ENTRIES[scheme])
+    for gate in topological_order(circuit):
+        in_a = slots[gate.inputs[0]]
+        in_b = slots[gate.inputs[-1]]
+        slots[gate.id] = len(slots)
+        if gate.type in UNARY_GATES:
+            steps.append((FORWARD, gate.id, slots[gate.id], in_a, in_b, -1))
+        elif is_free(gate, scheme):
+            steps.append((FREE_XOR, gate.id, slots[gate.id], in_a, in_b, -1))
+        else:
+            steps.append((TABLE, gate.id, slots[gate.id], in_a, in_b, len(table_gates) * rows_per_table))
+            table_gates.append(gate.id)
+    try:
+        outputs = [(wire, slots[wire]) for wire in circuit.out]
+    except KeyError as error:
+        raise ValueError(f"Output wire {error} is undefined") from None
+    return EvaluationPlan(scheme, {wire: slots[wire] for wire in inputs}, steps, np.array(table_gates, dtype=np.int64),
+            rows_per_table, len(slots), outputs)
+
+
+def compile_levels(plan: EvaluationPlan) -> list[Level]:
+    """Group the steps of a plan by depth, a step is one deeper than its deepest input."""
+    depths = [0] * plan.n_slots
+    by_depth: list[tuple[list, list, list]] = []
+    for kind, _, out, in_a, in_b, row in plan.steps:
+        depth = depths[out] = max(depths[in_a], depths[in_b]) + 1
+        if depth > len(by_depth):
+            by_depth.append(([], [], []))
+        forward, free, table = by_depth[depth - 1]
+        if kind == FORWARD:
+            forward.append((out, in_a))
+        elif kind == FREE_XOR:
+            free.append((out, in_a, in_b))
+        else:
+            table.append((out, in_a, in_b, row))
+    return [Level(*(np.array(steps, dtype=np.int64).reshape(-1, width).T for steps, width in zip(level, (2, 3, 4))))
+            for level in by_depth]
+
+
+def circuit_digest(circuit: Circuit | CompactCircuit) -> bytes:
+    """Hash of everything a plan depends on: inputs, outputs and gates."""
+    digest = blake2b(pickle.dumps((circuit.alice, circuit.bob, circuit.out)), digest_size=16)
+    if isinstance(circuit, CompactCircuit):
+        for column in (circuit.ops, circuit.in_a, circuit.in_b):
+            digest.update(column.tobytes())
+    else:
+        digest.update(pickle.dumps([(gate.id, gate.type, gate.inputs) for gate in circuit.gates]))
+    return digest.digest()
+
+
+# plans and levels by (circuit digest, scheme), circuits are never held so they can be freed or edited
+_plans: OrderedDict[tuple[bytes, str], EvaluationPlan] = OrderedDict()
+_levels: OrderedDict[tuple[bytes, str], list[Level]] = OrderedDict()
+
+
+def remember(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > PLAN_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def get_plan(circuit: Circuit | CompactCircuit, scheme: str, digest: bytes | None = None) -> EvaluationPlan:
+    """Return the cached plan of a circuit, compiling it on first use.
+
+    Plans are found by content, so an equal circuit built again shares the plan and
+    a circuit edited in place gets a new one. 'digest' is its circuit_digest, if known.
+    """
+    if digest is None:
+        digest = circuit_digest(circuit)
+    plan = _plans.get((digest, scheme))
+    if plan is None:
+        plan = compile_plan(circuit, scheme)
+    remember(_plans, (digest, scheme), plan)
+    return plan
+
+
+def get_levels(circuit: Circuit | CompactCircuit, scheme: str) -> tuple[EvaluationPlan, list[Level]]:
+    """Return the cached plan of a circuit with its steps grouped by compile_levels."""
+    digest = circuit_digest(circuit)
+    plan = get_plan(circuit, scheme, digest)
+    key = (digest, scheme)
+    levels = _levels.get(key)
+    if levels is None:
+        levels = compile_levels(plan)
+    remember(_levels, key, levels)
+    return plan, levels
+
+
+def clear_plans():
+    _plans.clear()
+    _levels.clear()
@@ -0,0 +1,261 @@
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+from circuit import Circuit
+from compact import CompactCircuit
+from garbled_circuit import GarbledCircuit
+from plan import circuit_digest
+
+POOL_CAPACITY = 8 # instances kept ready per circuit by default
+
+# circuit and garbling options of the pool served by this worker process, see GarblingPool(processes=True)
+_process_job: tuple | None = None
+
+
+class PoolMetrics(NamedTuple):
+    depth: int # instances ready, in memory or spilled
+    spilled: int # ready instances on disk
+    hits: int # take() served from the pool
+    misses: int # take() that had to garble inline
+    garbled: int # instances garbled in the background
+    refill_rate: float # background garblings per second of refilling
+
+
+def spill(instance: GarbledCircuit, directory: str) -> str:
+    """Pickle a garbling to a new file in directory and return its path."""
+    descriptor, path = tempfile.mkstemp(prefix='garbled-', suffix='.pickle', dir=directory)
+    with os.fdopen(descriptor, 'wb') as file:
+        pickle.dump(instance, file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def start_process(circuit: Circuit | CompactCircuit, options: tuple):
+    global _process_job
+    _process_job = (circuit, options)
+
+
+def garble_in_process(spill_dir: str | None) -> GarbledCircuit | str:
+    """Garble in a worker process, returning the instance or the path it was spilled to."""
+    circuit, options = _process_job
+    instance = GarbledCircuit(circuit, *options)
+    return spill(instance, spill_dir) if spill_dir is not None else instance
+
+
+class GarblingPool():
+    """Keep fresh garblings of one circuit ready so that take() does not garble.
+
+    Workers fill the pool up to 'capacity' instances and stop. Once take() lets the
+    depth drop below 'low_water' they refill it to capacity again. Every instance is
+    handed out exactly once. When the pool is empty take() waits up to 'timeout'
+    seconds for a worker, then garbles inline and counts a miss.
+
+    Workers are threads by default. Garbling is CPU-bound Python, so while they refill
+    they hold the GIL for most of the time and slow down take() and the rest of the
+    process. With processes=True each worker thread hands the garbling to a process of
+    a ProcessPoolExecutor and only waits for the pickled result, which keeps the GIL
+    free at the cost of starting the processes and pickling every instance once.
+
+    With a spill directory, only 'in_memory' instances stay in memory and the rest
+    are pickled to files there, which are deleted when taken or when the pool closes.
+    The files hold the garbler's secret keys, so the directory must be private.
+    """
+    circuit: Circuit | CompactCircuit
+    capacity: int
+    low_water: int
+    spill_dir: str | None
+    in_memory: int # ready instances held in memory, the rest is spilled
+
+    def __init__(self, circuit: Circuit | CompactCircuit, encryption_method: str = 'blake2', kappa: int = 16,
+            scheme: str = 'half_gates', capacity: int = POOL_CAPACITY, low_water: int | None = None, workers: int = 1,
+            spill_dir: str | None = None, in_memory: int | None = None, processes: bool = False):
+        if capacity < 1 or workers < 1:
+            raise ValueError("Capacity and number of workers must be positive")
+        low_water = max(capacity // 2, 1) if low_water is None else low_water
+        if not 1 <= low_water <= capacity:
+            # with 0 the depth never drops below it and the pool is never refilled
+            raise ValueError("Low-water mark must be in [1, capacity]")
+        self.circuit = circuit
+        self.options = (encryption_method, kappa, scheme)
+        self.capacity = capacity
+        self.low_water = low_water
+        self.workers = workers
+        self.spill_dir = spill_dir
+        self.in_memory = capacity if spill_dir is None else (1 if in_memory is None else in_memory)
+        self.processes = processes
+        self.executor: ProcessPoolExecutor | None = None
+
+        self.ready: deque[GarbledCircuit] = deque()
+        self.spilled: deque[str] = deque()
+        self.condition = threading.Condition()
+        self.threads: list[threading.Thread] = []
+        self.pending = 0 # instances being garbled
+        self.refilling = True
+        self.closed = False
+        self.error: Exception | None = None
+        self.hits = self.misses = self.garbled = 0
+        self.refill_seconds = 0.0
+
+    def __enter__(self) -> 'GarblingPool':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self) -> 'GarblingPool':
+        if self.processes:
+            # spawn, forking a process that runs threads can copy held locks
+            self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                    initializer=start_process, initargs=(self.circuit, self.options))
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self.work, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def close(self):
+        """Stop the workers and delete the spilled instances."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.ready.clear()
+        while self.spilled:
+            os.remove(self.spilled.popleft())
+
+    def garble(self) -> GarbledCircuit:
+        return GarbledCircuit(self.circuit, *self.options)
+
+    def depth(self) -> int:
+        return len(self.ready) + len(self.spilled)
+
+    def work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or (self.refilling and self.depth() + self.pending < self.capacity))
+                if self.closed:
+                    return
+                self.pending += 1
+                to_disk = self.spill_dir is not None and len(self.ready) + self.pending > self.in_memory
+            start = time.perf_counter()
+            try:
+                if self.executor is not None:
+                    result = self.executor.submit(garble_in_process, self.spill_dir if to_disk else None).result()
+                    instance, path = (None, result) if to_disk else (result, None)
+                else:
+                    instance = self.garble()
+                    path = spill(instance, self.spill_dir) if to_disk else None
+            except Exception as error: # reported by take()
+                with self.condition:
+                    self.pending -= 1
+                    self.error = error
+                    self.closed = True
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.pending -= 1
+                self.garbled += 1
+                self.refill_seconds += time.perf_counter() - start
+                if path is None:
+                    self.ready.append(instance)
+                else:
+                    self.spilled.append(path)
+                if self.depth() >= self.capacity:
+                    self.refilling = False
+                self.condition.notify_all()
+
+    def take(self, timeout: float = 0) -> GarbledCircuit:
+        """Hand out a garbling that nobody else gets, garbling inline if none is ready in time."""
+        path = instance = None
+        with self.condition:
+            if self.error is not None:
+                raise RuntimeError("Pre-garbling failed") from self.error
+            if timeout:
+                self.condition.wait_for(lambda: self.depth() > 0 or self.closed, timeout)
+            if self.ready:
+                instance = self.ready.popleft()
+            elif self.spilled:
+                path = self.spilled.popleft()
+            if instance is None and path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            if self.depth() < self.low_water:
+                self.refilling = True
+                self.condition.notify_all()
+
+        if path is not None:
+            with open(path, 'rb') as file:
+                instance = pickle.load(file)
+            os.remove(path)
+        return instance if instance is not None else self.garble()
+
+    def metrics(self) -> PoolMetrics:
+        with self.condition:
+            rate = self.garbled / self.refill_seconds if self.refill_seconds else 0.0
+            return PoolMetrics(self.depth(), len(self.spilled), self.hits, self.misses, self.garbled, rate)
+
+
+class GarblingService():
+    """Pre-garbling pools for any number of circuits, created on first use.
+
+    Circuits are identified by content, so equal circuits share a pool. The keyword
+    arguments are passed to every GarblingPool; with 'spill_dir' each pool spills to
+    its own subdirectory.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.pools: dict[bytes, GarblingPool] = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> 'GarblingService':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pool(self, circuit: Circuit | CompactCircuit) -> GarblingPool:
+        with self.lock:
+            digest = circuit_digest(circuit)
+            if digest not in self.pools:
+                options = dict(self.options)
+                if options.get('spill_dir') is not None:
+                    options['spill_dir'] = os.path.join(options['spill_dir'], digest.hex())
+                    os.makedirs(options['spill_dir'], mode=0o700, exist_ok=True)
+                self.pools[digest] = GarblingPool(circuit, **options).start()
+            return self.pools[digest]
+
+    def take(self, circuit: Circuit | CompactCircuit, timeout: float = 0) -> GarbledCircuit:
+        return self.pool(circuit).take(timeout)
+
+    def metrics(self) -> dict[str, PoolMetrics]:
+        """Metrics of each pool by circuit name, with a digest prefix if names collide."""
+        with self.lock:
+            pools = list(self.pools.items())
+        metrics = {}
+        for digest, pool in pools:
+            name = pool.circuit.name if pool.circuit.name not in metrics else f"{pool.circuit.name}-{digest.hex()[:8]}"
+            metrics[name] = pool.metrics()
+        return metrics
+
+    def close(self):
+        with self.lock:
+            pools = list(self.pools.values())
+            self.pools.clear()
+        for pool in pools:
+            pool.close()
+            if pool.spill_dir is not None:
+                shutil.rmtree(pool.spill_dir, ignore_errors=True)
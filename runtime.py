@@ -0,0 +1,278 @@
+import asyncio
+import json
+import queue
+import socket
+import struct
+from typing import Iterator
+
+import numpy as np
+
+import ot
+from algebra import PrimeCyclicGroup
+from circuit import Circuit, Id
+from compact import CompactCircuit
+from garbled_circuit import GarbledTable
+from streaming import StreamingGarbler, evaluate_stream
+
+# Every message is a frame: uint32 payload length, uint8 kind, payload.
+FRAME = struct.Struct('<IB')
+HELLO = 1 # garbler → evaluator, JSON parameters of the garbled circuit
+BASE_OT = 2 # evaluator → garbler, JSON first base OT message
+BASE_REPLY = 3 # garbler → evaluator, JSON base OT replies
+OT_EXTEND = 4 # evaluator → garbler, packed IKNP corrections then the flips of Bob's bits
+OT_MASKED = 5 # garbler → evaluator, the masked label pairs of Bob's wires
+INPUTS = 6 # garbler → evaluator, the labels of Alice's wires
+TABLES = 7 # garbler → evaluator, uint32 count, int64 gate ids, then the rows of the tables
+END = 8 # garbler → evaluator, JSON p-bits of the output wires
+RESULT = 9 # evaluator → garbler, JSON output bits
+
+TABLE_BATCH = 1024 # tables per TABLES frame
+
+
+class Channel():
+    """Framed messages over an asyncio stream, counting the bytes in each direction."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def send(self, kind: int, payload: bytes):
+        self.writer.write(FRAME.pack(len(payload), kind) + payload)
+        self.bytes_sent += FRAME.size + len(payload)
+
+    def send_json(self, kind: int, message):
+        self.send(kind, json.dumps(message).encode())
+
+    async def receive(self) -> tuple[int, bytes]:
+        size, kind = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+        payload = await self.reader.readexactly(size)
+        self.bytes_received += FRAME.size + size
+        return kind, payload
+
+    async def expect(self, kind: int) -> bytes:
+        received, payload = await self.receive()
+        if received != kind:
+            raise ValueError(f"Expected message {kind}, got {received}")
+        return payload
+
+
+def encode_tables(tables: list[tuple[Id, GarbledTable]]) -> bytes:
+    ids = np.array([gate_id for gate_id, _ in tables], dtype='<i8')
+    rows = b''.join(row for _, table in tables for _, row in sorted(table.items()))
+    return struct.pack('<I', len(tables)) + ids.tobytes() + rows
+
+
+def decode_tables(payload: bytes, scheme: str, kappa: int) -> list[tuple[Id, GarbledTable]]:
+    count, = struct.unpack_from('<I', payload)
+    ids = np.frombuffer(payload, dtype='<i8', count=count, offset=4).tolist()
+    entries = [(0,), (1,)] if scheme == 'half_gates' else [(0, 0), (0, 1), (1, 0), (1, 1)]
+    stride = kappa + 1
+    offset = 4 + 8*count
+    tables = []
+    for gate_id in ids:
+        tables.append((gate_id, {entry: payload[offset + row*stride:offset + (row+1)*stride] for row, entry in enumerate(entries)}))
+        offset += len(entries) * stride
+    return tables
+
+
+def split_labels(payload: bytes, size: int) -> list[bytes]:
+    return [payload[i:i+size] for i in range(0, len(payload), size)]
+
+
+def check_group(group: PrimeCyclicGroup, message: dict):
+    if message['prime'] != group.prime or message['generator'] != group.generator:
+        raise ValueError("The parties use different groups for the base OTs")
+
+
+class Garbler():
+    """Garbler endpoint (Alice) of the two-party protocol.
+
+    Tables are garbled by a StreamingGarbler on a worker thread and sent in batches
+    of TABLE_BATCH as they are produced, while the OT for Bob's inputs runs on the
+    same connection. The protocol takes a constant number of rounds: base OTs, one
+    batch of extended OTs for all of Bob's wires, then the output bits.
+    """
+    circuit: Circuit | CompactCircuit
+    inputs: dict[Id, int]
+    channel: Channel
+
+    def __init__(self, circuit: Circuit | CompactCircuit, inputs: dict[Id, int], encryption_method: str = 'blake2',
+            kappa: int = 16, scheme: str = 'half_gates', seed: bytes | None = None, group: PrimeCyclicGroup | None = None):
+        self.circuit = circuit
+        self.inputs = inputs
+        self.garbler = StreamingGarbler(circuit, encryption_method, kappa, scheme, seed)
+        self.group = group or ot.default_group()
+
+    def label(self, wire: Id, bit: int) -> bytes:
+        """Key of a wire for a bit followed by its encrypted bit."""
+        return self.garbler.keys[wire][bit] + bytes([self.garbler.pbits[wire] ^ bit])
+
+    async def run(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> dict[Id, int]:
+        """Run the protocol on a connected stream and return the output bits."""
+        garbler, circuit = self.garbler, self.circuit
+        self.channel = channel = Channel(reader, writer)
+        channel.send_json(HELLO, {'name': circuit.name, 'gates': len(circuit.gates), 'alice': len(circuit.alice),
+                'bob': len(circuit.bob), 'encryption_method': garbler.encryption_method, 'kappa': garbler.kappa, 'scheme': garbler.scheme})
+        channel.send(INPUTS, b''.join(self.label(wire, self.inputs[wire]) for wire in circuit.alice))
+        # the input keys are released while garbling, take Bob's label pairs first
+        messages = [(self.label(wire, 0), self.label(wire, 1)) for wire in circuit.bob]
+
+        stream = asyncio.create_task(self.stream_tables())
+        try:
+            base = json.loads(await channel.expect(BASE_OT))
+            check_group(self.group, base)
+            sender = ot.ExtensionSender(self.group)
+            channel.send_json(BASE_REPLY, {'replies': sender.base_reply(base['public'])})
+
+            payload = await channel.expect(OT_EXTEND)
+            count, security = len(circuit.bob), sender.security
+            bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+            columns = -(-count // 8) * 8
+            corrections = bits[:security*columns].reshape(security, columns)[:, :count]
+            flips = bits[security*columns:security*columns + count].tolist()
+            pool = ot.RandomOTSenderPool(garbler.kappa + 1)
+            pool.add(sender.extend(corrections, garbler.kappa + 1))
+            channel.send(OT_MASKED, b''.join(x_zero + x_one for x_zero, x_one in pool.transfer(messages, flips)))
+            await stream
+        finally:
+            stream.cancel()
+        # END follows both the last table and the OT, the evaluator stops reading at it
+        pbits_out = garbler.get_pbits_out()
+        channel.send_json(END, {'pbits_out': [pbits_out[wire] for wire in circuit.out]})
+
+        result = json.loads(await channel.expect(RESULT))
+        return dict(zip(circuit.out, result['outputs']))
+
+    async def stream_tables(self):
+        """Garble batches of tables on a thread and send each one as soon as it is ready."""
+        tables = self.garbler.tables()
+
+        def next_batch() -> list[tuple[Id, GarbledTable]]:
+            return [table for _, table in zip(range(TABLE_BATCH), tables)]
+
+        while batch := await asyncio.to_thread(next_batch):
+            self.channel.send(TABLES, encode_tables(batch))
+            await self.channel.writer.drain()
+
+
+class Evaluator():
+    """Evaluator endpoint (Bob) of the two-party protocol.
+
+    The garbling parameters come from the garbler's HELLO. Tables are queued as they
+    arrive and evaluated on a worker thread by streaming.evaluate_stream as soon as
+    the input labels are known, so evaluation overlaps the rest of the transfer.
+    """
+    circuit: Circuit | CompactCircuit
+    inputs: dict[Id, int]
+    channel: Channel
+
+    def __init__(self, circuit: Circuit | CompactCircuit, inputs: dict[Id, int], group: PrimeCyclicGroup | None = None):
+        self.circuit = circuit
+        self.inputs = inputs
+        self.group = group or ot.default_group()
+
+    async def run(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> dict[Id, int]:
+        """Run the protocol on a connected stream and return the output bits."""
+        circuit = self.circuit
+        self.channel = channel = Channel(reader, writer)
+        receiver = ot.ExtensionReceiver(self.group)
+        channel.send_json(BASE_OT, {'prime': self.group.prime, 'generator': self.group.generator, 'public': receiver.base_public()})
+
+        hello = json.loads(await channel.expect(HELLO))
+        expected = {'name': circuit.name, 'gates': len(circuit.gates), 'alice': len(circuit.alice), 'bob': len(circuit.bob)}
+        if any(hello[key] != value for key, value in expected.items()):
+            raise ValueError(f"The garbler sent a different circuit: {hello}")
+        method, kappa, scheme = hello['encryption_method'], hello['kappa'], hello['scheme']
+
+        control = asyncio.Queue()
+        tables = queue.Queue()
+        pbits_out = {}
+        dispatch = asyncio.create_task(self.dispatch(control, tables, pbits_out, scheme, kappa))
+        try:
+            a_inputs = {wire: (label[:kappa], label[kappa]) for wire, label in zip(circuit.alice, split_labels(await self.control(control, INPUTS), kappa + 1))}
+
+            replies = json.loads(await self.control(control, BASE_REPLY))['replies']
+            receiver.base_keys(replies)
+            count = len(circuit.bob)
+            corrections, choices, messages = receiver.extend(count, kappa + 1)
+            pool = ot.RandomOTReceiverPool(kappa + 1)
+            pool.add(choices, messages)
+            flips = pool.choose([self.inputs[wire] for wire in circuit.bob])
+            channel.send(OT_EXTEND, np.packbits(corrections, axis=1).tobytes() + np.packbits(np.array(flips, dtype=np.uint8)).tobytes())
+
+            masked = split_labels(await self.control(control, OT_MASKED), 2 * (kappa + 1))
+            labels = pool.receive([(pair[:kappa+1], pair[kappa+1:]) for pair in masked])
+            b_inputs = {wire: (label[:kappa], label[kappa]) for wire, label in zip(circuit.bob, labels)}
+
+            result = await asyncio.to_thread(evaluate_stream, circuit, iterate(tables), pbits_out, a_inputs, b_inputs, method, kappa, scheme)
+            await dispatch
+        finally:
+            dispatch.cancel()
+
+        channel.send_json(RESULT, {'outputs': [result[wire] for wire in circuit.out]})
+        await channel.writer.drain()
+        return result
+
+    async def control(self, control: asyncio.Queue, kind: int) -> bytes:
+        received, payload = await control.get()
+        if isinstance(payload, Exception):
+            raise payload
+        if received != kind:
+            raise ValueError(f"Expected message {kind}, got {received}")
+        return payload
+
+    async def dispatch(self, control: asyncio.Queue, tables: queue.Queue, pbits_out: dict[Id, int], scheme: str, kappa: int):
+        """Read frames until END, queue tables for the evaluation thread and the rest for run."""
+        try:
+            while True:
+                kind, payload = await self.channel.receive()
+                if kind == TABLES:
+                    tables.put(decode_tables(payload, scheme, kappa))
+                elif kind == END:
+                    pbits_out.update(zip(self.circuit.out, json.loads(payload)['pbits_out']))
+                    tables.put(None)
+                    return
+                else:
+                    control.put_nowait((kind, payload))
+        except BaseException as error:
+            error = error if isinstance(error, Exception) else ConnectionError("Connection closed")
+            control.put_nowait((None, error))
+            tables.put(error)
+            raise
+
+
+def iterate(tables: queue.Queue) -> Iterator[tuple[Id, GarbledTable]]:
+    """Yield the tables of the batches put in a queue until the None sentinel."""
+    while (batch := tables.get()) is not None:
+        if isinstance(batch, Exception):
+            raise batch
+        yield from batch
+
+
+async def run_local(circuit: Circuit | CompactCircuit, a_inputs: dict[Id, int], b_inputs: dict[Id, int],
+        encryption_method: str = 'blake2', kappa: int = 16, scheme: str = 'half_gates', tcp: bool = False,
+        group: PrimeCyclicGroup | None = None) -> tuple[dict[Id, int], dict[Id, int]]:
+    """Run both parties in this process over a socketpair, or a TCP connection on localhost.
+    Returns:
+        The output bits as seen by the garbler and by the evaluator.
+    """
+    garbler = Garbler(circuit, a_inputs, encryption_method, kappa, scheme, group=group)
+    evaluator = Evaluator(circuit, b_inputs, group)
+    if tcp:
+        accepted = asyncio.get_running_loop().create_future()
+        server = await asyncio.start_server(lambda reader, writer: accepted.set_result((reader, writer)), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        evaluator_stream = await asyncio.open_connection('127.0.0.1', port)
+        garbler_stream = await accepted
+        server.close()
+    else:
+        garbler_socket, evaluator_socket = socket.socketpair()
+        garbler_stream = await asyncio.open_connection(sock=garbler_socket)
+        evaluator_stream = await asyncio.open_connection(sock=evaluator_socket)
+    try:
+        return tuple(await asyncio.gather(garbler.run(*garbler_stream), evaluator.run(*evaluator_stream)))
+    finally:
+        for _, writer in (garbler_stream, evaluator_stream):
+            writer.close()
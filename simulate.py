@@ -0,0 +1,77 @@
+from circuit import Circuit, Id, topological_order
+
+# Bitwise versions of GateFunctions over packed assignments, mask has one bit per assignment
+BitwiseGateFunctions = {
+    'AND': lambda mask, x, y: x & y,
+    'OR': lambda mask, x, y: x | y,
+    'NOT': lambda mask, x: mask ^ x,
+    'XOR': lambda mask, x, y: x ^ y,
+    'NAND': lambda mask, x, y: mask ^ (x & y),
+    'NOR': lambda mask, x, y: mask ^ (x | y),
+    'XNOR': lambda mask, x, y: mask ^ x ^ y,
+    'GEQ': lambda mask, x, y: x & (mask ^ y),
+    'LEQ': lambda mask, x, y: (mask ^ x) & y,
+    'BUF': lambda mask, x: x,
+}
+
+
+def simulate(circuit: Circuit, inputs: dict[Id, int], width: int) -> dict[Id, int]:
+    """Evaluate a circuit in the clear on 'width' input assignments at once.
+
+    Bit i of the integer of a wire is its value in assignment i, so every gate is one
+    bitwise operation over all the assignments. Python integers are arbitrarily wide,
+    so thousands of assignments are packed as easily as 64.
+    Returns:
+        A dict mapping output wires to their packed values.
+    """
+    mask = (1 << width) - 1
+    values = dict(inputs)
+    for gate in topological_order(circuit):
+        values[gate.id] = BitwiseGateFunctions[gate.type](mask, *[values[wire] for wire in gate.inputs])
+    return {out: values[out] for out in circuit.out}
+
+
+def pack(assignments: list[dict[Id, int]]) -> dict[Id, int]:
+    """Pack a list of {wire: bit} assignments into one integer per wire."""
+    packed = {wire: 0 for wire in assignments[0]} if assignments else {}
+    for i, assignment in enumerate(assignments):
+        for wire, bit in assignment.items():
+            packed[wire] |= bit << i
+    return packed
+
+
+def unpack(packed: dict[Id, int], width: int) -> list[dict[Id, int]]:
+    """Inverse of pack."""
+    return [{wire: value >> i & 1 for wire, value in packed.items()} for i in range(width)]
+
+
+def exhaustive_inputs(circuit: Circuit) -> tuple[dict[Id, int], int]:
+    """Pack all the 2^N assignments of the N input wires.
+
+    Assignment n gives input wire k (Alice's wires then Bob's) the bit k of n counted
+    from the most significant one, the order in which main.py enumerates inputs.
+    """
+    wires = circuit.alice + circuit.bob
+    width = 1 << len(wires)
+    inputs = {}
+    for k, wire in enumerate(wires):
+        period = 1 << (len(wires) - 1 - k) # length of the runs of zeros and ones
+        block = ((1 << period) - 1) << period
+        inputs[wire] = block * (((1 << width) - 1) // ((1 << 2*period) - 1))
+    return inputs, width
+
+
+def truth_table(circuit: Circuit) -> dict[Id, int]:
+    """Packed value of every output wire over all the input assignments."""
+    inputs, width = exhaustive_inputs(circuit)
+    return simulate(circuit, inputs, width)
+
+
+def mismatches(circuit: Circuit, reference: Circuit) -> list[int]:
+    """Return the input assignments on which two circuits with the same wires disagree."""
+    inputs, width = exhaustive_inputs(circuit)
+    actual, expected = simulate(circuit, inputs, width), simulate(reference, inputs, width)
+    differences = 0
+    for out in circuit.out:
+        differences |= actual[out] ^ expected[out]
+    return [i for i in range(width) if differences >> i & 1]
@@ -1,10 +1,63 @@
 import secrets
+from functools import lru_cache
 import numpy as np
-import sympy
 import itertools
 
 import algebra
 
+# primes below this bound keep products of two residues within int64
+INT64_PRIME_BOUND = 2**31
+LAGRANGE_CACHE_SIZE = 1024 # x-coordinate sets whose coefficients are kept
+
+
+@lru_cache(maxsize=LAGRANGE_CACHE_SIZE)
+def lagrange_coefficients(prime: int, x_values: tuple[int, ...], at: int = 0) -> tuple[int, ...]:
+    """
+    Lagrange coefficients at 'at' of the points x_values, prod (at - x_j) / (x_i - x_j) over j != i.
+
+    The denominators are inverted together with Montgomery's trick, and the result is
+    cached per x-coordinate set and point, pass x_values sorted to share the entries.
+    """
+    x_values = [x % prime for x in x_values]
+    at %= prime
+    if len(set(x_values)) != len(x_values):
+        raise ValueError("Share x-coordinates must be distinct modulo the prime")
+    if at in x_values:
+        return tuple(int(x == at) for x in x_values)
+    denominators = []
+    for i, x_i in enumerate(x_values):
+        denominator = 1
+        for j, x_j in enumerate(x_values):
+            if j != i:
+                denominator = denominator * (x_i - x_j) % prime
+        denominators.append(denominator)
+    product = 1
+    for x in x_values:
+        product = product * (at - x) % prime
+    # prod of (at - x_j) over j != i is product / (at - x_i), so invert those in the same batch
+    inverses = algebra.batch_inverse(denominators + [(at - x) % prime for x in x_values], prime)
+    return tuple(product * inverses[i] * inverses[len(x_values) + i] % prime for i in range(len(x_values)))
+
+
+def interpolate(G: algebra.PrimeCyclicGroup, x_values: list[int], values: np.ndarray, points: list[int]) -> np.ndarray:
+    """
+    Evaluate at each of 'points' the polynomials of degree < len(x_values) through the columns of values.
+
+    Row i of values holds the values at x_values[i]. Returns a len(points) × columns
+    array, computed exactly as in SSS.share_many.
+    """
+    if len(values) != len(x_values):
+        raise ValueError("Expected one row of values per x-coordinate")
+    dtype = np.int64 if G.prime < INT64_PRIME_BOUND else object
+    order = sorted(range(len(x_values)), key=lambda i: x_values[i])
+    x_sorted = tuple(x_values[i] for i in order)
+    result = np.zeros((len(points),) + np.shape(values)[1:], dtype=dtype)
+    for row, point in enumerate(points):
+        for b, i in zip(lagrange_coefficients(G.prime, x_sorted, point), order):
+            result[row] = (result[row] + b * np.asarray(values[i], dtype=dtype) % G.prime) % G.prime
+    return result
+
+
 class SSS:
     """
     This class implements the Shamir Secret Sharing scheme.
@@ -45,51 +98,68 @@ class SSS:
 
         return shares
 
+    @staticmethod
+    def share_many(keys: list[int], G: algebra.PrimeCyclicGroup, no_shares: int, threshold: int,
+            coefficients: np.ndarray | None = None) -> np.ndarray:
+        """
+        Share many keys at once, each with its own random polynomial of degree threshold-1.
+
+        The polynomials are the columns of a threshold × len(keys) coefficient matrix,
+        highest degree first and the keys last, and all of them are evaluated together
+        with Horner's rule, i.e. the Vandermonde product row by row. Arithmetic is exact:
+        int64 for primes below INT64_PRIME_BOUND and Python integers (object arrays)
+        otherwise.
+        Returns:
+            A no_shares × len(keys) array, row i holds the shares at x = i+1.
+        """
+        if no_shares >= G.prime:
+            raise ValueError("The share x-coordinates 1..no_shares must be distinct modulo the prime")
+        dtype = np.int64 if G.prime < INT64_PRIME_BOUND else object
+        if coefficients is None:
+            coefficients = np.array([[G.rand_int() for _ in keys] for _ in range(threshold-1)], dtype=dtype).reshape(threshold-1, len(keys))
+        elif np.shape(coefficients) != (threshold-1, len(keys)):
+            raise ValueError("Expected threshold-1 coefficients per key")
+        polynomials = np.vstack([np.asarray(coefficients, dtype=dtype), np.array(keys, dtype=dtype).reshape(1, len(keys)) % G.prime])
+
+        x = np.arange(1, no_shares+1, dtype=np.int64).astype(dtype).reshape(no_shares, 1)
+        shares = np.broadcast_to(polynomials[0], (no_shares, len(keys)))
+        for row in polynomials[1:]:
+            shares = (shares * x + row) % G.prime
+        return np.array(shares, dtype=dtype)
+
     def evaluate_polynomial(self, y: int):
         """
         Evaluate the polynomial at y.
         """
         return self.G.polyeval(self.polynomial, y)
 
-    '''
-        The following two functions are used to calculate the inverse modulo p
-        of a number (we need it when we calculate the b values, to handle
-        the denominator)
-        
-        Adapted from https://en.wikibooks.org/wiki/Algorithm_Implementation/Mathematics/Extended_Euclidean_algorithm
-    '''
     def egcd(self, number1, number2):
-        if number1 == 0:
-            return (number2, 0, 1)
-        else:
-            g, y, x = self.egcd(number2 % number1, number1)
-            return g, x - (number2 // number1) * y, y
+        """
+        Extended Euclid, return (g, x, y) with number1*x + number2*y = g = gcd(number1, number2).
+        """
+        x0, x1, y0, y1 = 0, 1, 1, 0
+        while number1:
+            quotient, number1, number2 = number2 // number1, number2 % number1, number1
+            x0, x1 = x1, x0 - quotient * x1
+            y0, y1 = y1, y0 - quotient * y1
+        return number2, x0, y0
 
     def modinv(self, number, m):
-        g, x, y = self.egcd(number, m)
-        if g != 1:
-            raise Exception('modular inverse does not exist')
-        else:
-            return x % m
+        """
+        Inverse of number modulo m, kept for callers of the old API, lagrange_coefficients batches its inversions.
+        """
+        try:
+            return pow(number, -1, m)
+        except ValueError:
+            raise ValueError('modular inverse does not exist') from None
 
     def calculate_lagrange_basis_polynomial(self, x: int, x_values: list[int]):
 
         """
         Calculate the Lagrange basis polynomial for x.
         """
-        acc = 1
-        for element in x_values:
-            if element != x:  # do not multiply the current x in the formula
-                acc = acc * element
-                if element - x >= 0:
-                    inverse = self.modinv(element-x, self.G.prime) #
-                    # inverse = self.G.inv(element - x)
-                else:
-                    inverse = self.modinv(self.G.prime - abs(element - x), self.G.prime)
-                    # inverse = self.G.inv(abs(element - x))
- 
-                acc = self.G.mul(acc, inverse)
-        return acc
+        x_values = sorted(x_values)
+        return lagrange_coefficients(self.G.prime, tuple(x_values))[x_values.index(x)]
 
     def reconstruct_key(self, shares: list[tuple[int,int]]) -> int:
         """
@@ -103,16 +173,83 @@ class SSS:
         if len(shares) < self.threshold:
             raise ValueError("Not enough shares to reconstruct key.")
         else:
-            x_values = [x for x, _ in shares]
-            y_values = [y for _, y in shares]
+            shares = sorted(shares)
+            coefficients = lagrange_coefficients(self.G.prime, tuple(x for x, _ in shares))
 
             k = 0
-            for index, x in enumerate(x_values):
-                b = self.calculate_lagrange_basis_polynomial(x, x_values)
-                k = self.G.add(k, self.G.mul(b, y_values[index]))
+            for b, (_, y) in zip(coefficients, shares):
+                k = self.G.add(k, self.G.mul(b, y))
 
             return k
-            
+
+    @staticmethod
+    def reconstruct_many(G: algebra.PrimeCyclicGroup, x_values: list[int], shares: np.ndarray) -> np.ndarray:
+        """
+        Reconstruct many keys shared at the same x-coordinates, e.g. by share_many.
+
+        Row i of shares holds the shares at x_values[i]; the Lagrange coefficients are
+        looked up once and each key is one dot product with its column.
+        Returns:
+            The array of keys, one per column.
+        """
+        return interpolate(G, x_values, shares, [0])[0]
+
+
+class PackedSSS:
+    """
+    Packed Shamir secret sharing of k secrets per polynomial.
+
+    The polynomial of degree threshold-1 = t+k-1 takes the k secrets at x = 0, -1, ...,
+    -(k-1) and random values at the t = threshold-k points after them, and the shares
+    are its values at x = 1..no_shares. Any t shares reveal nothing, any threshold
+    shares reconstruct all k secrets, so each share carries k secrets at once.
+    """
+    G: algebra.PrimeCyclicGroup
+    no_shares: int
+    threshold: int
+    k: int
+
+    def __init__(self, G: algebra.PrimeCyclicGroup, no_shares: int, threshold: int, k: int):
+        if not 0 < k < threshold <= no_shares:
+            raise ValueError("Packed sharing needs 0 < k < threshold <= no_shares")
+        if no_shares + threshold > G.prime:
+            raise ValueError("The secret and share x-coordinates must be distinct modulo the prime")
+        self.G = G
+        self.no_shares = no_shares
+        self.threshold = threshold
+        self.k = k
+
+    def secret_points(self) -> list[int]:
+        return [-m for m in range(self.k)]
+
+    def share_many(self, keys: list[int], randomness: np.ndarray | None = None) -> np.ndarray:
+        """
+        Share len(keys) keys, k per polynomial, keys m*k..m*k+k-1 go to polynomial m.
+        Returns:
+            A no_shares × len(keys)/k array, row i holds the shares at x = i+1.
+        """
+        if len(keys) % self.k:
+            raise ValueError(f"The number of keys must be a multiple of k = {self.k}")
+        blocks = len(keys) // self.k
+        t = self.threshold - self.k
+        dtype = np.int64 if self.G.prime < INT64_PRIME_BOUND else object
+        if randomness is None:
+            randomness = np.array([[self.G.rand_int() for _ in range(blocks)] for _ in range(t)], dtype=dtype).reshape(t, blocks)
+        elif np.shape(randomness) != (t, blocks):
+            raise ValueError("Expected threshold-k random values per polynomial")
+        values = np.vstack([np.array(keys, dtype=dtype).reshape(blocks, self.k).T % self.G.prime, np.asarray(randomness, dtype=dtype)])
+        sources = self.secret_points() + [-m for m in range(self.k, self.threshold)]
+        return interpolate(self.G, sources, values, list(range(1, self.no_shares+1)))
+
+    def reconstruct_many(self, x_values: list[int], shares: np.ndarray) -> np.ndarray:
+        """
+        Recover the keys from the share rows at x_values, at least threshold of them.
+        Returns:
+            The array of keys in the order given to share_many.
+        """
+        if len(x_values) < self.threshold:
+            raise ValueError("Not enough shares to reconstruct key.")
+        return interpolate(self.G, x_values, shares, self.secret_points()).T.reshape(-1)
 
 
 if __name__ == "__main__":
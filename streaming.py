@@ -0,0 +1,142 @@
+from typing import Iterable, Iterator, Mapping
+
+import numpy as np
+
+from circuit import Circuit, Gate, Id, Label, topological_order
+from compact import CompactCircuit, NO_WIRE
+from garbled_circuit import GarbledCircuit, GarbledTable, is_derived, is_free
+from cipher import get_backend
+from labels import SeededKeys, SeededPbits
+import instrument
+from yao import evaluate_gate
+
+# (gate id, table) items sent from the garbler to the evaluator, only for gates with a table
+TableStream = Iterable[tuple[Id, GarbledTable]]
+
+
+def gate_order(circuit: Circuit | CompactCircuit) -> Iterable[Gate]:
+    """Return the gates in topological order, a CompactCircuit stores them that way already."""
+    if isinstance(circuit, CompactCircuit):
+        return circuit.sorted_gates()
+    return topological_order(circuit)
+
+
+def last_uses(circuit: Circuit | CompactCircuit) -> Mapping[Id, int]:
+    """Map each wire to the position of the last gate reading it.
+
+    Wires that no gate reads map to -1 and output wires are never released. For a CompactCircuit this is an int32 array
+    indexed by wire, computed without iterating over the gates in Python.
+    """
+    if isinstance(circuit, CompactCircuit):
+        positions = np.arange(len(circuit.ops), dtype=np.int32)
+        last = np.full(circuit.n_wires, -1, dtype=np.int32)
+        np.maximum.at(last, circuit.in_a, positions)
+        unary = circuit.in_b == NO_WIRE
+        np.maximum.at(last, circuit.in_b[~unary], positions[~unary])
+        last[circuit.out] = len(circuit.ops)
+        return last
+
+    last = {}
+    for position, gate in enumerate(gate_order(circuit)):
+        last[gate.id] = -1
+        for wire in gate.inputs:
+            last[wire] = position
+    for wire in circuit.out:
+        last[wire] = len(circuit.gates)
+    return last
+
+
+def release(wires: dict, gate: Gate, position: int, last: Mapping[Id, int]):
+    """Drop the inputs of a gate that no later gate reads, and its output if nothing reads it."""
+    for wire in gate.inputs:
+        if last[wire] == position:
+            wires.pop(wire, None)
+    if last[gate.id] == -1:
+        wires.pop(gate.id, None)
+
+
+class StreamingGarbler(GarbledCircuit):
+    """Garble a circuit gate by gate in topological order.
+
+    Only the keys of the inputs are created up front. The keys of every other wire
+    are created when its gate is garbled and dropped after its last reader, so memory
+    grows with the width of the circuit rather than its size. With a seed only the
+    keys of derived wires are held at all. Tables are produced by tables(), the
+    p-bits of the outputs are known once it is exhausted.
+    """
+    peak_keys: int # largest number of wires whose keys were held at once
+
+    def __init__(self, circuit: Circuit | CompactCircuit, encryption_method: str, kappa: int, scheme: str = 'classic', seed: bytes | None = None):
+        self.configure(circuit, encryption_method, kappa, scheme, seed)
+        inputs = circuit.alice + circuit.bob
+        if self.labels:
+            # fresh keys are recomputed from the seed, only derived ones are held
+            self.keys, self.pbits = SeededKeys(self.labels, self.delta), SeededPbits(self.labels)
+        else:
+            self.keys = {wire: self.fresh_keys(wire) for wire in inputs}
+            self.pbits = {wire: self.fresh_pbit(wire) for wire in inputs}
+        self.peak_keys = len(self.keys)
+
+    def tables(self) -> Iterator[tuple[Id, GarbledTable]]:
+        """Yield (gate id, table) for each gate that needs a table, in topological order."""
+        last = last_uses(self.circuit)
+        recorder = instrument.active
+        table_bytes = 0
+        for position, gate in enumerate(gate_order(self.circuit)):
+            if not is_derived(gate, self.scheme) and not self.labels:
+                self.keys[gate.id] = self.fresh_keys(gate.id)
+                self.pbits[gate.id] = self.fresh_pbit(gate.id)
+            garbled_table = self.garble_gate(gate)
+            self.peak_keys = max(self.peak_keys, len(self.keys))
+            release(self.keys, gate, position, last)
+            release(self.pbits, gate, position, last)
+            if garbled_table is not None:
+                if recorder is not None:
+                    table_bytes += sum(len(row) for row in garbled_table.values())
+                yield gate.id, garbled_table
+        if recorder is not None:
+            recorder.gates_done('garbled', (gate.type for gate in self.circuit.gates), table_bytes, self.peak_keys,
+                    self.peak_keys * (2*self.kappa + 1))
+
+
+def evaluate_stream(circuit: Circuit | CompactCircuit,
+        garbled_tables: TableStream,
+        pbits_out: Mapping[Id, int],
+        a_inputs: dict[Id, tuple[Label, int]],
+        b_inputs: dict[Id, tuple[Label, int]],
+        encryption_method: str,
+        kappa: int,
+        scheme: str = 'classic'):
+    """Evaluate yao circuit while its tables arrive, see yao.evaluate for the arguments.
+
+    Tables are consumed in topological order as the gates need them and input keys
+    are dropped after their last reader. pbits_out is only read after the last gate,
+    so the pbits of a StreamingGarbler that is still producing the stream can be passed.
+    """
+    backend = get_backend(encryption_method, kappa)
+    last = last_uses(circuit)
+    wire_inputs = {**a_inputs, **b_inputs}
+    tables = iter(garbled_tables)
+    recorder = instrument.active
+    table_bytes = peak_labels = 0
+
+    for position, gate in enumerate(gate_order(circuit)):
+        current = {}
+        if not is_free(gate, scheme):
+            gate_id, current[gate.id] = next(tables)
+            if gate_id != gate.id:
+                raise ValueError(f"Expected the table of gate {gate.id}, got gate {gate_id}")
+        wire_inputs[gate.id] = evaluate_gate(gate, current, wire_inputs, backend, scheme)
+        if recorder is not None:
+            table_bytes += sum(len(row) for row in current.get(gate.id, {}).values())
+            peak_labels = max(peak_labels, len(wire_inputs))
+        release(wire_inputs, gate, position, last)
+
+    # drain the stream, which also lets a garbler finish the free gates after the last table
+    for gate_id, _ in tables:
+        raise ValueError(f"Unexpected table of gate {gate_id}")
+
+    if recorder is not None:
+        recorder.gates_done('evaluated', (gate.type for gate in circuit.gates), table_bytes, peak_labels, peak_labels * (kappa + 1))
+
+    return {out: wire_inputs[out][1] ^ pbits_out[out] for out in circuit.out}
@@ -1,6 +1,119 @@
+import asyncio
+import gc
+import io
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from utils import gen_label, encode, decode, flip_coin, encrypt_xor, encrypt_hash, decrypt_hash, gen_prime, is_prime, xor_bytes
+import weakref
+from itertools import product
+
+import numpy as np
+
+from utils import gen_label, encode, decode, flip_coin, encrypt_xor, encrypt_hash, decrypt_hash, gen_prime, gen_safe_prime, is_prime, prime_factors, xor_bytes
+import algebra
 from algebra import PrimeCyclicGroup
+from circuit import Circuit, Gate, GateFunctions, topological_levels
+from garbled_circuit import GarbledCircuit
+from cipher import BACKENDS, get_backend
+from compact import CompactCircuit, OPCODES
+from bristol import load_bristol, iter_gates
+from garbled_file import GarbledFile, write_garbled
+import parallel
+from sss import SSS, PackedSSS, lagrange_coefficients, interpolate
+from algebra import batch_inverse
+from simulate import BitwiseGateFunctions, simulate, pack, unpack, exhaustive_inputs, truth_table, mismatches
+from parallel import ParallelGarbledCircuit
+from streaming import StreamingGarbler, evaluate_stream, last_uses
+from yao import evaluate, evaluate_levels
+import ot
+import runtime
+import benchmark
+from builder import CircuitBuilder
+import labels
+import plan
+from pool import GarblingPool, GarblingService
+from labels import LabelGenerator
+from optimize import CANONICAL, equivalent, optimize
+import instrument
+
+ADDER = Circuit(name="ADDER", alice=[1,2], bob=[3,4], out=[5,11,10], gates=[
+    Gate(5, "XOR", [1,3]),
+    Gate(6, "AND", [1,3]),
+    Gate(7, "XOR", [2,4]),
+    Gate(8, "AND", [2,4]),
+    Gate(9, "AND", [7,6]),
+    Gate(10, "OR", [8,9]),
+    Gate(11, "XOR", [7,6]),
+])
+
+MIXED = Circuit(name="MIXED", alice=[1,2], bob=[3], out=[8,9], gates=[
+    Gate(4, "XNOR", [1,3]),
+    Gate(5, "NAND", [4,2]),
+    Gate(6, "GEQ", [5,1]),
+    Gate(7, "LEQ", [6,3]),
+    Gate(8, "NOR", [7,4]),
+    Gate(9, "XNOR", [8,5]),
+])
+
+UNARY = Circuit(name="UNARY", alice=[1], bob=[2], out=[3,5,6,7], gates=[
+    Gate(3, "NOT", [1]),
+    Gate(4, "BUF", [2]),
+    Gate(5, "AND", [3,4]),
+    Gate(6, "NOT", [5]),
+    Gate(7, "XOR", [6,3]),
+])
+
+
+# 2-bit adder exercising every Bristol Fashion gate
+BRISTOL_ADDER = b"""11 20
+2 2 2
+1 3
+
+2 1 0 2 4 XOR
+2 1 0 2 5 AND
+2 1 1 3 6 XOR
+4 2 1 6 3 5 7 12 MAND
+1 1 7 13 INV
+1 1 12 14 INV
+2 1 13 14 15 AND
+1 1 1 16 EQ
+1 1 4 17 EQW
+2 1 6 5 18 XOR
+2 1 15 16 19 XOR
+"""
+
+
+def plain_evaluate(circuit: Circuit, inputs: dict[int, int]) -> dict[int, int]:
+    """Evaluate a circuit in the clear using GateFunctions."""
+    values = dict(inputs)
+    for gate in sorted(circuit.gates, key=lambda g: g.id):
+        values[gate.id] = int(GateFunctions[gate.type](*[values[i] for i in gate.inputs]))
+    return {out: values[out] for out in circuit.out}
+
+
+# small residue group keeping the many base OTs of the tests fast, ot.default_group() is 2048 bits
+TEST_GROUP = ot.residue_group(284431605386864643794266370566751791679)
+
+
+def garbled_evaluate(garbled_circuit: GarbledCircuit, inputs: dict[int, int]) -> dict[int, int]:
+    """Evaluate a garbled circuit by handing out the input keys directly."""
+    circuit = garbled_circuit.circuit
+    keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+    a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.alice}
+    b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.bob}
+    return evaluate(circuit, garbled_circuit.get_garbled_tables(), garbled_circuit.get_pbits_out(),
+            a_inputs, b_inputs, garbled_circuit.encryption_method, garbled_circuit.kappa, garbled_circuit.scheme)
+
+
+def all_inputs(circuit: Circuit):
+    wires = circuit.alice + circuit.bob
+    for bits in product((0, 1), repeat=len(wires)):
+        yield dict(zip(wires, bits))
 
 class TestCircuitGenerator(unittest.TestCase):
         def test_encoding_decoding(self):
@@ -91,7 +204,1106 @@ class PrimeCyclicGroupTests(unittest.TestCase):
             # print(json.dumps(generated, indent=4, sort_keys=True))
             self.assertEqual(s, [])
 
+    def test_is_prime(self):
+        sieve = [True] * 2000
+        for n in range(2, 2000):
+            if sieve[n]:
+                sieve[n*n::n] = [False] * len(sieve[n*n::n])
+        self.assertEqual([n for n in range(2000) if is_prime(n)], [n for n in range(2, 2000) if sieve[n]])
+        # Carmichael numbers and strong pseudoprimes to base 2
+        for n in (561, 2047, 3277, 4033, 3215031751, 3825123056546413051, 318665857834031151167461):
+            self.assertFalse(is_prime(n), n)
+        for n in (2**61 - 1, 2**89 - 1, 2**127 - 1, 91994388364979):
+            self.assertTrue(is_prime(n), n)
+        self.assertFalse(is_prime((2**61 - 1) * (2**31 - 1)))
+
+    def test_safe_prime_and_factors(self):
+        for bits in (8, 64, 128):
+            prime = gen_safe_prime(bits)
+            self.assertEqual(prime.bit_length(), bits)
+            self.assertTrue(is_prime(prime) and is_prime(prime // 2))
+            self.assertEqual(PrimeCyclicGroup(prime).order_factors(), [2, prime // 2])
+        self.assertEqual(prime_factors(2**127 - 2), [2, 3, 7, 19, 43, 73, 127, 337, 5419, 92737, 649657, 77158673929])
+        self.assertEqual(prime_factors(2 * 3**4 * 1000003**2), [2, 3, 1000003])
+
+    def test_generator_validation(self):
+        self.assertEqual(PrimeCyclicGroup(23, 5).generator, 5)
+        with self.assertRaises(ValueError):
+            PrimeCyclicGroup(23, 2) # 2 is a square modulo 23
+
+    def test_parameter_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'groups.json')
+            os.environ[algebra.GROUP_CACHE_ENV] = path
+            try:
+                group = PrimeCyclicGroup.cached(32)
+                self.assertEqual(group.prime.bit_length(), 32)
+                self.assertTrue(os.path.exists(path))
+                self.assertEqual(PrimeCyclicGroup.cached(32).generator, group.generator)
+                self.assertNotEqual(PrimeCyclicGroup.cached(40).prime, group.prime)
+                self.assertEqual(PrimeCyclicGroup.cached(32).prime, group.prime)
+                with open(path, 'w') as file:
+                    file.write('{"32": [15, 2]}')
+                self.assertNotEqual(PrimeCyclicGroup.cached(32).prime, 15)
+            finally:
+                del os.environ[algebra.GROUP_CACHE_ENV]
+
+    def test_fixed_base_gen_pow(self):
+        for prime in (2, 3, 101, 2**61 - 1):
+            group = PrimeCyclicGroup(prime)
+            for exponent in (0, 1, 2, 255, 256, prime - 2, prime - 1, prime, 3 * prime + 7, -5):
+                self.assertEqual(group.gen_pow(exponent), pow(group.generator, exponent, prime))
+        self.assertEqual(group.gen_pow_many([5, 6]), [group.gen_pow(5), group.gen_pow(6)])
+
+    def test_multi_pow(self):
+        group = PrimeCyclicGroup(2**61 - 1)
+        for n in (0, 1, 5, 40, 300):
+            bases = [group.rand_int() for _ in range(n)]
+            exponents = [group.rand_int() for _ in range(n)]
+            expected = 1
+            for base, exponent in zip(bases, exponents):
+                expected = group.mul(expected, group.pow(base, exponent))
+            self.assertEqual(group.multi_pow(bases, exponents), expected)
+        with self.assertRaises(ValueError):
+            group.multi_pow([2], [])
+
+
+
+class GarbledCircuitTests(unittest.TestCase):
+
+    def assertGarbledCorrect(self, circuit, encryption_method, kappa, scheme):
+        garbled_circuit = GarbledCircuit(circuit, encryption_method, kappa, scheme)
+        inputs, width = exhaustive_inputs(circuit)
+        results = [garbled_evaluate(garbled_circuit, assignment) for assignment in unpack(inputs, width)]
+        self.assertEqual(pack(results), truth_table(circuit))
+
+    def test_classic(self):
+        for circuit in (ADDER, MIXED):
+            self.assertGarbledCorrect(circuit, 'xor', 1, 'classic')
+
+    def test_free_xor(self):
+        for circuit in (ADDER, MIXED):
+            self.assertGarbledCorrect(circuit, 'xor', 1, 'free_xor')
+
+    def test_free_xor_keys_share_offset(self):
+        garbled_circuit = GarbledCircuit(ADDER, 'xor', 1, 'free_xor')
+        for key_zero, key_one in garbled_circuit.keys.values():
+            self.assertEqual(xor_bytes(key_zero, key_one), garbled_circuit.delta)
+
+    def test_free_xor_skips_tables(self):
+        stats = GarbledCircuit(ADDER, 'xor', 1, 'free_xor').stats()
+        self.assertEqual((stats.gates, stats.tables, stats.skipped_tables), (7, 4, 3))
+        stats = GarbledCircuit(ADDER, 'xor', 1, 'classic').stats()
+        self.assertEqual((stats.tables, stats.skipped_tables), (7, 0))
+        self.assertEqual(stats.table_bytes, 7 * 4 * 2)
+
+    def test_half_gates(self):
+        for kappa in (1, 16):
+            for circuit in (ADDER, MIXED):
+                self.assertGarbledCorrect(circuit, 'hash', kappa, 'half_gates')
+
+    def test_half_gates_tables_have_two_rows(self):
+        kappa = 16
+        stats = GarbledCircuit(ADDER, 'hash', kappa, 'half_gates').stats()
+        self.assertEqual((stats.tables, stats.skipped_tables), (4, 3))
+        self.assertEqual(stats.bytes_per_and_gate, 2 * (kappa + 1))
+
+    def test_half_gates_requires_hash(self):
+        self.assertRaises(ValueError, GarbledCircuit, ADDER, 'xor', 1, 'half_gates')
+
+    def test_wide_label_backends(self):
+        for method in ('blake2', 'fixed_key'):
+            for scheme in ('classic', 'free_xor', 'half_gates'):
+                self.assertGarbledCorrect(MIXED, method, 16, scheme)
+
+    def test_evaluate_levels_matches_evaluate(self):
+        for kappa in (1, 16):
+            for scheme in ('classic', 'free_xor'):
+                for circuit in (ADDER, MIXED):
+                    garbled_circuit = GarbledCircuit(circuit, 'xor', kappa, scheme)
+                    keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+                    for inputs in all_inputs(circuit):
+                        a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.alice}
+                        b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.bob}
+                        args = (circuit, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(), a_inputs, b_inputs, 'xor', kappa, scheme)
+                        self.assertEqual(evaluate_levels(*args), evaluate(*args))
+
+    def test_unary_gates_are_free(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            self.assertGarbledCorrect(UNARY, 'blake2', 16, scheme)
+            garbled_circuit = GarbledCircuit(UNARY, 'blake2', 16, scheme)
+            self.assertEqual(set(garbled_circuit.garbled_tables), {5, 7} if scheme == 'classic' else {5})
+            key_zero, key_one = garbled_circuit.keys[1]
+            self.assertEqual(garbled_circuit.keys[3], (key_one, key_zero))
+            self.assertEqual(garbled_circuit.pbits[3], garbled_circuit.pbits[1] ^ 1)
+            self.assertEqual(garbled_circuit.keys[4], garbled_circuit.keys[2])
+        for scheme in ('classic', 'free_xor'):
+            garbled_circuit = GarbledCircuit(UNARY, 'xor', 1, scheme)
+            keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+            for inputs in all_inputs(UNARY):
+                a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in UNARY.alice}
+                b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in UNARY.bob}
+                args = (UNARY, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(), a_inputs, b_inputs, 'xor', 1, scheme)
+                self.assertEqual(evaluate_levels(*args), plain_evaluate(UNARY, inputs))
+
+    def test_evaluate_levels_file(self):
+        garbled_circuit = GarbledCircuit(MIXED, 'xor', 16, 'classic')
+        buffer = io.BytesIO()
+        write_garbled(garbled_circuit, buffer)
+        garbled_file = GarbledFile(buffer.getvalue())
+        keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+        for inputs in all_inputs(MIXED):
+            a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.alice}
+            b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.bob}
+            result = evaluate_levels(MIXED, garbled_file.tables, garbled_file.pbits_out, a_inputs, b_inputs, 'xor', 16, 'classic')
+            self.assertEqual(result, plain_evaluate(MIXED, inputs))
+
+    def test_unknown_scheme(self):
+        self.assertRaises(ValueError, GarbledCircuit, ADDER, 'xor', 1, 'unknown')
+
+
+class CipherBackendTests(unittest.TestCase):
+
+    def test_registry(self):
+        self.assertEqual({'xor', 'hash', 'blake2', 'fixed_key'} - set(BACKENDS), set())
+        self.assertRaises(ValueError, get_backend, 'unknown', 1)
+
+    def test_xor_matches_encrypt_xor(self):
+        backend = get_backend('xor', 1)
+        key_one, key_two, value = gen_label(1), gen_label(1), gen_label(2)
+        self.assertEqual(backend.encrypt(3, key_one, key_two, value), encrypt_xor(key_two, encrypt_xor(key_one, value, 1), 1))
+
+    def test_round_trip(self):
+        for method in ('xor', 'blake2', 'fixed_key'):
+            for kappa in (1, 16, 32):
+                backend = get_backend(method, kappa)
+                key_one, key_two, value = gen_label(kappa), gen_label(kappa), gen_label(kappa+1)
+                encrypted = backend.encrypt(7, key_one, key_two, value)
+                self.assertEqual(len(encrypted), kappa+1)
+                self.assertEqual(backend.decrypt(7, key_one, key_two, encrypted), value)
+
+    def test_gate_pads_match_single(self):
+        for method in ('xor', 'blake2', 'fixed_key'):
+            backend = get_backend(method, 16)
+            pairs = [(gen_label(16), gen_label(16)) for _ in range(4)]
+            self.assertEqual(backend.derive_keys(1, pairs), [backend.derive_key(1, *pair) for pair in pairs])
+
+    def test_fixed_key_tweak_does_not_wrap(self):
+        backend = get_backend('fixed_key', 1)
+        key_one, key_two = gen_label(1), gen_label(1)
+        self.assertNotEqual(backend.derive_key(1, key_one, key_two), backend.derive_key(2, key_one, key_two))
+        with self.assertRaises(ValueError):
+            backend.derive_key(1 + 2**16, key_one, key_two)
+        with self.assertRaises(ValueError):
+            backend.hash_label(2**16, bytes(2))
+
+    def test_pads_depend_on_index(self):
+        for method in ('blake2', 'fixed_key'):
+            backend = get_backend(method, 16)
+            key_one, key_two = gen_label(16), gen_label(16)
+            self.assertNotEqual(backend.derive_key(1, key_one, key_two), backend.derive_key(2, key_one, key_two))
+            self.assertNotEqual(backend.hash_label(1, key_one + b'\x00'), backend.hash_label(2, key_one + b'\x00'))
+
+    def test_xor_can_not_hash(self):
+        self.assertRaises(ValueError, get_backend('xor', 1).hash_label, 1, bytes(2))
+
+
+class CompactCircuitTests(unittest.TestCase):
+
+    def test_round_trip(self):
+        for circuit in (ADDER, MIXED):
+            compact = CompactCircuit.from_circuit(circuit)
+            self.assertEqual(compact.to_circuit(), circuit._replace(gates=sorted(circuit.gates, key=lambda g: g.id)))
+
+    def test_dense_indices(self):
+        compact = CompactCircuit.from_circuit(ADDER)
+        self.assertEqual(compact.alice + compact.bob, [0, 1, 2, 3])
+        self.assertEqual(list(compact.wires()), list(range(11)))
+        self.assertEqual(compact.gates[0], Gate(4, 'XOR', [0, 2]))
+        self.assertEqual(compact.out, [4, 10, 9])
+        self.assertEqual(compact.nbytes, 7 * (1 + 4 + 4))
+
+    def test_garble_compact(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            compact = CompactCircuit.from_circuit(MIXED)
+            garbled_circuit = GarbledCircuit(compact, 'blake2', 16, scheme)
+            for inputs in all_inputs(compact):
+                self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(compact.to_circuit(False), inputs))
+
+    def test_undefined_wire(self):
+        circuit = Circuit(name="BAD", alice=[1], bob=[2], out=[3], gates=[Gate(3, "AND", [1, 4])])
+        self.assertRaises(ValueError, CompactCircuit.from_circuit, circuit)
+
+
+class BristolTests(unittest.TestCase):
+
+    def assertAdds(self, circuit):
+        for x, y in product(range(4), repeat=2):
+            inputs = {0: x & 1, 1: x >> 1, 2: y & 1, 3: y >> 1}
+            result = plain_evaluate(circuit, inputs)
+            self.assertEqual(sum(bit << i for i, bit in enumerate(result[w] for w in circuit.out)), x + y)
+
+    def test_load_circuit(self):
+        circuit = load_bristol(BRISTOL_ADDER, 'adder', compact=False)
+        self.assertEqual((circuit.alice, circuit.bob), ([0, 1], [2, 3]))
+        self.assertEqual(len(circuit.gates), 12)
+        self.assertEqual([gate.id for gate in circuit.gates], list(range(4, 16)))
+        self.assertEqual([gate.inputs for gate in circuit.gates if gate.type in ('NOT', 'BUF')], [[7], [8], [4]])
+        self.assertAdds(circuit)
+
+    def test_load_compact_from_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'adder.txt')
+            with open(path, 'wb') as file:
+                file.write(BRISTOL_ADDER)
+            compact = load_bristol(path, 'adder')
+            self.assertEqual(list(iter_gates(path)), list(compact.gates))
+        self.assertAdds(compact.to_circuit())
+        garbled_circuit = GarbledCircuit(compact, 'blake2', 16, 'half_gates')
+        for inputs in all_inputs(compact):
+            self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(compact.to_circuit(), inputs))
+
+    def test_invalid_gates(self):
+        self.assertRaises(ValueError, load_bristol, b"1 3\n2 1 1\n1 1\n2 1 0 1 2 OR\n")
+        self.assertRaises(ValueError, load_bristol, b"1 4\n2 1 1\n1 1\n2 1 0 2 3 AND\n")
+
+
+class StreamingTests(unittest.TestCase):
+
+    def test_last_uses(self):
+        last = last_uses(ADDER)
+        self.assertEqual((last[1], last[6], last[9], last[10]), (1, 6, 5, 7))
+        compact = CompactCircuit.from_circuit(ADDER)
+        self.assertEqual(last_uses(compact).tolist(), [1, 3, 1, 3, 7, 6, 6, 5, 5, 7, 7])
+
+    def test_stream_matches_plain(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            for circuit in (ADDER, MIXED, UNARY, CompactCircuit.from_circuit(MIXED), CompactCircuit.from_circuit(UNARY)):
+                for inputs in all_inputs(circuit):
+                    garbler = StreamingGarbler(circuit, 'blake2', 16, scheme)
+                    keys, pbits = garbler.keys, garbler.pbits
+                    a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.alice}
+                    b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.bob}
+                    result = evaluate_stream(circuit, garbler.tables(), garbler.pbits, a_inputs, b_inputs, 'blake2', 16, scheme)
+                    expected = plain_evaluate(circuit if isinstance(circuit, Circuit) else circuit.to_circuit(False), inputs)
+                    self.assertEqual(result, expected)
+
+    def test_memory_follows_width(self):
+        # a chain of 1000 gates only ever needs a handful of live keys
+        gates = [Gate(3, "AND", [1, 2])] + [Gate(i, "XOR" if i % 2 else "AND", [i-1, 1]) for i in range(4, 1003)]
+        circuit = Circuit(name="CHAIN", alice=[1], bob=[2], out=[1002], gates=gates)
+        garbler = StreamingGarbler(circuit, 'blake2', 16, 'free_xor')
+        tables = list(garbler.tables())
+        self.assertEqual(len(tables), 501)
+        self.assertLessEqual(garbler.peak_keys, 4)
+        self.assertEqual(set(garbler.keys), {1002})
+
+
+class GarbledFileTests(unittest.TestCase):
+
+    def test_tables_outlive_the_file(self):
+        garbled_circuit = GarbledCircuit(MIXED, 'blake2', 16, 'half_gates')
+        keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+        inputs = {1: 1, 2: 0, 3: 1}
+        a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.alice}
+        b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.bob}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'mixed.gc')
+            garbled_circuit.write(path)
+            with GarbledFile(path) as garbled_file:
+                tables, pbits_out = garbled_file.tables, garbled_file.pbits_out
+                row = tables[5][(0,)]
+                result = evaluate(MIXED, tables, pbits_out, a_inputs, b_inputs, 'blake2', 16, 'half_gates')
+            self.assertEqual(result, plain_evaluate(MIXED, inputs))
+            # still mapped while referenced after close
+            self.assertEqual(bytes(row), garbled_circuit.garbled_tables[5][(0,)])
+            self.assertEqual(evaluate(MIXED, tables, pbits_out, a_inputs, b_inputs, 'blake2', 16, 'half_gates'), result)
+            del tables, row
+
+    def test_write_and_evaluate(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            garbled_circuit = GarbledCircuit(MIXED, 'blake2', 16, scheme)
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'mixed.gc')
+                garbled_circuit.write(path)
+                with GarbledFile(path) as garbled_file:
+                    self.assertEqual((garbled_file.kappa, garbled_file.scheme, garbled_file.encryption_method), (16, scheme, 'blake2'))
+                    self.assertEqual((garbled_file.alice, garbled_file.bob, garbled_file.out), (MIXED.alice, MIXED.bob, MIXED.out))
+                    self.assertEqual(garbled_file.pbits_out, garbled_circuit.get_pbits_out())
+                    self.assertEqual({gate_id: {entry: bytes(row) for entry, row in table.items()} for gate_id, table in garbled_file.tables.items()},
+                            garbled_circuit.garbled_tables)
+
+                    keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+                    for inputs in all_inputs(MIXED):
+                        a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.alice}
+                        b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in MIXED.bob}
+                        result = evaluate(MIXED, garbled_file.tables, garbled_file.pbits_out, a_inputs, b_inputs, 'blake2', 16, scheme)
+                        self.assertEqual(result, plain_evaluate(MIXED, inputs))
+
+    def test_rows_are_not_copied(self):
+        garbled_circuit = GarbledCircuit(ADDER, 'xor', 1, 'classic')
+        buffer = io.BytesIO()
+        write_garbled(garbled_circuit, buffer)
+        garbled_file = GarbledFile(buffer.getvalue())
+        row = garbled_file.tables[6][(1, 0)]
+        self.assertIsInstance(row, memoryview)
+        self.assertEqual(row.obj, garbled_file.buffer.obj)
+        self.assertNotIn(99, garbled_file.tables)
+
+    def test_bad_magic(self):
+        self.assertRaises(ValueError, GarbledFile, bytes(64))
+
+
+class SeededLabelTests(unittest.TestCase):
+
+    def test_generator(self):
+        generator = LabelGenerator(b'seed', 16, pairs=True)
+        wires = [0, 1, labels.BLOCK_WIRES - 1, labels.BLOCK_WIRES, 5 * labels.BLOCK_WIRES + 3]
+        keys = [generator.keys(wire) for wire in wires]
+        self.assertEqual(keys, [LabelGenerator(b'seed', 16, pairs=True).keys(wire) for wire in reversed(wires)][::-1])
+        self.assertEqual(len({key for pair in keys for key in pair}), 2 * len(wires))
+        self.assertTrue(all(len(key) == 16 for pair in keys for key in pair))
+        self.assertNotEqual(LabelGenerator(b'other', 16, pairs=True).keys(0), keys[0])
+        self.assertIsNone(LabelGenerator(b'seed', 16, pairs=False).keys(0)[1])
+        pbits = [generator.pbit(wire) for wire in range(64)]
+        self.assertEqual(set(pbits), {0, 1})
+        self.assertLessEqual(len(generator.blocks), labels.CACHED_BLOCKS)
+
+    def test_recently_used_blocks_are_kept(self):
+        generator = LabelGenerator(b'seed', 16, pairs=False)
+        first = generator.block(0)
+        for index in range(1, 3 * labels.CACHED_BLOCKS):
+            # the input wires of block 0 are read between the gates of every later block
+            generator.keys(index * labels.BLOCK_WIRES)
+            generator.keys(0)
+        self.assertIs(generator.blocks[0], first) # never evicted and derived again
+        self.assertEqual(len(generator.blocks), labels.CACHED_BLOCKS)
+
+    def test_only_derived_keys_are_stored(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            garbled_circuit = GarbledCircuit(ADDER, 'blake2', 16, scheme, seed=b'seed')
+            self.assertEqual(set(garbled_circuit.keys.stored), garbled_circuit.derived)
+            self.assertEqual(set(garbled_circuit.keys), set(ADDER.wires()))
+            for key_zero, key_one in garbled_circuit.keys.values():
+                if scheme != 'classic':
+                    self.assertEqual(xor_bytes(key_zero, key_one), garbled_circuit.delta)
+            for inputs in all_inputs(ADDER):
+                self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(ADDER, inputs))
+
+    def test_streaming_matches_seeded_garbling(self):
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            garbled_circuit = GarbledCircuit(MIXED, 'blake2', 16, scheme, seed=b'seed')
+            garbler = StreamingGarbler(MIXED, 'blake2', 16, scheme, seed=b'seed')
+            self.assertEqual(dict(garbler.tables()), garbled_circuit.garbled_tables)
+            self.assertEqual({wire: garbler.pbits[wire] for wire in MIXED.out}, garbled_circuit.get_pbits_out())
+            self.assertLessEqual(len(garbler.keys), len(MIXED.out)) # derived outputs only
+
+
+class EvaluationPlanTests(unittest.TestCase):
+
+    def setUp(self):
+        plan.clear_plans()
+
+    def test_cached_by_content(self):
+        first = plan.get_plan(ADDER, 'classic')
+        self.assertIs(plan.get_plan(ADDER, 'classic'), first)
+        rebuilt = Circuit(ADDER.name, list(ADDER.alice), list(ADDER.bob), list(ADDER.out), list(ADDER.gates))
+        self.assertIs(plan.get_plan(rebuilt, 'classic'), first)
+        self.assertIsNot(plan.get_plan(ADDER, 'free_xor'), first)
+        self.assertIsNot(plan.get_plan(MIXED, 'classic'), first)
+
+    def test_circuit_edited_in_place(self):
+        circuit = Circuit("EDITED", [1], [2], [3], [Gate(3, "AND", [1, 2])])
+        first = plan.get_plan(circuit, 'classic')
+        circuit.gates[0] = Gate(3, "XOR", [1, 2])
+        self.assertIsNot(plan.get_plan(circuit, 'classic'), first)
+        compact = CompactCircuit.from_circuit(MIXED)
+        first = plan.get_plan(compact, 'classic')
+        compact.ops[0] = OPCODES['NAND'] if compact.ops[0] != OPCODES['NAND'] else OPCODES['AND']
+        self.assertIsNot(plan.get_plan(compact, 'classic'), first)
+        # the caches do not keep the circuit alive
+        reference = weakref.ref(compact)
+        del compact
+        gc.collect()
+        self.assertIsNone(reference())
+
+    def test_bounded(self):
+        size = plan.PLAN_CACHE_SIZE
+        plan.PLAN_CACHE_SIZE = 2
+        try:
+            first = plan.get_plan(ADDER, 'classic')
+            plan.get_plan(MIXED, 'classic')
+            plan.get_plan(UNARY, 'classic')
+            self.assertEqual(len(plan._plans), 2)
+            self.assertIsNot(plan.get_plan(ADDER, 'classic'), first)
+        finally:
+            plan.PLAN_CACHE_SIZE = size
+
+    def test_layout(self):
+        garbled_circuit = GarbledCircuit(MIXED, 'xor', 1, 'free_xor')
+        evaluation_plan = plan.get_plan(MIXED, 'free_xor')
+        self.assertEqual(evaluation_plan.table_gates.tolist(), [5, 6, 7, 8])
+        self.assertEqual(evaluation_plan.outputs, [(8, 7), (9, 8)])
+        rows = evaluation_plan.rows(garbled_circuit.garbled_tables, 2)
+        for kind, gate_id, _, _, _, row in evaluation_plan.steps:
+            if kind == plan.TABLE:
+                for a, b in product((0, 1), repeat=2):
+                    self.assertEqual(rows[2*(row + 2*a + b):2*(row + 2*a + b + 1)], garbled_circuit.garbled_tables[gate_id][(a, b)])
+
+    def test_file_rows_not_copied(self):
+        garbled_circuit = GarbledCircuit(MIXED, 'blake2', 16, 'half_gates')
+        buffer = io.BytesIO()
+        write_garbled(garbled_circuit, buffer)
+        garbled_file = GarbledFile(buffer.getvalue())
+        evaluation_plan = plan.get_plan(MIXED, 'half_gates')
+        self.assertIs(evaluation_plan.rows(garbled_file.tables, 17), garbled_file.tables.rows)
+        # a plan in another order gathers the rows, missing tables raise KeyError
+        reordered = evaluation_plan._replace(table_gates=evaluation_plan.table_gates[::-1])
+        self.assertEqual(reordered.rows(garbled_file.tables, 17), reordered.rows(garbled_circuit.garbled_tables, 17))
+        with self.assertRaises(KeyError):
+            evaluation_plan._replace(table_gates=np.array([5, 99])).rows(garbled_file.tables, 17)
+
+    def test_ids_out_of_order(self):
+        # gate 3 reads gate 5, so id order is not topological
+        circuit = Circuit(name="SHUFFLED", alice=[1], bob=[2], out=[3], gates=[
+            Gate(3, "AND", [5, 4]),
+            Gate(4, "XOR", [1, 2]),
+            Gate(5, "OR", [4, 1]),
+        ])
+        self.assertEqual([gate.id for gate in plan.topological_order(circuit)], [4, 5, 3])
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            for garbled_circuit in (GarbledCircuit(circuit, 'blake2', 16, scheme), ParallelGarbledCircuit(circuit, 'blake2', 16, scheme, workers=1)):
+                for inputs in all_inputs(circuit):
+                    self.assertEqual(garbled_evaluate(garbled_circuit, inputs), {3: inputs[1] ^ inputs[2]})
+            for inputs in all_inputs(circuit):
+                garbler = StreamingGarbler(circuit, 'blake2', 16, scheme)
+                keys, pbits = garbler.keys, garbler.pbits
+                a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.alice}
+                b_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in circuit.bob}
+                result = evaluate_stream(circuit, garbler.tables(), garbler.pbits, a_inputs, b_inputs, 'blake2', 16, scheme)
+                self.assertEqual(result, {3: inputs[1] ^ inputs[2]})
+
+    def test_invalid(self):
+        undefined = Circuit(name="UNDEFINED", alice=[1], bob=[2], out=[3], gates=[Gate(3, "AND", [1, 9])])
+        self.assertRaises(ValueError, plan.compile_plan, undefined, 'classic')
+        cycle = Circuit(name="CYCLE", alice=[1], bob=[2], out=[4], gates=[Gate(3, "AND", [1, 4]), Gate(4, "AND", [3, 2])])
+        self.assertRaises(ValueError, plan.compile_plan, cycle, 'classic')
+        twice = Circuit(name="TWICE", alice=[1], bob=[2], out=[3], gates=[Gate(3, "AND", [1, 2]), Gate(3, "XOR", [1, 2])])
+        self.assertRaises(ValueError, plan.compile_plan, twice, 'classic')
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class GarblingPoolTests(unittest.TestCase):
+
+    def test_take_once_and_refill(self):
+        with GarblingPool(ADDER, capacity=4, low_water=2) as pool:
+            wait_until(lambda: pool.metrics().depth == 4)
+            taken = [pool.take() for _ in range(3)]
+            self.assertEqual(len({id(instance) for instance in taken}), 3)
+            self.assertEqual(len({instance.delta for instance in taken}), 3)
+            wait_until(lambda: pool.metrics().depth == 4)
+            metrics = pool.metrics()
+            self.assertEqual((metrics.hits, metrics.misses, metrics.garbled), (3, 0, 7))
+            self.assertGreater(metrics.refill_rate, 0)
+            for inputs in all_inputs(ADDER):
+                self.assertEqual(garbled_evaluate(taken[0], inputs), plain_evaluate(ADDER, inputs))
+
+    def test_no_refill_above_low_water(self):
+        with GarblingPool(ADDER, capacity=4, low_water=2) as pool:
+            wait_until(lambda: pool.metrics().depth == 4)
+            pool.take()
+            pool.take()
+            time.sleep(0.05)
+            self.assertEqual(pool.metrics().depth, 2)
+
+    def test_miss_garbles_inline(self):
+        pool = GarblingPool(MIXED, 'xor', 1, 'free_xor')
+        garbled_circuit = pool.take()
+        self.assertEqual(pool.metrics().misses, 1)
+        for inputs in all_inputs(MIXED):
+            self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(MIXED, inputs))
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with GarblingPool(MIXED, 'fixed_key', 16, 'half_gates', capacity=3, low_water=1, spill_dir=directory, in_memory=1) as pool:
+                wait_until(lambda: pool.metrics().depth == 3)
+                self.assertEqual(pool.metrics().spilled, 2)
+                spilled = [os.path.join(directory, name) for name in os.listdir(directory)]
+                self.assertEqual(len(spilled), 2)
+                for _ in range(3):
+                    garbled_circuit = pool.take()
+                    for inputs in all_inputs(MIXED):
+                        self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(MIXED, inputs))
+                self.assertFalse(any(os.path.exists(path) for path in spilled))
+            self.assertEqual(os.listdir(directory), []) # the refill is deleted on close
+
+    def test_process_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with GarblingPool(MIXED, 'fixed_key', 16, 'half_gates', capacity=3, low_water=1, spill_dir=directory, in_memory=1,
+                    workers=2, processes=True) as pool:
+                wait_until(lambda: pool.metrics().depth == 3, 60)
+                self.assertEqual(len(os.listdir(directory)), 2)
+                taken = [pool.take() for _ in range(3)]
+                self.assertEqual(len({instance.delta for instance in taken}), 3)
+                for garbled_circuit in taken:
+                    for inputs in all_inputs(MIXED):
+                        self.assertEqual(garbled_evaluate(garbled_circuit, inputs), plain_evaluate(MIXED, inputs))
+
+    def test_take_during_refill(self):
+        # take() only pops a ready instance, it never waits for the garblings in progress
+        circuit = benchmark.multiplier(8)
+        with GarblingPool(circuit, capacity=8, low_water=7, workers=2, processes=True) as pool:
+            wait_until(lambda: pool.metrics().depth == 8, 60)
+            during_refill = 0
+            for _ in range(16):
+                wait_until(lambda: pool.metrics().depth > 0, 60)
+                # no worker can finish an instance while the lock is held, so take() cannot wait for one
+                with pool.condition:
+                    pending = pool.pending
+                    pool.take()
+                    self.assertEqual(pool.pending, pending)
+                during_refill += pending > 0
+            metrics = pool.metrics()
+            self.assertEqual(metrics.misses, 0)
+            self.assertGreater(metrics.garbled, 8)
+            self.assertGreater(during_refill, 0)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, GarblingPool, ADDER, capacity=2, low_water=3)
+        self.assertRaises(ValueError, GarblingPool, ADDER, capacity=2, low_water=0)
+        with GarblingPool(ADDER, scheme='unknown') as pool:
+            wait_until(lambda: pool.error is not None)
+            self.assertRaises(RuntimeError, pool.take)
+
+    def test_service(self):
+        with GarblingService(capacity=2, low_water=1) as service:
+            service.take(ADDER, timeout=10)
+            rebuilt = Circuit(ADDER.name, list(ADDER.alice), list(ADDER.bob), list(ADDER.out), list(ADDER.gates))
+            self.assertIs(service.pool(rebuilt), service.pool(ADDER))
+            service.take(MIXED, timeout=10)
+            metrics = service.metrics()
+            self.assertEqual(set(metrics), {'ADDER', 'MIXED'})
+            self.assertEqual(metrics['ADDER'].hits, 1)
+
+
+class InstrumentTests(unittest.TestCase):
+
+    def test_record_garble_and_evaluate(self):
+        with instrument.record() as recorder:
+            garbled_circuit = GarbledCircuit(ADDER, 'blake2', 16, 'half_gates')
+            for inputs in all_inputs(ADDER):
+                garbled_evaluate(garbled_circuit, inputs)
+        metrics = recorder.to_dict()
+        self.assertEqual(set(metrics['phases']), {'garble.configure', 'garble.wires', 'garble.pbits', 'garble.keys',
+                'garble.tables', 'evaluate.plan', 'evaluate.gates'})
+        self.assertEqual(metrics['phases']['evaluate.gates']['calls'], 16)
+        gate_types = {gate_type: sum(gate.type == gate_type for gate in ADDER.gates) for gate_type in ('AND', 'XOR', 'OR')}
+        self.assertEqual(metrics['gates']['garbled'], {gate_type: count for gate_type, count in gate_types.items() if count})
+        self.assertEqual(metrics['gates']['evaluated'], {gate_type: 16*count for gate_type, count in gate_types.items() if count})
+        self.assertGreater(metrics['hashes']['label_hashes'], 0)
+        table_bytes = garbled_circuit.stats().table_bytes
+        self.assertEqual(metrics['table_bytes'], {'produced': table_bytes, 'consumed': 16*table_bytes})
+        self.assertGreater(metrics['labels']['peak'], 0)
+        self.assertEqual(json.loads(recorder.to_json()), metrics)
+
+    def test_parallel_counts_each_recording(self):
+        pads = []
+        for _ in range(2):
+            with instrument.record() as recorder:
+                ParallelGarbledCircuit(MIXED, 'blake2', 16, 'classic', workers=1)
+            pads.append(recorder.to_dict()['hashes']['pads'])
+        self.assertGreater(pads[0], 0)
+        self.assertEqual(pads[0], pads[1])
+
+    def test_stream_counts(self):
+        with instrument.record() as recorder:
+            garbler = StreamingGarbler(MIXED, 'blake2', 16, 'classic')
+            keys, pbits = garbler.keys, garbler.pbits
+            a_inputs = {w: (keys[w][0], pbits[w]) for w in MIXED.alice}
+            b_inputs = {w: (keys[w][0], pbits[w]) for w in MIXED.bob}
+            evaluate_stream(MIXED, garbler.tables(), garbler.pbits, a_inputs, b_inputs, 'blake2', 16, 'classic')
+        metrics = recorder.to_dict()
+        self.assertEqual(metrics['table_bytes']['produced'], metrics['table_bytes']['consumed'])
+        self.assertEqual(metrics['hashes']['pads'], 5 * len(MIXED.gates))
+        self.assertEqual(metrics['gates']['garbled'], metrics['gates']['evaluated'])
+
+    def test_counts_from_threads(self):
+        with instrument.record() as recorder:
+            backend = get_backend('blake2', 16)
+            threads = [threading.Thread(target=lambda: [backend.hash_label(i, bytes(17)) for i in range(2000)]) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(recorder.to_dict()['hashes']['label_hashes'], 8 * 2000)
+
+    def test_disabled(self):
+        self.assertIsNone(instrument.active)
+        self.assertNotIsInstance(get_backend('blake2', 16), instrument.CountingBackend)
+        with instrument.record():
+            self.assertIsInstance(get_backend('blake2', 16), instrument.CountingBackend)
+            with self.assertRaises(RuntimeError):
+                with instrument.record():
+                    pass
+        self.assertIsNone(instrument.active)
+
+    def test_profile(self):
+        with instrument.record(profile=True) as recorder:
+            GarbledCircuit(ADDER, 'blake2', 16, 'classic')
+        profile = recorder.to_dict()['profile']
+        self.assertTrue(0 < len(profile) <= instrument.PROFILE_LIMIT)
+        self.assertTrue(any('generate_garbled_tables' in row['function'] for row in profile))
+        with tempfile.TemporaryDirectory() as directory:
+            recorder.dump_profile(os.path.join(directory, 'garble.prof'))
+        with self.assertRaises(ValueError):
+            instrument.Recorder().dump_profile('unused')
+
+
+class ParallelGarblingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.min_chunk = parallel.MIN_CHUNK
+        parallel.MIN_CHUNK = 1
+
+    def tearDown(self):
+        parallel.MIN_CHUNK = self.min_chunk
+
+    def test_seeded_garbling_is_reproducible(self):
+        first = GarbledCircuit(MIXED, 'xor', 1, 'classic', seed=b'seed')
+        second = GarbledCircuit(MIXED, 'xor', 1, 'classic', seed=b'seed')
+        self.assertEqual((first.keys, first.pbits, first.garbled_tables), (second.keys, second.pbits, second.garbled_tables))
+        third = GarbledCircuit(MIXED, 'xor', 1, 'classic', seed=b'other')
+        self.assertNotEqual(first.keys, third.keys)
+
+    def test_matches_single_core(self):
+        circuit = load_bristol(BRISTOL_ADDER, 'adder', compact=False)
+        for scheme in ('classic', 'free_xor', 'half_gates'):
+            for workers in (1, 2):
+                single = GarbledCircuit(circuit, 'blake2', 16, scheme, seed=b'seed')
+                multi = ParallelGarbledCircuit(circuit, 'blake2', 16, scheme, seed=b'seed', workers=workers)
+                self.assertEqual(multi.garbled_tables, single.garbled_tables)
+                self.assertEqual(multi.keys, single.keys)
+                self.assertEqual(multi.pbits, single.pbits)
+                for inputs in all_inputs(circuit):
+                    self.assertEqual(garbled_evaluate(multi, inputs), plain_evaluate(circuit, inputs))
+
+
+class SimulatorTests(unittest.TestCase):
+
+    def test_bitwise_matches_gate_functions(self):
+        mask = 0b1111
+        x, y = 0b0011, 0b0101
+        for gate_type, function in GateFunctions.items():
+            if gate_type in ('NOT', 'BUF'):
+                expected = [int(function(x >> i & 1)) for i in range(4)]
+                packed = BitwiseGateFunctions[gate_type](mask, x)
+            else:
+                expected = [int(function(x >> i & 1, y >> i & 1)) for i in range(4)]
+                packed = BitwiseGateFunctions[gate_type](mask, x, y)
+            self.assertEqual([packed >> i & 1 for i in range(4)], expected, gate_type)
+
+    def test_matches_plain_evaluation(self):
+        for circuit in (ADDER, MIXED):
+            inputs, width = exhaustive_inputs(circuit)
+            self.assertEqual(width, 2 ** len(circuit.alice + circuit.bob))
+            assignments = unpack(inputs, width)
+            self.assertEqual(assignments, list(all_inputs(circuit)))
+            self.assertEqual(unpack(simulate(circuit, inputs, width), width), [plain_evaluate(circuit, a) for a in assignments])
+
+    def test_mismatches(self):
+        self.assertEqual(mismatches(ADDER, ADDER), [])
+        broken = ADDER._replace(gates=[gate._replace(type='XNOR') if gate.id == 11 else gate for gate in ADDER.gates])
+        self.assertEqual(len(mismatches(broken, ADDER)), 16)
+        broken = ADDER._replace(gates=[gate._replace(type='NAND') if gate.id == 9 else gate for gate in ADDER.gates])
+        # the carry of gate 10 = OR(8, 9) only hides the broken gate 9 when 8 = AND(2, 4) is set
+        self.assertEqual(mismatches(broken, ADDER), [n for n in range(16) if not (n >> 2 & n & 1)])
+
+
+class ObliviousTransferTests(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.receiver = ot.setup(TEST_GROUP)
+
+    def test_base_ot(self):
+        group = ot.default_group()
+        choices = [0, 1, 1, 0]
+        sender, receiver = ot.BaseOTSender(group), ot.BaseOTReceiver(group, choices)
+        keys = sender.keys(receiver.reply(sender.public))
+        for pair, key, choice in zip(keys, receiver.keys(), choices):
+            self.assertEqual(key, pair[choice])
+            self.assertNotEqual(key, pair[1 - choice])
+
+    def test_default_group(self):
+        group = ot.default_group()
+        self.assertEqual((group.prime.bit_length(), group.order, group.generator), (2048, (ot.OT_PRIME - 1) // 2, 2))
+        self.assertEqual(group.gen_pow(group.order), 1)
+        with self.assertRaises(ValueError):
+            ot.residue_group(ot.OT_PRIME, 1)
+        with self.assertRaises(ValueError):
+            # a non-residue generates the whole group, not the subgroup of order q
+            ot.residue_group(ot.OT_PRIME, ot.OT_PRIME - 2)
+
+    def test_random_ot_extension(self):
+        corrections, choices, messages = self.receiver.extend(100, 17)
+        pairs = self.sender.extend(corrections, 17)
+        self.assertEqual(len(pairs), 100)
+        for pair, choice, message in zip(pairs, choices, messages):
+            self.assertEqual(message, pair[choice])
+            self.assertNotEqual(message, pair[1 - choice])
+
+    def test_tweaks_run_across_batches(self):
+        for count in (3, 5):
+            corrections, choices, messages = self.receiver.extend(count, 8)
+            self.assertEqual([pair[choice] for pair, choice in zip(self.sender.extend(corrections, 8), choices)], messages)
+        self.assertEqual((self.sender.extended, self.receiver.extended), (8, 8))
+
+    def test_pool_transfer(self):
+        pools = ot.precompute(self.sender, self.receiver, 30, 3)
+        ot.precompute(self.sender, self.receiver, 20, 3, pools)
+        self.assertEqual(len(pools[0]), 50)
+        messages = [(os.urandom(3), os.urandom(3)) for _ in range(40)]
+        bits = [flip_coin() for _ in messages]
+        self.assertEqual(ot.transfer(pools, messages, bits), [pair[bit] for pair, bit in zip(messages, bits)])
+        self.assertEqual((len(pools[0]), len(pools[1])), (10, 10))
+        with self.assertRaises(ValueError):
+            ot.transfer(pools, messages, bits)
+
+    def test_garbled_inputs(self):
+        garbled_circuit = GarbledCircuit(ADDER, 'xor', 1, 'free_xor')
+        keys, pbits = garbled_circuit.keys, garbled_circuit.pbits
+        pools = ot.precompute(self.sender, self.receiver, 2 * 16, 2)
+        expected = truth_table(ADDER)
+        for n, inputs in enumerate(all_inputs(ADDER)):
+            a_inputs = {w: (keys[w][inputs[w]], pbits[w] ^ inputs[w]) for w in ADDER.alice}
+            messages = [(keys[w][0] + bytes([pbits[w]]), keys[w][1] + bytes([pbits[w] ^ 1])) for w in ADDER.bob]
+            labels = ot.transfer(pools, messages, [inputs[w] for w in ADDER.bob])
+            b_inputs = {w: (label[:1], label[1]) for w, label in zip(ADDER.bob, labels)}
+            result = evaluate(ADDER, garbled_circuit.garbled_tables, garbled_circuit.get_pbits_out(), a_inputs, b_inputs, 'xor', 1, 'free_xor')
+            self.assertEqual(result, {w: expected[w] >> n & 1 for w in ADDER.out})
+
+
+class SSSTests(unittest.TestCase):
+    def test_egcd_modinv(self):
+        sss = SSS(5, PrimeCyclicGroup(91994388364979), 3, 2)
+        g, x, y = sss.egcd(240, 46)
+        self.assertEqual((g, 240*x + 46*y), (2, 2))
+        self.assertEqual(sss.modinv(3, 7), 5)
+        with self.assertRaises(Exception):
+            sss.modinv(4, 8)
+
+    def test_polyeval_no_overflow(self):
+        group = PrimeCyclicGroup(91994388364979)
+        polynomial = [4103884901909, 5481390490034, 91694388364660]
+        for y in (1, 5, 10**6):
+            self.assertEqual(group.polyeval(polynomial, y), (polynomial[0]*y*y + polynomial[1]*y + polynomial[2]) % group.prime)
+
+    def test_share_many(self):
+        group = PrimeCyclicGroup(91994388364979)
+        shares = SSS.share_many([91694388364660], group, 5, 3, [[4103884901909], [5481390490034]])
+        self.assertEqual(shares[:, 0].tolist(), [9285275391624, 27078320587385, 53079135586964, 87287720390361, 37709686632597])
+
+        for prime in (101, 2**31 - 1, 2**127 - 1):
+            group = PrimeCyclicGroup(prime)
+            keys = [group.rand_int() for _ in range(20)]
+            shares = SSS.share_many(keys, group, 6, 3)
+            self.assertEqual(shares.shape, (6, 20))
+            for j, key in enumerate(keys):
+                sss = SSS(key, group, 6, 3)
+                self.assertEqual(sss.reconstruct_key([(x, int(shares[x-1, j])) for x in (2, 4, 5)]), key)
+
+        with self.assertRaises(ValueError):
+            SSS.share_many([1, 2], group, 5, 3, [[1, 2]])
+
+    def test_batch_inverse(self):
+        prime = 2**61 - 1
+        values = [1, 2, 3, prime - 1, 12345678901234]
+        self.assertEqual(batch_inverse(values, prime), [pow(v, -1, prime) for v in values])
+        with self.assertRaises(ValueError):
+            batch_inverse([3, 0], prime)
+
+    def test_lagrange_cache(self):
+        lagrange_coefficients.cache_clear()
+        group = PrimeCyclicGroup(101)
+        sss = SSS(20, group, 6, 3)
+        self.assertEqual(sss.reconstruct_key([(1, 44), (2, 2), (3, 96)]), 20)
+        self.assertEqual(sss.reconstruct_key([(3, 96), (1, 44), (2, 2)]), 20)
+        self.assertEqual(lagrange_coefficients.cache_info().hits, 1)
+        # prod x_j / (x_j - x_i) for x = 1, 2, 3: 3, -3, 1
+        self.assertEqual(lagrange_coefficients(101, (1, 2, 3)), (3, 98, 1))
+        with self.assertRaises(ValueError):
+            lagrange_coefficients(101, (1, 102))
+
+    def test_reconstruct_many(self):
+        for prime in (2**31 - 1, 2**127 - 1):
+            group = PrimeCyclicGroup(prime)
+            keys = [group.rand_int() for _ in range(50)]
+            shares = SSS.share_many(keys, group, 7, 4)
+            quorum = [6, 1, 3, 7]
+            self.assertEqual(SSS.reconstruct_many(group, quorum, shares[[x - 1 for x in quorum]]).tolist(), keys)
+
+    def test_interpolate(self):
+        group = PrimeCyclicGroup(101)
+        # 3x^2 + 2x + 1 through x = 1, 2, 4, evaluated elsewhere
+        values = [[group.polyeval([3, 2, 1], x)] for x in (1, 2, 4)]
+        points = [0, -1, 3, 7]
+        self.assertEqual(interpolate(group, [1, 2, 4], values, points)[:, 0].tolist(), [group.polyeval([3, 2, 1], x) for x in points])
+        self.assertEqual(lagrange_coefficients(101, (1, 2, 4), 2), (0, 1, 0))
+
+    def test_packed_sharing(self):
+        for prime in (2**31 - 1, 2**127 - 1):
+            group = PrimeCyclicGroup(prime)
+            packed = PackedSSS(group, 9, 6, 4)
+            keys = [group.rand_int() for _ in range(40)]
+            shares = packed.share_many(keys)
+            self.assertEqual(shares.shape, (9, 10))
+            for quorum in ([1, 2, 3, 4, 5, 6], [9, 7, 5, 3, 2, 1], list(range(1, 10))):
+                self.assertEqual(packed.reconstruct_many(quorum, shares[[x - 1 for x in quorum]]).tolist(), keys)
+            # with k = 1 the shares are plain Shamir shares of the keys
+            single = PackedSSS(group, 5, 3, 1).share_many(keys)
+            self.assertEqual(SSS.reconstruct_many(group, [2, 4, 5], single[[1, 3, 4]]).tolist(), keys)
+        with self.assertRaises(ValueError):
+            packed.reconstruct_many([1, 2, 3], shares[:3])
+        with self.assertRaises(ValueError):
+            packed.share_many(keys[:3])
+        with self.assertRaises(ValueError):
+            PackedSSS(group, 5, 3, 3)
+
+
+class RuntimeTests(unittest.TestCase):
+    def run_protocol(self, circuit, inputs, *args, **kwargs):
+        a_inputs = {wire: inputs[wire] for wire in circuit.alice}
+        b_inputs = {wire: inputs[wire] for wire in circuit.bob}
+        return asyncio.run(runtime.run_local(circuit, a_inputs, b_inputs, *args, group=TEST_GROUP, **kwargs))
+
+    def test_all_inputs(self):
+        expected = truth_table(ADDER)
+        for method, kappa, scheme in (('blake2', 16, 'half_gates'), ('xor', 1, 'free_xor')):
+            for n, inputs in enumerate(all_inputs(ADDER)):
+                garbler_result, evaluator_result = self.run_protocol(ADDER, inputs, method, kappa, scheme)
+                self.assertEqual(evaluator_result, {wire: expected[wire] >> n & 1 for wire in ADDER.out})
+                self.assertEqual(garbler_result, evaluator_result)
+
+    def test_tcp_and_batches(self):
+        batch = runtime.TABLE_BATCH
+        runtime.TABLE_BATCH = 2
+        try:
+            inputs = {1: 1, 2: 0, 3: 1}
+            expected = plain_evaluate(MIXED, inputs)
+            for tcp in (False, True):
+                self.assertEqual(self.run_protocol(MIXED, inputs, 'fixed_key', 16, 'classic', tcp=tcp), (expected, expected))
+        finally:
+            runtime.TABLE_BATCH = batch
+
+    def test_evaluator_in_another_process(self):
+        # each process builds its own default group, they must agree on it
+        script = (
+            "import asyncio, json, sys\n"
+            "import benchmark, runtime\n"
+            "async def main(port, bits):\n"
+            "    reader, writer = await asyncio.open_connection('127.0.0.1', port)\n"
+            "    circuit = benchmark.adder(4)\n"
+            "    result = await runtime.Evaluator(circuit, dict(zip(circuit.bob, bits))).run(reader, writer)\n"
+            "    writer.close()\n"
+            "    print(json.dumps([result[wire] for wire in circuit.out]))\n"
+            "asyncio.run(main(int(sys.argv[1]), json.loads(sys.argv[2])))\n"
+        )
+        circuit = benchmark.adder(4)
+        a, b = 11, 6
+        inputs = number_inputs(circuit, a, b)
+        garbler = runtime.Garbler(circuit, {wire: inputs[wire] for wire in circuit.alice})
+
+        async def run():
+            accepted = asyncio.get_running_loop().create_future()
+            server = await asyncio.start_server(lambda reader, writer: accepted.set_result((reader, writer)), '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            evaluator = await asyncio.create_subprocess_exec(sys.executable, '-c', script, str(port),
+                    json.dumps([inputs[wire] for wire in circuit.bob]), stdout=asyncio.subprocess.PIPE,
+                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            try:
+                reader, writer = await asyncio.wait_for(accepted, 60)
+                server.close()
+                garbler_result = await asyncio.wait_for(garbler.run(reader, writer), 120)
+                writer.close()
+                output, _ = await asyncio.wait_for(evaluator.communicate(), 60)
+            finally:
+                if evaluator.returncode is None:
+                    evaluator.kill()
+                    await evaluator.wait()
+            return garbler_result, json.loads(output)
+
+        garbler_result, evaluator_outputs = asyncio.run(run())
+        self.assertEqual(number_output(circuit, garbler_result), a + b)
+        self.assertEqual(evaluator_outputs, [garbler_result[wire] for wire in circuit.out])
+
+    def test_table_encoding(self):
+        garbled_circuit = GarbledCircuit(MIXED, 'blake2', 8, 'half_gates')
+        tables = sorted(garbled_circuit.garbled_tables.items())
+        self.assertEqual(runtime.decode_tables(runtime.encode_tables(tables), 'half_gates', 8), tables)
+
+    def test_different_circuits(self):
+        garbler = runtime.Garbler(ADDER, {1: 0, 2: 0}, group=TEST_GROUP)
+        evaluator = runtime.Evaluator(MIXED, {3: 0}, TEST_GROUP)
+        with self.assertRaises(ValueError):
+            asyncio.run(asyncio.wait_for(self.handshake(garbler, evaluator), 10))
+
+    async def handshake(self, garbler, evaluator):
+        garbler_socket, evaluator_socket = socket.socketpair()
+        garbler_stream = await asyncio.open_connection(sock=garbler_socket)
+        evaluator_stream = await asyncio.open_connection(sock=evaluator_socket)
+        garbler_task = asyncio.create_task(garbler.run(*garbler_stream))
+        try:
+            await evaluator.run(*evaluator_stream)
+        finally:
+            garbler_task.cancel()
+            for _, writer in (garbler_stream, evaluator_stream):
+                writer.close()
+
+
+def number_inputs(circuit: Circuit, a: int, b: int) -> dict[int, int]:
+    """Little-endian bits of a on Alice's wires and of b on Bob's wires."""
+    return {**{wire: a >> i & 1 for i, wire in enumerate(circuit.alice)}, **{wire: b >> i & 1 for i, wire in enumerate(circuit.bob)}}
+
+
+def number_output(circuit: Circuit, outputs: dict[int, int]) -> int:
+    return sum(outputs[wire] << i for i, wire in enumerate(circuit.out))
+
+
+class BenchmarkTests(unittest.TestCase):
+    def test_circuit_families(self):
+        functions = {
+            'adder': lambda a, b: a + b,
+            'and': lambda a, b: a & b,
+            'comparator': lambda a, b: int(a > b),
+            'millionaire': lambda a, b: int(a >= b),
+            'multiplier': lambda a, b: a * b,
+        }
+        for family, function in functions.items():
+            circuit = benchmark.FAMILIES[family](4)
+            for a, b in product(range(16), repeat=2):
+                outputs = simulate(circuit, number_inputs(circuit, a, b), 1)
+                self.assertEqual(number_output(circuit, outputs), function(a, b), (family, a, b))
+
+    def test_run_and_compare(self):
+        results = benchmark.run(['adder'], [4], [('xor', 1, 'free_xor'), ('blake2', 16, 'half_gates')], repeat=1)
+        self.assertEqual([(r.encryption_method, r.gates) for r in results], [('xor', 17), ('blake2', 17)])
+        # the level evaluator only runs with the xor method
+        self.assertGreater(results[0].levels_gates_per_second, 0)
+        self.assertEqual(results[1].levels_gates_per_second, 0)
+        baseline = json.loads(json.dumps(benchmark.to_json(results)))
+        self.assertEqual(benchmark.compare(results, baseline), [])
+        slower = [result._replace(garble_gates_per_second=result.garble_gates_per_second / 2, bytes_per_gate=result.bytes_per_gate + 1)
+                for result in results]
+        regressions = benchmark.compare(slower, baseline)
+        self.assertEqual(len(regressions), 4)
+        self.assertIn('garble_gates_per_second', regressions[0])
+
+
+class BuilderTests(unittest.TestCase):
+    OPERATIONS = {
+        'add': (lambda builder, a, b: builder.add(a, b), lambda a, b, n: (a + b) % 2**n),
+        'add_carry': (lambda builder, a, b: builder.add(a, b, carry_out=True), lambda a, b, n: a + b),
+        'sub': (lambda builder, a, b: builder.sub(a, b), lambda a, b, n: (a - b) % 2**n),
+        'lt': (lambda builder, a, b: builder.lt(a, b), lambda a, b, n: int(a < b)),
+        'gt': (lambda builder, a, b: builder.gt(a, b), lambda a, b, n: int(a > b)),
+        'geq': (lambda builder, a, b: builder.geq(a, b), lambda a, b, n: int(a >= b)),
+        'leq': (lambda builder, a, b: builder.leq(a, b), lambda a, b, n: int(a <= b)),
+        'eq': (lambda builder, a, b: builder.eq(a, b), lambda a, b, n: int(a == b)),
+        'neq': (lambda builder, a, b: builder.neq(a, b), lambda a, b, n: int(a != b)),
+        'mul': (lambda builder, a, b: builder.mul(a, b), lambda a, b, n: a * b),
+        'mux': (lambda builder, a, b: builder.mux(a[0], a, b), lambda a, b, n: b if a & 1 else a),
+    }
+
+    def build(self, name, n):
+        builder = CircuitBuilder(name)
+        build, _ = self.OPERATIONS[name]
+        builder.output(build(builder, builder.alice_input(n), builder.bob_input(n)))
+        return builder.build()
+
+    def test_operations(self):
+        for name, (_, function) in self.OPERATIONS.items():
+            for n in (1, 2, 3):
+                circuit = self.build(name, n)
+                for a, b in product(range(2**n), repeat=2):
+                    outputs = simulate(circuit, number_inputs(circuit, a, b), 1)
+                    self.assertEqual(number_output(circuit, outputs), function(a, b, n), (name, n, a, b))
+
+    def test_non_free_gates(self):
+        expected = {'add': 7, 'add_carry': 8, 'sub': 7, 'lt': 8, 'gt': 8, 'geq': 8, 'eq': 7, 'neq': 7, 'mux': 8}
+        for name, count in expected.items():
+            circuit = self.build(name, 8)
+            self.assertEqual(sum(gate.type not in ('XOR', 'XNOR') for gate in circuit.gates), count, name)
+        self.assertEqual(len(topological_levels(self.build('eq', 8))), 4) # XNOR then 3 levels of ANDs
+
+    def test_garbled(self):
+        circuit = self.build('sub', 4)
+        garbled_circuit = GarbledCircuit(circuit, 'blake2', 16, 'half_gates')
+        inputs = number_inputs(circuit, 3, 9)
+        self.assertEqual(number_output(circuit, garbled_evaluate(garbled_circuit, inputs)), (3 - 9) % 16)
+
+
+class OptimizerTests(unittest.TestCase):
+    REDUNDANT = Circuit(name="REDUNDANT", alice=[1,2], bob=[3], out=[8,9,10,11,2], gates=[
+        Gate(4, "NAND", [1,1]), # NOT 1
+        Gate(5, "AND", [4,2]),
+        Gate(6, "AND", [2,4]), # duplicate of 5
+        Gate(7, "XOR", [1,1]), # constant 0
+        Gate(8, "OR", [7,5]), # copy of 5
+        Gate(9, "NOT", [6]),
+        Gate(10, "XNOR", [7,7]), # constant 1
+        Gate(11, "NAND", [3,7]), # constant 1
+        Gate(12, "AND", [1,3]), # dead
+    ])
+
+    def test_redundant(self):
+        optimized, report = optimize(self.REDUNDANT)
+        self.assertTrue(equivalent(self.REDUNDANT, optimized))
+        self.assertEqual((report.gates_before, report.non_free_before), (9, 6))
+        # GEQ(2, 1) and the constant, NOT GEQ has no gate type of its own
+        self.assertEqual(sorted(gate.type for gate in optimized.gates), ['GEQ', 'NOT', 'XNOR'])
+        self.assertEqual(report.non_free_after, 1)
+        self.assertEqual((report.merged, report.dead), (2, 1))
+        self.assertEqual(optimized.out[4], 2)
+        self.assertEqual([gate.id for gate in optimized.gates][0], 5)
+
+    def test_inverters_absorbed(self):
+        builder = CircuitBuilder('inverted')
+        (a,), (b,) = builder.alice_input(), builder.bob_input()
+        builder.output(builder.and_(builder.not_(a), builder.not_(b)))
+        builder.output(builder.xor(builder.not_(a), b))
+        optimized, report = optimize(builder.build())
+        self.assertTrue(equivalent(builder.build(), optimized))
+        self.assertEqual([gate.type for gate in optimized.gates], ['NOR', 'XNOR'])
+        self.assertEqual(report.non_free_after, 1)
+
+    def test_equivalent(self):
+        for family, function in benchmark.FAMILIES.items():
+            for n in (1, 3, 8):
+                circuit = function(n)
+                optimized, report = optimize(circuit)
+                self.assertTrue(equivalent(circuit, optimized), circuit.name)
+                self.assertLessEqual(report.gates_after, report.gates_before)
+        circuit = load_bristol(BRISTOL_ADDER, 'adder', compact=False)
+        self.assertTrue(equivalent(circuit, optimize(circuit)[0]))
+
+    def test_truth_tables(self):
+        for table, (gate_type, swap, negated) in CANONICAL.items():
+            for x, y in product((0, 1), repeat=2):
+                inputs = (y, x) if swap else (x, y)
+                self.assertEqual(bool(GateFunctions[gate_type](*inputs)) ^ negated, bool(table >> (2*x + y) & 1))
+        self.assertEqual(len(CANONICAL), 10) # every function of two inputs depending on both
 
+    def test_garbled(self):
+        optimized, _ = optimize(self.REDUNDANT)
+        garbled_circuit = GarbledCircuit(optimized, 'blake2', 16, 'half_gates')
+        for inputs in all_inputs(optimized):
+            self.assertEqual([garbled_evaluate(garbled_circuit, inputs)[wire] for wire in optimized.out],
+                    [plain_evaluate(self.REDUNDANT, inputs)[wire] for wire in self.REDUNDANT.out])
 
 
 if __name__ == '__main__':
@@ -1,8 +1,7 @@
 from random import randint, getrandbits 
-from hashlib import sha512
+from hashlib import sha512, shake_256
 from secrets import token_bytes, randbits
-from math import ceil
-import operator
+from math import ceil, gcd, isqrt
 
 def flip_coin() -> int:
     return randint(0,1)
@@ -10,12 +9,18 @@ def flip_coin() -> int:
 def gen_label(kappa: int) -> bytes:
     return token_bytes(kappa)
 
-def encode(key:bytes, pbit:int, kappa: int) -> bytes:
+def prf(seed: bytes, domain: bytes, index: int, size: int) -> bytes:
+    """Derive 'size' pseudo-random bytes from a secret seed, a domain and an index."""
+    return shake_256(seed + domain + index.to_bytes(8, 'big', signed=True)).digest(size)
+
+def encode(key:bytes, pbit:int, kappa: int, padding: int | None = None) -> bytes:
     assert len(key) == kappa # Key must be one bit smaller than kappa because it must fit pbit
     assert pbit == 0 or pbit == 1
     # pad pbit with random bits
+    if padding is None:
+        padding = getrandbits(7-1)
     
-    pbit_padded = (getrandbits(7-1) << 1 | pbit).to_bytes(1, 'big')
+    pbit_padded = (padding << 1 | pbit).to_bytes(1, 'big')
     encoded = key + pbit_padded
     assert len(encoded) == kappa + 1
     return encoded
@@ -28,22 +33,6 @@ def decode(value:bytes, kappa: int) -> tuple[bytes, int]:
     assert pbit == 1 or pbit == 0
     return label, pbit
 
-def encrypt(index:int, key_one: bytes, key_two: bytes, value: bytes, method: str, kappa: int) -> bytes:
-    if method == 'xor':
-        return encrypt_xor(key_two, encrypt_xor(key_one, value, kappa), kappa)
-    elif method == 'hash':
-        return encrypt_hash(index, key_one, key_two, value, kappa)
-    else:
-        raise Exception('Unknown method')
-
-def decrypt(index:int, key_one: bytes, key_two: bytes, value: bytes, method: str, kappa: int) -> bytes:
-    if method == 'xor':
-        return encrypt_xor(key_two, encrypt_xor(key_one, value, kappa), kappa)
-    elif method == 'hash':
-        return encrypt_hash(index, key_one, key_two, value, kappa)
-    else:
-        raise Exception('Unknown method')
-
 def encrypt_xor(key: bytes, value: bytes, kappa: int) -> bytes:
     assert len(key) == kappa
     assert len(value) == 2*kappa
@@ -64,6 +53,12 @@ def derive_key(index: int, key_one: bytes, key_two: bytes, kappa: int) -> int:
     key_int = key_int >> 2
     return key_int 
 
+def hash_label(index: int, label: bytes, kappa: int) -> bytes:
+    """Hash a label together with a gate dependent tweak to kappa+1 bytes."""
+    assert kappa + 1 <= sha512().digest_size
+    preimage = index.to_bytes(ceil(index.bit_length()/8), 'big') + label
+    return sha512(preimage).digest()[:kappa+1]
+
 def encrypt_hash(index: int, key_one: bytes, key_two: bytes, value: bytes, kappa: int) -> bytes:
     key_int = derive_key(index, key_one, key_two, kappa)
     value_int = int.from_bytes(value, byteorder='big')
@@ -80,12 +75,30 @@ def decrypt_hash(index: int, key_one: bytes, key_two: bytes, value: bytes, kappa
     # print(f"key = {int(key_int)} len(value) = {len(value)} result bitlen = {result.bit_length()}")
     return result.to_bytes(kappa+1, 'big', signed=False)
 
+SMALL_PRIMES = [2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97]
+
 def gen_prime(num_bits: int) -> int:
     """Return random prime of bit size 'num_bits'"""
     r = randbits(num_bits)
     return next_prime(r)
 
+def gen_safe_prime(num_bits: int) -> int:
+    """Return a random safe prime p = 2q + 1 of bit size 'num_bits', q prime."""
+    if num_bits < 3:
+        raise ValueError("Safe primes have at least 3 bits")
+    while True:
+        q = randbits(num_bits - 1) | 1 << (num_bits - 2) | 1
+        p = 2*q + 1
+        # p and q are both prime only if neither has a small factor other than themselves
+        if any(q % f == 0 and q != f or p % f == 0 and p != f for f in SMALL_PRIMES):
+            continue
+        # 2^(p-1) = 1 with q prime proves p prime (Pocklington), so test q thoroughly
+        if pow(2, p - 1, p) == 1 and is_prime(q):
+            return p
+
 def next_prime(n: int) -> int:
+    if n <= 2:
+        return 2
     if n % 2 == 0:
         n += 1
     while not is_prime(n):
@@ -93,17 +106,120 @@ def next_prime(n: int) -> int:
     return n
 
 def is_prime(n: int) -> bool:
-    if n == 2:
-        return True
-    if n < 2 or n % 2 == 0:
+    """Baillie-PSW test: strong probable prime to base 2 and strong Lucas probable prime.
+
+    No composite passing both is known, and there is none below 2^64.
+    """
+    if n < 2:
         return False
-    for _ in range(3, int(n**0.5)+1, 2):
-        if n % _ == 0:
-            return False
-    return True
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return n == p
+    return is_strong_probable_prime(n, 2) and is_strong_lucas_probable_prime(n)
+
+def is_strong_probable_prime(n: int, base: int) -> bool:
+    """Miller-Rabin round for an odd n."""
+    d, s = n - 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+    x = pow(base, d, n)
+    if x == 1 or x == n - 1:
+        return True
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+def jacobi(a: int, n: int) -> int:
+    """Jacobi symbol (a/n) for an odd positive n."""
+    a %= n
+    result = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+def is_strong_lucas_probable_prime(n: int) -> bool:
+    """Strong Lucas test for an odd n with Selfridge's parameters P = 1, Q = (1-D)/4."""
+    if isqrt(n) ** 2 == n:
+        return False # no D with (D/n) = -1 exists
+    D = 5
+    while jacobi(D, n) != -1:
+        D = -D - 2 if D > 0 else -D + 2
+    P, Q = 1, (1 - D) // 4
+    d, s = n + 1, 0
+    while d % 2 == 0:
+        d, s = d // 2, s + 1
+
+    def half(x: int) -> int:
+        return (x + n if x & 1 else x) // 2 % n
+
+    # U_k, V_k and Q^k from k = 1 up to d, doubling then incrementing k bit by bit
+    U, V, Qk = 1, P, Q % n
+    for bit in bin(d)[3:]:
+        U, V, Qk = U * V % n, (V * V - 2 * Qk) % n, Qk * Qk % n
+        if bit == '1':
+            U, V, Qk = half(P * U + V), half(D * U + P * V), Qk * Q % n
+    if U == 0 or V == 0:
+        return True
+    for _ in range(s - 1):
+        V, Qk = (V * V - 2 * Qk) % n, Qk * Qk % n
+        if V == 0:
+            return True
+    return False
+
+def prime_factors(n: int) -> list[int]:
+    """Distinct prime factors of n, in increasing order (trial division, then Pollard's rho)."""
+    factors = set()
+    for p in SMALL_PRIMES:
+        while n % p == 0:
+            factors.add(p)
+            n //= p
+    pending = [n] if n > 1 else []
+    while pending:
+        m = pending.pop()
+        if is_prime(m):
+            factors.add(m)
+        else:
+            f = pollard_rho(m)
+            pending += [f, m // f]
+    return sorted(factors)
+
+def pollard_rho(n: int) -> int:
+    """Return a non-trivial factor of a composite n without small factors (Brent's variant)."""
+    for c in range(1, n):
+        y, r, q, g = 2, 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(128, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = gcd(q, n)
+                k += 128
+            r *= 2
+        if g == n: # the batched product hit 0, retrace step by step
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = gcd(abs(x - ys), n)
+        if g != n:
+            return g
+    raise ValueError(f"No factor found for {n}")
 
 def xor_bytes(seq1: bytes, seq2: bytes) -> bytes:
     """XOR two byte sequence."""
     assert len(seq1) == len(seq2)
-    return bytes(map(operator.xor, seq1, seq2))
+    return (int.from_bytes(seq1, 'big') ^ int.from_bytes(seq2, 'big')).to_bytes(len(seq1), 'big')
 
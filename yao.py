@@ -1,6 +1,49 @@
-from circuit import Circuit, Id, Label
-from garbled_circuit import GarbledTable
-from utils import decrypt, decode
+import numpy as np
+
+from circuit import Circuit, Gate, Id, Label
+from garbled_circuit import GarbledTable, UNARY_GATES, is_free
+from cipher import CipherBackend, get_backend
+from plan import EvaluationPlan, FORWARD, FREE_XOR, get_levels, get_plan
+import instrument
+from utils import decode, xor_bytes
+
+
+def evaluate_gate(gate: Gate,
+        garbled_tables: dict[Id, GarbledTable],
+        wire_inputs: dict[Id, tuple[Label, int]],
+        backend: CipherBackend,
+        scheme: str = 'classic') -> tuple[Label, int]:
+    """Evaluate a single garbled gate.
+    Returns:
+        The (key, encr_bit) pair of the gate's output wire.
+    """
+    gate_id, gate_in = gate.id, gate.inputs
+    # NOT and BUF gates forward the key, the garbler swapped the keys of a NOT output
+    if gate.type in UNARY_GATES:
+        return wire_inputs[gate_in[0]]
+    key_a, encr_bit_a = wire_inputs[gate_in[0]]
+    key_b, encr_bit_b = wire_inputs[gate_in[1]]
+    if is_free(gate, scheme):
+        return xor_bytes(key_a, key_b), encr_bit_a ^ encr_bit_b
+    if scheme == 'half_gates':
+        table = garbled_tables[gate_id]
+        return evaluate_half_gates(gate_id, table[(0,)], table[(1,)], key_a + bytes([encr_bit_a]), key_b + bytes([encr_bit_b]), backend)
+
+    encr_msg = garbled_tables[gate_id][(encr_bit_a, encr_bit_b)]
+    msg = backend.decrypt(gate_id, key_a, key_b, encr_msg)
+    return decode(msg, backend.kappa)
+
+
+def evaluate_half_gates(gate_id: Id, table_g: bytes, table_e: bytes, key_a: bytes, key_b: bytes, backend: CipherBackend) -> tuple[Label, int]:
+    """Evaluate the two rows of a half-gates table given the input keys extended with their encrypted bit."""
+    key_g = backend.hash_label(2*gate_id, key_a)
+    if key_a[-1]:
+        key_g = xor_bytes(key_g, table_g)
+    key_e = backend.hash_label(2*gate_id+1, key_b)
+    if key_b[-1]:
+        key_e = xor_bytes(key_e, xor_bytes(table_e, key_a))
+    key_out = xor_bytes(key_g, key_e)
+    return key_out[:-1], key_out[-1] & 1
 
 
 def evaluate(circuit: Circuit, 
@@ -9,42 +52,113 @@ def evaluate(circuit: Circuit,
         a_inputs: dict[Id, tuple[Label, int]], 
         b_inputs: dict[Id, tuple[Label, int]], 
         encryption_method: str,
-        kappa: int):
+        kappa: int,
+        scheme: str = 'classic'):
     """Evaluate yao circuit with given inputs.
     Args:
-        circuit: A dict containing circuit spec.
+        circuit: A dict containing circuit spec, a Circuit or CompactCircuit.
         g_tables: The yao circuit garbled tables.
         pbits_out: The pbits of outputs.
         a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
         b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: The garbling scheme the circuit was garbled with.
     Returns:
         A dict mapping output wires with their result bit.
+
+    The per-circuit work (ordering, wire slots, table layout) comes from a cached
+    plan.EvaluationPlan, so repeated sessions of one circuit only flatten their tables.
     """
-    gates = circuit.gates  # dict containing circuit gates
-    wire_outputs = circuit.out  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g.id):
-        gate_id, gate_in, msg = gate.id, gate.inputs, None
-        # Special case if it's a NOT gate
-        key_a, encr_bit_a = wire_inputs[gate_in[0]]
-        key_b, encr_bit_b = wire_inputs[gate_in[1]]
-        encr_msg = garbled_tables[gate_id][(encr_bit_a, encr_bit_b)]
-        msg = decrypt(gate.id, key_a, key_b, encr_msg, encryption_method, kappa)
-        if msg:
-            pickled = decode(msg, kappa)
-            wire_inputs[gate_id] = pickled
-
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        wire_input = wire_inputs[out][1]
-        pbit_out = pbits_out[out]
-        evaluation[out] = wire_input ^ pbit_out
-
-    return evaluation
+    with instrument.phase('evaluate.plan'):
+        plan = get_plan(circuit, scheme)
+        backend = get_backend(encryption_method, kappa)
+        rows = plan.rows(garbled_tables, kappa + 1)
+    with instrument.phase('evaluate.gates'):
+        labels = evaluate_plan(plan, rows, a_inputs, b_inputs, backend)
+
+    recorder = instrument.active
+    if recorder is not None:
+        recorder.gates_done('evaluated', (gate.type for gate in circuit.gates), len(rows), plan.n_slots,
+                plan.n_slots * (kappa + 1))
+    return {out: labels[slot][1] ^ pbits_out[out] for out, slot in plan.outputs}
+
+
+def evaluate_plan(plan: EvaluationPlan, rows: bytes | memoryview, a_inputs: dict[Id, tuple[Label, int]], b_inputs: dict[Id, tuple[Label, int]],
+        backend: CipherBackend) -> list[tuple[Label, int]]:
+    """Run the steps of a plan over the rows buffer of EvaluationPlan.rows and return the (key, encr_bit) pair of every slot."""
+
+    labels: list[tuple[Label, int] | None] = [None] * plan.n_slots
+    for inputs in (a_inputs, b_inputs):
+        for wire, label in inputs.items():
+            labels[plan.inputs[wire]] = label
+
+    half_gates = plan.scheme == 'half_gates'
+    stride = backend.kappa + 1
+    for kind, gate_id, out, in_a, in_b, row in plan.steps:
+        if kind == FORWARD:
+            labels[out] = labels[in_a]
+            continue
+        key_a, encr_bit_a = labels[in_a]
+        key_b, encr_bit_b = labels[in_b]
+        if kind == FREE_XOR:
+            labels[out] = xor_bytes(key_a, key_b), encr_bit_a ^ encr_bit_b
+        elif half_gates:
+            start = row * stride
+            labels[out] = evaluate_half_gates(gate_id, rows[start:start+stride], rows[start+stride:start+2*stride],
+                    key_a + bytes([encr_bit_a]), key_b + bytes([encr_bit_b]), backend)
+        else:
+            start = (row + 2*encr_bit_a + encr_bit_b) * stride
+            labels[out] = decode(backend.decrypt(gate_id, key_a, key_b, rows[start:start+stride]), backend.kappa)
+    return labels
+
+
+def evaluate_levels(circuit: Circuit,
+        garbled_tables: dict[Id, GarbledTable],
+        pbits_out: dict[Id, int],
+        a_inputs: dict[Id, tuple[Label, int]],
+        b_inputs: dict[Id, tuple[Label, int]],
+        encryption_method: str,
+        kappa: int,
+        scheme: str = 'classic'):
+    """Evaluate yao circuit level by level with NumPy, see evaluate for the arguments.
+
+    All the keys are kept in one uint8 array of shape (slots, kappa+1) holding each key
+    followed by its encrypted bit. The slot arrays of every level come from the cached
+    plan (plan.get_levels), and a level is evaluated with a few gathers and XORs over
+    all its gates, reading only the selected row of each table from the flat rows of
+    EvaluationPlan.rows. Levels cost a constant overhead, so this pays off on wide
+    circuits; evaluate is faster on deep, narrow ones. Only the 'xor' method with the
+    classic and free_xor schemes is supported.
+    """
+    if encryption_method != 'xor' or scheme not in ('classic', 'free_xor'):
+        raise ValueError("Level evaluation requires the 'xor' method and the classic or free_xor scheme")
+
+    with instrument.phase('evaluate.levels'):
+        plan, levels = get_levels(circuit, scheme)
+        stride = kappa + 1
+        rows = np.frombuffer(plan.rows(garbled_tables, stride), dtype=np.uint8).reshape(-1, stride)
+        inputs = {**a_inputs, **b_inputs}
+        labels = np.empty((plan.n_slots, stride), dtype=np.uint8)
+        slots = list(map(plan.inputs.__getitem__, inputs))
+        keys, encr_bits = zip(*inputs.values()) if inputs else ((), ())
+        labels[slots, :kappa] = np.frombuffer(b''.join(keys), dtype=np.uint8).reshape(-1, kappa)
+        labels[slots, kappa] = encr_bits
+
+        for forward, free, table in levels:
+            if forward.shape[1]:
+                labels[forward[0]] = labels[forward[1]]
+            if free.shape[1]:
+                labels[free[0]] = labels[free[1]] ^ labels[free[2]]
+            if table.shape[1]:
+                keys_a, keys_b = labels[table[1]], labels[table[2]]
+                selected = rows[table[3] + 2*keys_a[:, kappa] + keys_b[:, kappa]]
+                # the 'xor' pad of a key is the key followed by its last byte
+                keys_a[:, kappa] = keys_a[:, kappa-1]
+                keys_b[:, kappa] = keys_b[:, kappa-1]
+                selected ^= keys_a
+                selected ^= keys_b
+                selected[:, kappa] &= 1
+                labels[table[0]] = selected
 
+    outputs = [out for out, _ in plan.outputs]
+    bits = labels[[slot for _, slot in plan.outputs], kappa].tolist()
+    return {out: bit ^ pbits_out[out] for out, bit in zip(outputs, bits)}